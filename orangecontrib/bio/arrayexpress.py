@@ -2,7 +2,6 @@ from __future__ import absolute_import, print_function
 
 import os
 import re
-import shelve
 import shutil
 import posixpath
 import json
@@ -21,7 +20,7 @@ except ImportError:
 import io
 import six
 
-from orangecontrib.bio.utils import serverfiles
+from orangecontrib.bio.utils import serverfiles, httpcache
 
 parse_json = json.load
 
@@ -60,33 +59,26 @@ ARRAYEXPRESS_FIELDS = \
      ]
 
 
-def _open_shelve(filename, flag="r"):
-    dirname = os.path.dirname(filename)
-    if not os.path.isdir(dirname):
-        os.makedirs(dirname)
-    exists = os.path.exists(filename)
-    if flag in ["r", "w"] and not exists:
-        # needs to be created first
-        # XXX: Race condition
-        s = shelve.open(filename, "c")
-        s.close()
-
-    return shelve.open(filename, flag)
-
-
 class ArrayExpressConnection(object):
     """
     Constructs and runs REST query on ArrayExpress.
 
     :param address: Address of the ArrayExpress API.
     :param timeout: Timeout for the connection.
+    :param cache: A response cache directory, an
+        :class:`~.utils.httpcache.HTTPCache` or a dict like object
+        (default: :obj:`DEFAULT_CACHE`).
 
     """
 
     DEFAULT_ADDRESS = "http://www.ebi.ac.uk/arrayexpress/{format}/v2/"
     DEFAULT_FORMAT = "json"
-    DEFAULT_CACHE = serverfiles.localpath(
-        "ArrayExpress", "ArrayExpressCache.shelve")
+    DEFAULT_CACHE = serverfiles.localpath("ArrayExpress", "http-cache")
+    #: The size budget (in bytes) of the default response cache.
+    DEFAULT_CACHE_SIZE = 2 ** 30
+    #: Time (in seconds) after which the responses in the default cache
+    #: are revalidated with the server.
+    DEFAULT_CACHE_TTL = 24 * 60 * 60
 
     # Order of arguments in the query
     _ARGS_ORDER = ["keywords", "species", "array"]
@@ -260,26 +252,30 @@ class ArrayExpressConnection(object):
                          (accession, kind))
 
     def _cache_urlopen(self, url, timeout=30):
-        if self.cache is not None:
-            with self.open_cache("r") as cache:
-                if url in cache:
-                    return io.BytesIO(cache[url])
-
-            stream = urlopen(url, timeout=timeout)
-            data = stream.read()
-            with self.open_cache("w") as cache:
-                cache[url] = data
-
-            return io.BytesIO(data)
-        else:
+        if self.cache is None:
             return urlopen(url, timeout=timeout)
 
+        with self.open_cache("w") as cache:
+            if isinstance(cache, httpcache.HTTPCache):
+                return cache.urlopen(url, timeout=timeout)
+            if url not in cache:
+                cache[url] = urlopen(url, timeout=timeout).read()
+            return io.BytesIO(cache[url])
+
     def open_cache(self, flag="r"):
+        """
+        Return a context manager for the cache (an
+        :class:`~.utils.httpcache.HTTPCache` or a dict like object).
+        """
         if isinstance(self.cache, six.string_types):
             try:
-                return closing(_open_shelve(self.cache, flag))
+                return _fake_closing(httpcache.shared(
+                    self.cache, max_size=self.DEFAULT_CACHE_SIZE,
+                    ttl=self.DEFAULT_CACHE_TTL))
             except Exception:
                 return _fake_closing({})
+        elif isinstance(self.cache, httpcache.HTTPCache):
+            return _fake_closing(self.cache)
         elif hasattr(self.cache, "close"):
             return closing(self.cache)
         elif self.cache is None:
@@ -3,28 +3,24 @@ from __future__ import print_function
 import os
 import errno
 import sys
-import shelve
 import itertools
 import warnings
 import io
+import copy
 
 from functools import wraps, reduce
 from collections import namedtuple
 from operator import itemgetter
-from contextlib import closing
 from xml.dom import pulldom
+from multiprocessing.pool import ThreadPool
 
 
 if sys.version_info < (3,):
     from urllib2 import HTTPError, urlopen, quote
-    from urllib import addinfourl
-    import anydbm
 else:
     from urllib.request import urlopen
-    from urllib.response import addinfourl
     from urllib.parse import quote
     from urllib.error import HTTPError
-    import dbm as anydbm
 
 import six
 
@@ -33,6 +29,8 @@ try:
 except ImportError:
     from .utils import environ
 
+from .utils import httpcache
+
 
 class BioMartError(Exception):
     pass
@@ -217,7 +215,7 @@ def drop_iter(generator):
             try:
                 yield next(generator)
             except StopIteration:
-                raise StopIteration
+                return
             except Exception as ex:
                 warnings.warn("An error occured during iteration:\n%s" %
                               str(ex), UserWarning, stacklevel=2)
@@ -233,15 +231,15 @@ def ensure_dir_exists(name, mode=0o777):
 
 DEFAULT_ADDRESS = "http://www.biomart.org/biomart/martservice"
 
-# The cache is python version depended (due to use of pickle)
-_PY_TAG = "py{0.major}.{0.minor}".format(sys.version_info)
-_CACHE_VER = 3  # Cache structure version
-_CACHE_TAG = "v{}-{}".format(_CACHE_VER, _PY_TAG)
+#: The default (shared) response cache directory.
+HTTP_CACHE = os.path.join(environ.buffer_dir, "biomart-http-cache")
 
-DATA_CACHE = os.path.join(environ.buffer_dir,
-                          "biomart-data.cache.{}.db".format(_CACHE_TAG))
-META_CACHE = os.path.join(environ.buffer_dir,
-                          "biomart-mata.cache.{}.db".format(_CACHE_TAG))
+#: The default response cache size budget (in bytes).
+HTTP_CACHE_SIZE = 2 ** 30
+
+#: Time (in seconds) after which the responses in the default cache are
+#: revalidated with the server.
+HTTP_CACHE_TTL = 24 * 60 * 60
 
 
 def checkBioMartServerError(response):
@@ -262,42 +260,27 @@ class BioMartConnection(object):
     >>> response = connection.registry()
     >>> response = connection.datasets(mart="ensembl")
 
-    """
-    _Response = namedtuple("Response", ["data", "headers", "url", "code"])
+    :param cache: A :class:`~.utils.httpcache.HTTPCache` for the
+        responses (default: a cache in :obj:`HTTP_CACHE` shared by all
+        connections).
 
+    """
     FOLLOW_REDIRECTS = False
 
-    def __init__(self, address=None, timeout=30):
+    def __init__(self, address=None, timeout=30, cache=None):
 
         self.address = address if address is not None else DEFAULT_ADDRESS
         self.timeout = timeout
+        self.cache = cache
         self._error_cache = {}
 
-    def _get_cache_for_args(self, kwargs):
-        if "type" in kwargs:
-            return self._open_meta_cache
-        elif "query" in kwargs:
-            return self._open_data_cache
-        else:
-            raise ValueError
-
-    def _open_data_cache(self, flag="r"):
-        return self._open_cache(DATA_CACHE, flag=flag)
-
-    def _open_meta_cache(self, flag="r"):
-        return self._open_cache(META_CACHE, flag=flag)
-
-    def _open_cache(self, filename, flag="r"):
-        # Ensure the cache db actualy exists (r,w flags do not create it)
-        ensure_dir_exists(os.path.dirname(filename))
-        if flag in ["r", "w"]:
-            try:
-                return shelve.open(filename, flag)
-            except anydbm.error:
-                shelve.open(filename, "c").close()
-                return shelve.open(filename, flag)
-        else:
-            return shelve.open(filename, flag)
+    def http_cache(self):
+        """ Return the response cache (:class:`~.utils.httpcache.HTTPCache`).
+        """
+        if self.cache is not None:
+            return self.cache
+        return httpcache.shared(HTTP_CACHE, max_size=HTTP_CACHE_SIZE,
+                                ttl=HTTP_CACHE_TTL)
 
     def request_url(self, **kwargs):
         order = ["type", "dataset", "mart", "virtualSchema", "query"]
@@ -311,55 +294,26 @@ class BioMartConnection(object):
 
         return self.address + "?" + query
 
+    def stream(self, **kwargs):
+        """ Open the request (bypassing the cache) and return the response
+        as a file like object to be read incrementally.
+        """
+        return urlopen(self.request_url(**kwargs), timeout=self.timeout)
+
     def request(self, **kwargs):
         url = self.request_url(**kwargs)
-        cache_key = url
-
-        if sys.version_info >= (3,) and isinstance(url, bytes):
-            cache_key = url.decode("latin-1")
-        elif sys.version_info < (3,) and isinstance(url, unicode):
-            cache_key = url.encode("utf-8")
-
-        if cache_key in self._error_cache:
-            raise self._error_cache[cache_key]
-
-        cache_open = self._get_cache_for_args(kwargs)
-
-        with closing(cache_open(flag="r")) as cache:
-            response = cache.get(cache_key, None)
-
-        if response is not None:
-            rtype, rargs = response
-            if rtype == "Success":
-                response = BioMartConnection._Response(*rargs)
-            elif rtype == "Failure":
-                raise BioMartError(*rargs)
-            else:
-                assert False
-
-        if response is None:
-            try:
-                reply = urlopen(url, timeout=self.timeout)
-                headers = reply.headers
-                data = reply.read()
-            except HTTPError as err:
-                self._error_cache[url] = err
-                raise
-            else:
-                response = self._Response(data, headers, reply.url, reply.code)
-                try:
-                    checkBioMartServerError(data)
-                except Exception as err:
-                    # TODO: Which (if any) errors can and should be
-                    # cached persistently?
-                    self._error_cache[url] = err
-                    raise
 
-            with closing(cache_open(flag="w")) as cache:
-                cache[cache_key] = ("Success", tuple(response))
+        if url in self._error_cache:
+            raise self._error_cache[url]
 
-        return addinfourl(io.BytesIO(response.data), response.headers,
-                          response.url, response.code)
+        try:
+            return self.http_cache().urlopen(
+                url, timeout=self.timeout, validate=checkBioMartServerError)
+        except (HTTPError, BioMartError) as err:
+            # TODO: Which (if any) errors can and should be
+            # cached persistently?
+            self._error_cache[url] = err
+            raise
 
     def registry(self, **kwargs):
         return self.request(type="registry")
@@ -377,12 +331,7 @@ class BioMartConnection(object):
         return self.request(type="configuration", dataset=dataset, **kwargs)
 
     def clear_cache(self):
-        with closing(self._open_data_cache(flag="n")):
-            pass
-
-        with closing(self._open_meta_cache(flag="n")):
-            pass
-
+        self.http_cache().clear()
         self._error_cache.clear()
 
     # Back compatibility
@@ -424,8 +373,8 @@ class BioMartRegistry(object):
         """Return a list of :obj:`BioMartVirtualSchema` instances representing
         each schema.
         """
-        schemas = [schema.attributes.get(name, "default")
-                   for name in self.registry.elements("virtualSchema")]
+        schemas = [schema.attributes.get("name", "default")
+                   for schema in self.registry.elements("virtualSchema")]
         if not schemas:
             schemas = [BioMartVirtualSchema(self.registry, name="default",
                                             connection=self.connection)]
@@ -1134,6 +1083,216 @@ class BioMartQuery(object):
         get_table = get_example_table
 
 
+class BioMartQueryExecutor(object):
+    """ Run a (large) TSV :obj:`BioMartQuery` in chunks.
+
+    The value list of a filter (e.g. a list of gene ids) is split into
+    chunks of `chunk_size` values which are queried concurrently by at
+    most `workers` threads. The responses are parsed incrementally into
+    columns, and each completed chunk is stored in the connection's
+    response cache so an interrupted run only repeats the missing chunks.
+
+    :param BioMartQuery query: The query to run.
+    :param str chunk_filter: Name of the filter to split (default: the
+        filter with the longest list of values).
+    :param int chunk_size: The number of filter values in a chunk.
+    :param int workers: The maximum number of concurrent requests.
+    :param bool cache: Use the response cache.
+
+    >>> query = BioMartQuery(connection, dataset="hsapiens_gene_ensembl",
+    ...                      attributes=["ensembl_gene_id",
+    ...                                  "external_gene_name"],
+    ...                      filters=[("entrezgene", entrez_ids)])
+    ...
+    >>> header, columns = BioMartQueryExecutor(query).run()
+
+    """
+    #: The placeholder for the chunked filter values in the query xml
+    PLACEHOLDER = "__chunk__"
+
+    def __init__(self, query, chunk_filter=None, chunk_size=500, workers=4,
+                 cache=True):
+        if query.format.lower() != "tsv":
+            raise BioMartError("Only TSV queries can be run in chunks")
+        self.query = query
+        self.connection = query.registry.connection
+        self.chunk_filter = chunk_filter
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.cache = cache
+
+    def _split(self):
+        # Return a copy of the query with the chunked filter values
+        # replaced by the PLACEHOLDER and a list of value chunks
+        def name(filter):
+            return getattr(filter, "internalName", filter)
+
+        candidates = [(i, j) for i, (_, _, filters) in
+                      enumerate(self.query._query)
+                      for j, (filter, value) in enumerate(filters)
+                      if isinstance(value, list) and
+                      self.chunk_filter in (None, name(filter))]
+        if self.chunk_filter is not None and not candidates:
+            raise ValueError("No filter %r with a list of values" %
+                             self.chunk_filter)
+
+        query = copy.copy(self.query)
+        query._query = [(dataset, list(attributes), list(filters))
+                        for dataset, attributes, filters in self.query._query]
+        if not candidates:
+            return query, [None]
+
+        i, j = max(candidates,
+                   key=lambda ij: len(query._query[ij[0]][2][ij[1]][1]))
+        filter, values = query._query[i][2][j]
+        query._query[i][2][j] = (filter, self.PLACEHOLDER)
+        step = self.chunk_size
+        return query, [values[k: k + step]
+                       for k in range(0, len(values), step)] or [[]]
+
+    def queries(self):
+        """ Return a list of the xml queries for all the chunks.
+        """
+        query, chunks = self._split()
+        xml = (query.xml_query(count=False, header=True)
+               .replace("\n", "").replace("\t", ""))
+        placeholder = 'value="%s"' % self.PLACEHOLDER
+        return [xml if chunk is None else
+                xml.replace(placeholder, 'value="%s"' % ",".join(chunk))
+                for chunk in chunks]
+
+    def run(self, progress_callback=None):
+        """ Run the query and return a tuple with the header (a list
+        of column names) and a list of columns (numpy object arrays of
+        strings).
+        """
+        import numpy
+
+        queries = self.queries()
+        cache = self.connection.http_cache() if self.cache else None
+        results = {}
+        pending = []
+        for i, xml in enumerate(queries):
+            body = cache.get(self._cache_key(xml)) if cache else None
+            if body is not None:
+                results[i] = parse_tsv(io.BytesIO(body))
+            else:
+                pending.append((i, xml))
+
+        def report():
+            if progress_callback is not None:
+                progress_callback(100.0 * len(results) / len(queries))
+
+        report()
+        error = None
+        if pending:
+            pool = ThreadPool(min(self.workers, len(pending)))
+            try:
+                for i, response, err in pool.imap_unordered(self._fetch,
+                                                            pending):
+                    if err is not None:
+                        error = error or err
+                        continue
+                    result, (body, headers, url, code) = response
+                    results[i] = result
+                    if cache is not None:
+                        cache.put(self._cache_key(queries[i]), body, url=url,
+                                  status=code, headers=headers)
+                    report()
+            finally:
+                pool.close()
+                pool.join()
+
+        if error is not None:
+            raise error
+
+        # concatenate the chunks in the query order
+        ordered = [results[i] for i in sorted(results)]
+        header = next((h for h, _ in ordered if h is not None), [])
+        columns = []
+        for k in range(len(header)):
+            column = numpy.empty(sum(len(cols[k]) for _, cols in ordered
+                                     if cols), dtype=object)
+            start = 0
+            for _, cols in ordered:
+                if cols:
+                    column[start: start + len(cols[k])] = cols[k]
+                    start += len(cols[k])
+            columns.append(column)
+        return header, columns
+
+    def get_table(self, progress_callback=None):
+        """ Run the query and return an :class:`Orange.data.Table`
+        with the columns as string meta attributes.
+        """
+        import numpy
+        import Orange.data
+
+        header, columns = self.run(progress_callback)
+        domain = Orange.data.Domain(
+            [], [], [Orange.data.StringVariable(name) for name in header])
+        nrows = len(columns[0]) if columns else 0
+        metas = numpy.empty((nrows, len(header)), dtype=object)
+        for k, column in enumerate(columns):
+            metas[:, k] = column
+        return Orange.data.Table.from_numpy(
+            domain, numpy.empty((nrows, 0)), metas=metas)
+
+    def _cache_key(self, xml):
+        return self.connection.request_url(query=xml)
+
+    def _fetch(self, item):
+        # Run a single chunk query (in a worker thread)
+        i, xml = item
+        try:
+            reply = self.connection.stream(query=xml)
+            lines = []
+            result = parse_tsv(reply, lines)
+            raw = (b"".join(lines), reply.headers, reply.url, reply.code)
+        except Exception as err:
+            return i, None, err
+        return i, (result, raw), None
+
+
+def parse_tsv(stream, lines=None, block_size=2 ** 16):
+    """ Parse a BioMart TSV response (with a header line) from a file like
+    `stream` incrementally. Return a tuple with the header (``None`` if
+    the response is empty) and a list of columns (lists of strings).
+    If `lines` is a list the raw lines are appended to it.
+
+    Raise :obj:`BioMartQueryError` or :obj:`BioMartError` if the response
+    is an error message.
+    """
+    header = None
+    columns = []
+    first = True
+    while True:
+        block = stream.readlines(block_size)
+        if not block:
+            break
+        if first:
+            checkBioMartServerError(block[0])
+            if block[0].startswith(b"Query ERROR:"):
+                raise BioMartQueryError(block[0] + b"".join(stream))
+            header = block[0].rstrip(b"\r\n").decode("utf-8").split("\t")
+            columns = [[] for _ in header]
+            if lines is not None:
+                lines.append(block[0])
+            block = block[1:]
+            first = False
+        if lines is not None:
+            lines.extend(block)
+
+        ncols = len(columns)
+        rows = [line.rstrip(b"\r\n").decode("utf-8").split("\t")
+                for line in block if line.strip()]
+        rows = [row if len(row) == ncols else
+                (row + [""] * ncols)[:ncols] for row in rows]
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return header, columns
+
+
 def get_pointed(self):
     if self.is_pointer():
         pointerDataset = self.pointerDataset
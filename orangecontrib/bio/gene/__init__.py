@@ -2,8 +2,10 @@ from __future__ import absolute_import
 import sys
 import os
 import time
+import hashlib
 
 from ..utils import serverfiles
+from ..utils import arraystore
 
 from .. import taxonomy as obiTaxonomy
 from .. import kegg as obiKEGG
@@ -36,6 +38,11 @@ except ImportError:
 
 from functools import reduce
 
+import numpy
+
+if sys.version_info >= (3,):
+    intern = sys.intern
+
 default_database_path = serverfiles.localpath("NCBI_geneinfo")
 
 class GeneInfo(object):
@@ -362,6 +369,14 @@ def ignore_case(gs):
     """ Transform names in sets in list to lower case """
     return [ set([a.lower() for a in g]) for g in gs ]
 
+def _intern(s):
+    return intern(s) if type(s) is str else s
+
+def _unique(genes):
+    """ Return a list of unique genes (in order of their first occurrence). """
+    seen = set()
+    return [g for g in genes if not (g in seen or seen.add(g))]
+
 def create_mapping(groups, lower=False):
     """ 
     Returns mapping of aliases to the group index. If lower
@@ -380,11 +395,11 @@ def create_mapping(groups, lower=False):
     if lower: 
         for i,group in enumerate(groups):
             for alias in group:
-                togroup[alias.lower()].add(i)
+                togroup[_intern(alias.lower())].add(i)
     else:
         for i,group in enumerate(groups):
             for alias in group:
-                togroup[alias].add(i)
+                togroup[_intern(alias)].add(i)
 
     return togroup
 
@@ -440,14 +455,84 @@ def join_sets(set1, set2, lower=False):
 
     return new
  
-def join_sets_l(lsets, lower=False):
+def join_sets_l(lsets, lower=False, pairwise=False):
     """
-    Joins multiple gene set mappings using join_sets function.
+    Joins multiple gene set mappings. If lower is True, lower case
+    forms of gene aliases are compared.
+
+    Groups of aliases (from any of the mappings) sharing at least one
+    gene are joined into connected components (see :func:`join_groups`).
+    If pairwise is True, mappings are instead joined successively with
+    the join_sets function (the former behaviour).
     """
-    current = lsets[0]
-    for b in lsets[1:]:
-        current = join_sets(current, b, lower=lower)
-    return current
+    if pairwise:
+        current = lsets[0]
+        for b in lsets[1:]:
+            current = join_sets(current, b, lower=lower)
+        return current
+    return join_groups(lsets, lower=lower)
+
+def join_groups(lsets, lower=False):
+    """
+    Join groups of aliases from a list of gene set mappings into connected
+    components of groups sharing at least one gene (with a union-find
+    structure). If lower is True, lower case forms of gene aliases are
+    compared.
+
+    As with join_sets, groups are only joined with groups from other
+    mappings. An alias that belongs to several groups of the same mapping
+    is ambiguous and does not join these groups to anything.
+
+    Components are returned in the order of their first group.
+    """
+    groups = []
+    sources = []
+    for source, sets in enumerate(lsets):
+        groups.extend(sets)
+        sources.extend([source] * len(sets))
+    parent = list(range(len(groups)))
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            # the smaller index becomes the root
+            if ri < rj:
+                parent[rj] = ri
+            else:
+                parent[ri] = rj
+
+    #alias -> {source: group index or None if owned by several groups}
+    owners = {}
+    for i, group in enumerate(groups):
+        for alias in group:
+            key = alias.lower() if lower else alias
+            bysource = owners.setdefault(key, {})
+            j = bysource.setdefault(sources[i], i)
+            if j is not None and j != i:
+                bysource[sources[i]] = None
+
+    for bysource in owners.values():
+        linked = [i for i in bysource.values() if i is not None]
+        for j in linked[1:]:
+            union(linked[0], j)
+
+    components = {}
+    order = []
+    for i, group in enumerate(groups):
+        root = find(i)
+        if root not in components:
+            components[root] = set()
+            order.append(root)
+        components[root].update(group)
+    return [components[root] for root in order]
 
 class Matcher(object):
     """
@@ -481,6 +566,19 @@ class Matcher(object):
         """
         notImplemented()
 
+    def match_many(self, genes):
+        """Return a list of matches (see :func:`match`) for each of `genes`."""
+        return self.matcho.match_many(genes)
+
+    def umatch_many(self, genes):
+        """Return unique matches for `genes` (see :func:`Match.umatch_many`)."""
+        return self.matcho.umatch_many(genes)
+
+    @property
+    def targets(self):
+        """The list of target genes (see :func:`set_targets`)."""
+        return self.matcho.targets
+
 def buffer_path():
     """ Returns buffer path from Orange's setting folder if not 
     defined differently (in gene_matcher_path). """
@@ -531,6 +629,156 @@ def auto_pickle(filename, version, func, *args, **kwargs):
 
     return output
 
+def _alias_hashes(keys):
+    """ Return stable 64 bit hashes of strings `keys` as a numpy array. """
+    digests = b"".join(hashlib.md5(k.encode("utf-8")).digest()[:8]
+                       for k in keys)
+    return numpy.frombuffer(digests, dtype="<u8")
+
+class AliasGroups(object):
+    """
+    A read-only sequence of sets of aliases stored in an :class:`AliasIndex`.
+    """
+    def __init__(self, aliases, indptr):
+        self._aliases = aliases
+        self._indptr = indptr
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self._indptr[index], self._indptr[index + 1]
+        return set(self._aliases[i] for i in range(start, end))
+
+    def __iter__(self):
+        aliases = self._aliases.tolist()
+        indptr = numpy.asarray(self._indptr).tolist()
+        for start, end in zip(indptr[:-1], indptr[1:]):
+            yield set(aliases[start:end])
+
+class AliasIndex(object):
+    """
+    A compact, memory mappable index of gene alias groups.
+
+    Groups of aliases are stored as a string table with group offsets.
+    The (optionally lower cased) aliases are indexed by sorted 64 bit
+    hashes mapping them to the ids of groups containing them, so lookups
+    do not require building a dictionary.
+
+    Behaves as a read-only version of the mapping returned by
+    :func:`create_mapping` (missing keys map to an empty set).
+    """
+    #: Format version of the stored files.
+    FORMAT = 1
+
+    def __init__(self, arrays, ignore_case):
+        self.arrays = arrays
+        self.ignore_case = ignore_case
+        self._hashes = arrays["key_hashes"]
+        self._keys = arraystore.stored_strings(arrays, "keys")
+        self._key_indptr = arrays["key_indptr"]
+        self._key_groups = arrays["key_groups"]
+        #: Sets of aliases (a :class:`AliasGroups` instance).
+        self.groups = AliasGroups(
+            arraystore.stored_strings(arrays, "aliases"),
+            arrays["group_indptr"])
+
+    @classmethod
+    def from_aliases(cls, aliases, ignore_case=True):
+        """ Build the index from a list of sets of aliases. """
+        aliases = [sorted(group) for group in aliases]
+        arrays = {}
+        arraystore.store_strings(
+            arrays, "aliases", [a for group in aliases for a in group])
+        arrays["group_indptr"] = numpy.cumsum(
+            [0] + [len(group) for group in aliases]).astype(numpy.int64)
+
+        mapping = create_mapping(aliases, ignore_case)
+        keys = list(mapping)
+        hashes = _alias_hashes(keys)
+        order = numpy.argsort(hashes, kind="mergesort")
+        keys = [keys[i] for i in order]
+        groups = [sorted(mapping[k]) for k in keys]
+        arrays["key_hashes"] = hashes[order]
+        arraystore.store_strings(arrays, "keys", keys)
+        arrays["key_indptr"] = numpy.cumsum(
+            [0] + [len(g) for g in groups]).astype(numpy.int64)
+        arrays["key_groups"] = numpy.array(
+            [i for g in groups for i in g], dtype=numpy.int32)
+        return cls(arrays, ignore_case)
+
+    @classmethod
+    def _meta(cls, version, ignore_case):
+        meta = {"format": cls.FORMAT, "ignore_case": ignore_case}
+        if version is not None:
+            meta["version"] = version
+        return meta
+
+    @classmethod
+    def load(cls, filename, version=None, ignore_case=True):
+        """
+        Load (memory map) the index from `filename`. Return `None` if the
+        file does not exist or was not stored with the same `version`
+        (any version is accepted if `version` is `None`).
+        """
+        loaded = arraystore.load_valid(filename, cls._meta(version, ignore_case))
+        if loaded is None:
+            return None
+        return cls(loaded[0], ignore_case)
+
+    def save(self, filename, version=None):
+        arraystore.save(filename, self.arrays,
+                        self._meta(version, self.ignore_case))
+
+    def _find(self, key, h):
+        hashes = self._hashes
+        i = int(numpy.searchsorted(hashes, h))
+        while i < len(hashes) and hashes[i] == h:
+            if self._keys[i] == key:
+                start, end = self._key_indptr[i], self._key_indptr[i + 1]
+                return set(self._key_groups[start:end].tolist())
+            i += 1
+        return None
+
+    def get(self, key, default=None):
+        if self.ignore_case:
+            key = key.lower()
+        ids = self._find(key, _alias_hashes([key])[0])
+        return default if ids is None else ids
+
+    def __getitem__(self, key):
+        return self.get(key, set())
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def get_many(self, keys):
+        """ Return a list of sets of group ids for `keys`. """
+        if self.ignore_case:
+            keys = [k.lower() for k in keys]
+        hashes = _alias_hashes(keys)
+        result = [set() for _ in keys]
+        if not len(self._hashes):
+            return result
+        pos = numpy.searchsorted(self._hashes, hashes)
+        found = numpy.flatnonzero(
+            self._hashes[numpy.minimum(pos, len(self._hashes) - 1)] == hashes)
+        for i in found.tolist():
+            ids = self._find(keys[i], hashes[i])
+            if ids is not None:
+                result[i] = ids
+        return result
+
 class MatcherAliases(Matcher):
     """
     Genes matcher based on a list of sets of given aliases.
@@ -557,12 +805,13 @@ class MatcherAliases(Matcher):
         """
         d = defaultdict(list)
         #d = id: [ targets ], where id is index of the set of aliases
+        targets = list(targets)
         for target in targets:
             ids = self.to_ids(target)
             if ids != None:
                 for id in ids:
                     d[id].append(target)
-        mo = MatchAliases(d, self)
+        mo = MatchAliases(d, self, targets)
         self.matcho = mo #backward compatibility - default match object
         return mo
 
@@ -574,16 +823,54 @@ class MatcherAliases(Matcher):
 
 class Match(object):
 
+    #: A list of target genes.
+    targets = ()
+
     def umatch(self, gene):
         """Returns an unique (only one matching target) target or None"""
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
+
+    def _match_unique(self, genes):
+        """ Return a dictionary of matches for a list of unique `genes`. """
+        return dict((gene, self.match(gene)) for gene in genes)
+
+    def match_many(self, genes):
+        """
+        Return a list of matches (see :func:`match`) for each of `genes`.
+        Each distinct gene name is matched only once.
+        """
+        genes = list(genes)
+        matches = self._match_unique(_unique(genes))
+        return [list(matches[gene]) for gene in genes]
+
+    def umatch_many(self, genes):
+        """
+        Match all `genes` at once and return an (`indices`, `unmatched`)
+        tuple of numpy arrays. `indices` are the indices of the unique
+        matching genes in :obj:`targets` (-1 if there is no unique match)
+        and `unmatched` is a boolean mask of genes without a unique match.
+        """
+        genes = list(genes)
+        unique = _unique(genes)
+        matches = self._match_unique(unique)
+        if getattr(self, "_target_index", None) is None:
+            self._target_index = {}
+            for i, target in enumerate(self.targets):
+                self._target_index.setdefault(target, i)
+        index = self._target_index
+        uindex = dict((gene, index[m[0]] if len(m) == 1 else -1)
+                      for gene, m in matches.items())
+        indices = numpy.fromiter((uindex[gene] for gene in genes),
+                                 dtype=numpy.intp, count=len(genes))
+        return indices, indices < 0
  
 class MatchAliases(Match):
 
-    def __init__(self, to_targets, parent):
+    def __init__(self, to_targets, parent, targets=()):
         self.to_targets = to_targets
         self.parent = parent
+        self.targets = targets
 
     def match(self, gene):
         """
@@ -601,6 +888,28 @@ class MatchAliases(Match):
         inputgeneids = self.parent.to_ids(gene)
         return [ (self.to_targets[igid], self.parent.aliases[igid]) for igid in inputgeneids ]
 
+    def _match_unique(self, genes):
+        # Normalize the names once and avoid inserting unknown names into
+        # the (default)dicts.
+        mdict = self.parent.mdict
+        to_targets = self.to_targets
+        keys = [gene.lower() for gene in genes] if self.parent.ignore_case \
+            else genes
+        if isinstance(mdict, AliasIndex):
+            allids = mdict.get_many(keys)
+        else:
+            allids = [mdict.get(key, ()) for key in keys]
+        matches = {}
+        for gene, ids in zip(genes, allids):
+            if len(ids) == 1:
+                for id in ids:
+                    matched = set(to_targets.get(id, ()))
+            else:
+                matched = set(target for id in ids
+                              for target in to_targets.get(id, ()))
+            matches[gene] = list(matched)
+        return matches
+
 class MatcherAliasesPickled(MatcherAliases):
     """
     Gene matchers based on sets of aliases supporting pickling should
@@ -611,6 +920,10 @@ class MatcherAliasesPickled(MatcherAliases):
     Loading of gene aliases is done lazily: they are loaded when they are
     needed. Loading of aliases for components of joined matchers is often 
     unnecessary and is therefore avoided. 
+
+    Aliases are stored in an :class:`AliasIndex` file in :func:`buffer_path`
+    which is memory mapped on load (and rebuilt when the
+    `create_aliases_version` changes).
     """
     
     def set_aliases(self, aliases):
@@ -618,7 +931,12 @@ class MatcherAliasesPickled(MatcherAliases):
 
     def get_aliases(self):
         if not self.saved_aliases: #loads aliases if not loaded
-            self.aliases = self.load_aliases()
+            index = self.load_index()
+            if index is not None:
+                self.aliases = index.groups
+                self.saved_mdict = index
+            else:
+                self.aliases = self.load_aliases()
         #print "size of aliases ", len(self.saved_aliases)
         return self.saved_aliases
 
@@ -627,7 +945,9 @@ class MatcherAliasesPickled(MatcherAliases):
     def get_mdict(self):
         """ Creates mdict. Aliases are loaded if needed. """
         if not self.saved_mdict:
-            self.saved_mdict = create_mapping(self.aliases, self.ignore_case)
+            aliases = self.aliases
+            if not self.saved_mdict:
+                self.saved_mdict = create_mapping(aliases, self.ignore_case)
         return self.saved_mdict
 
     def set_mdict(self, mdict):
@@ -650,6 +970,39 @@ class MatcherAliasesPickled(MatcherAliases):
         """ Returns gene aliases. """
         notImplemented()
 
+    def index_filename(self):
+        """
+        Return the file name of the alias index or None if the aliases
+        should not be stored.
+        """
+        fn = self.filename()
+        if fn is None or isinstance(fn, tuple):
+            return None
+        return os.path.join(buffer_path(), fn) + \
+            (".ic.index" if self.ignore_case else ".index")
+
+    def load_index(self):
+        """
+        Return the (memory mapped) :class:`AliasIndex` of aliases. The index
+        is built with `create_aliases` if it does not exist or its version
+        differs from `create_aliases_version`. Return None if aliases can
+        not be stored (see :func:`load_aliases`).
+        """
+        filename = self.index_filename()
+        if filename is None:
+            return None
+        ver = self.create_aliases_version() #if version == None ignore it
+        index = AliasIndex.load(filename, ver, self.ignore_case)
+        if index is None:
+            index = AliasIndex.from_aliases(self.create_aliases(),
+                                            self.ignore_case)
+            try:
+                index.save(filename, ver)
+            except (IOError, OSError):
+                return index
+            index = AliasIndex.load(filename, ver, self.ignore_case) or index
+        return index
+
     def load_aliases(self):
         fn = self.filename()
         ver = self.create_aliases_version() #if version == None ignore it
@@ -848,6 +1201,8 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
 
     The joined gene matcher can only be pickled if the source gene
     matchers are picklable.
+
+    Groups of aliases are joined transitively (see :func:`join_groups`).
     """
 
     def filename(self):
@@ -865,7 +1220,7 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
 
     def create_aliases_version(self):
         try:
-            return "v4_" + "__".join([ mat.create_aliases_version() for mat in self.matchers ])
+            return "v5_" + "__".join([ mat.create_aliases_version() for mat in self.matchers ])
         except:
             return None
 
@@ -901,7 +1256,7 @@ class MatcherSequence(Matcher):
                                 #be problematic if a generator was passed
         for matcher in self.matchers:
             ms.append(matcher.set_targets(targets))
-        om = MatchSequence(ms)
+        om = MatchSequence(ms, targets)
         self.matcho = om
         return om
 
@@ -914,8 +1269,20 @@ class MatcherSequence(Matcher):
 
 class MatchSequence(Match):
 
-    def __init__(self, ms):
+    def __init__(self, ms, targets=()):
         self.ms = ms
+        self.targets = targets
+
+    def _match_unique(self, genes):
+        matches = dict((gene, []) for gene in genes)
+        for match in self.ms:
+            if not genes:
+                break
+            for gene, m in match._match_unique(genes).items():
+                if m:
+                    matches[gene] = m
+            genes = [gene for gene in genes if not matches[gene]]
+        return matches
 
     def match(self, gene):
         for match in self.ms:
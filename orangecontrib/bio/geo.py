@@ -4,6 +4,7 @@ import os
 import gzip
 import re
 import io
+import warnings
 
 from collections import defaultdict
 
@@ -25,6 +26,7 @@ else:
 
 from .utils import serverfiles
 from .utils import compat
+from .utils import arraystore
 from . import taxonomy
 
 
@@ -58,6 +60,226 @@ def spots_max(x):
     else:
         return max(vs)
 
+class SoftTable(object):
+    """
+    The data table of a GDS SOFT file.
+
+    :ivar X: A (spots x samples) float array of expression values (NaN
+        for unknown values).
+    :ivar spots: A list of spot ids (rows of `X`).
+    :ivar genes: A list of gene names of the spots.
+    :ivar samples: A list of sample ids (columns of `X`).
+
+    """
+    def __init__(self, X, spots, genes, samples):
+        self.X = X
+        self.spots = spots
+        self.genes = genes
+        self.samples = samples
+
+    def remove_unknown(self, threshold):
+        """
+        Return a table without the spots with a proportion of unknown
+        values above `threshold` (if `threshold` is None or 0 nothing is
+        removed).
+        """
+        if not threshold or not len(self.samples):
+            return self
+        keep = ~(numpy.isnan(self.X).mean(axis=1) > threshold)
+        return SoftTable(self.X[keep],
+                         [s for s, k in zip(self.spots, keep) if k],
+                         [g for g, k in zip(self.genes, keep) if k],
+                         self.samples)
+
+    def save(self, filename, meta=None):
+        """Save the table (and JSON serializable `meta`) to `filename`."""
+        arrays = {"X": self.X}
+        arraystore.store_strings(arrays, "spots", self.spots)
+        arraystore.store_strings(arrays, "genes", self.genes)
+        arraystore.store_strings(arrays, "samples", self.samples)
+        arraystore.save(filename, arrays, meta)
+
+    @classmethod
+    def load(cls, filename, meta=None):
+        """
+        Load a table saved with :func:`save` (the matrix is memory
+        mapped). Return a (`table`, `meta`) tuple, or None if the file is
+        missing or its metadata does not contain all the items in `meta`.
+        """
+        loaded = arraystore.load_valid(filename, meta or {})
+        if loaded is None:
+            return None
+        arrays, meta = loaded
+        strings = lambda name: \
+            arraystore.stored_strings(arrays, name).tolist()
+        table = cls(arrays["X"], strings("spots"), strings("genes"),
+                    strings("samples"))
+        return table, meta
+
+    def gene_index(self):
+        """
+        Return a (`gene_names`, `index`) tuple of sorted unique gene names
+        and an array mapping each spot to its gene in `gene_names`.
+        """
+        names, index = numpy.unique(numpy.array(self.genes, dtype=object)
+                                    .astype(six.text_type),
+                                    return_inverse=True)
+        return [six.text_type(n) for n in names], index.ravel()
+
+    def merge_spots(self, merge_function=spots_mean):
+        """
+        Merge the spots of the same gene with `merge_function`. Return a
+        (`gene_names`, `matrix`) tuple of sorted gene names and a
+        (genes x samples) array of merged values.
+
+        :func:`spots_mean`, :func:`spots_median`, :func:`spots_min` and
+        :func:`spots_max` are computed as grouped reductions; any other
+        function is called with a list of the spot values of each gene in
+        each sample.
+        """
+        names, index = self.gene_index()
+        return names, _group_reduce(self.X, index, len(names), merge_function)
+
+
+def _group_reduce(X, index, ngroups, merge_function=spots_mean):
+    """
+    Reduce the rows of `X` in groups given by `index` (NaN values are
+    ignored; groups with no known values are NaN).
+    """
+    order = numpy.argsort(index, kind="mergesort")
+    index = index[order]
+    X = X[order]
+    starts = numpy.flatnonzero(numpy.r_[True, index[1:] != index[:-1]]) \
+        if len(index) else numpy.array([], dtype=int)
+    out = numpy.full((ngroups, X.shape[1]), numpy.nan, dtype=X.dtype)
+    if not len(index):
+        return out
+    groups = index[starts]
+    known = ~numpy.isnan(X)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        if merge_function is spots_mean:
+            sums = numpy.add.reduceat(numpy.where(known, X, 0), starts, axis=0)
+            counts = numpy.add.reduceat(known, starts, axis=0)
+            out[groups] = sums / counts
+        elif merge_function is spots_min:
+            out[groups] = numpy.fmin.reduceat(X, starts, axis=0)
+        elif merge_function is spots_max:
+            out[groups] = numpy.fmax.reduceat(X, starts, axis=0)
+        elif merge_function is spots_median:
+            counts = numpy.add.reduceat(known, starts, axis=0)
+            for j in range(X.shape[1]):
+                # sort the values within groups (NaNs last)
+                col = X[numpy.lexsort((X[:, j], index)), j]
+                lo = starts + numpy.maximum(counts[:, j] - 1, 0) // 2
+                hi = starts + counts[:, j] // 2
+                out[groups, j] = numpy.where(
+                    counts[:, j] > 0, (col[lo] + col[hi]) / 2, numpy.nan)
+        else:
+            ends = numpy.r_[starts[1:], len(index)]
+            for group, start, end in zip(groups, starts, ends):
+                out[group] = [_float_or_nan(merge_function(
+                    [compat.unknown if numpy.isnan(v) else v
+                     for v in column]))
+                    for column in X[start:end].T]
+    return out
+
+
+def _float_or_nan(x):
+    return float("nan") if compat.isunknown(x) else float(x)
+
+
+def _soft_table_chunks(f, chunk_size):
+    """
+    Yield (`spots`, `genes`, `values`) chunks of at most `chunk_size`
+    lines of a SOFT data table (`values` are the tab separated values
+    part of the lines).
+    """
+    spots, genes, values = [], [], []
+    for line in f:
+        if line.startswith("!dataset_table_end"):
+            break
+        d = line.rstrip("\r\n").split("\t", 2)
+        d += [""] * (3 - len(d))
+        spots.append(d[0])
+        genes.append(d[1])
+        values.append(d[2])
+        if len(spots) >= chunk_size:
+            yield spots, genes, values
+            spots, genes, values = [], [], []
+    if spots:
+        yield spots, genes, values
+
+
+def _soft_values(values, nsamples, dtype):
+    """
+    Convert a list of tab separated SOFT table values ('null' for
+    unknown) into a (len(values) x nsamples) array.
+    """
+    text = "\t".join(values).replace("null", "nan")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            X = numpy.fromstring(text, dtype=dtype, sep="\t")
+        except ValueError:
+            X = None
+    if X is not None and X.size == len(values) * nsamples:
+        return X.reshape(len(values), nsamples)
+    # missing or malformed values; convert line by line
+    X = numpy.full((len(values), nsamples), numpy.nan, dtype=dtype)
+    for i, line in enumerate(values):
+        for j, v in enumerate(line.split("\t")[:nsamples]):
+            try:
+                X[i, j] = float(v)
+            except ValueError:
+                pass
+    return X
+
+
+def parse_soft_table(f, remove_unknown=None, dtype=numpy.float64,
+                     size_hint=None, chunk_size=10000):
+    """
+    Parse the data table of a GDS SOFT file (a text file object) into a
+    :class:`SoftTable`.
+
+    The table is read in chunks of `chunk_size` lines, which are
+    converted to arrays and copied into a preallocated matrix (of
+    `size_hint` rows, grown if needed).
+
+    :param remove_unknown: Remove spots with a proportion of unknown
+        values above this threshold (None or 0 to keep all spots).
+    :param dtype: The dtype of the matrix (float32 or float64).
+
+    """
+    for line in f:
+        if line.startswith("!dataset_table_begin"):
+            break
+    samples = f.readline().rstrip("\r\n").split("\t")[2:]
+    nsamples = len(samples)
+    X = numpy.empty((size_hint or chunk_size, nsamples), dtype=dtype)
+    spots, genes = [], []
+    rows = 0
+    for chunk_spots, chunk_genes, values in \
+            _soft_table_chunks(f, chunk_size):
+        chunk = _soft_values(values, nsamples, dtype)
+        if remove_unknown and nsamples:
+            keep = ~(numpy.isnan(chunk).mean(axis=1) > remove_unknown)
+            chunk = chunk[keep]
+            chunk_spots = [s for s, k in zip(chunk_spots, keep) if k]
+            chunk_genes = [g for g, k in zip(chunk_genes, keep) if k]
+        if rows + len(chunk) > len(X):
+            grown = numpy.empty((max(2 * len(X), rows + len(chunk)), nsamples),
+                                dtype=dtype)
+            grown[:rows] = X[:rows]
+            X = grown
+        X[rows:rows + len(chunk)] = chunk
+        rows += len(chunk)
+        spots.extend(chunk_spots)
+        genes.extend(chunk_genes)
+    if rows < len(X):
+        X = X[:rows].copy()
+    return SoftTable(X, spots, genes, samples)
+
+
 p_assign = re.compile(" = (.*$)")
 p_tagvalue = re.compile("![a-z]*_([a-z_]*) = (.*)$")    
 tagvalue = lambda x: p_tagvalue.search(x).groups()
@@ -127,6 +349,10 @@ class GDS():
     loaded locally, else it downloads it from `NCBI's GEO FTP site
     <ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SOFT/GDS/>`_.
 
+    The parsed data file is cached in a binary file next to it (with
+    :obj:`COMPILED_SUFFIX` appended to its name), which is reused until
+    the data file changes.
+
     :param gdsname: An NCBI's ID for the data set in the form "GDSn"
       where "n" is a GDS ID number.
 
@@ -134,6 +360,10 @@ class GDS():
 
     """
 
+    #: Suffix of the cache of the parsed data file.
+    COMPILED_SUFFIX = ".compiled"
+    _COMPILED_FORMAT = 1
+
     def __init__(self, gdsname, verbose=False, force_download=False):
         self.gdsname = gdsname
         self.verbose = verbose
@@ -142,15 +372,46 @@ class GDS():
         d = os.path.dirname(self.filename)
         if not os.path.exists(d):
             os.makedirs(d)
-        self._getinfo() # to get the info
-        taxid = taxonomy.search(self.info["sample_organism"], exact=True)
-        self.info["taxid"] = taxid[0] if len(taxid)==1 else None
-        self._getspotmap() # to get gene->spot and spot->gene mapping
+        self._load() # info and the full (unfiltered) data table
+        self._set_spotmap(self._table.spots, self._table.genes)
         self.genes = sorted(self.gene2spots.keys())        
         self.spots = sorted(self.spot2gene.keys())        
         self.info["gene_count"] = len(self.genes)
         self.gdsdata = None
         self.data = None
+
+    def _compiled_meta(self):
+        return {"format": self._COMPILED_FORMAT,
+                "source": arraystore.file_stamp(self.filename)}
+
+    def _load(self):
+        """
+        Load the dataset info and data table from the compiled cache if
+        it is up to date, else parse the SOFT file and write the cache.
+        """
+        self._download()
+        compiled = self.filename + self.COMPILED_SUFFIX
+        loaded = SoftTable.load(compiled, self._compiled_meta())
+        if loaded is not None:
+            self._table, meta = loaded
+            self.info = meta["info"]
+            return
+
+        self._getinfo()
+        taxid = taxonomy.search(self.info["sample_organism"], exact=True)
+        self.info["taxid"] = taxid[0] if len(taxid)==1 else None
+        f = gzip.open(self.filename, "rb")
+        if six.PY3:
+            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+        with f:
+            self._table = parse_soft_table(
+                f, size_hint=self.info.get("feature_count"))
+        meta = dict(self._compiled_meta(), info=self.info)
+        try:
+            self._table.save(compiled, meta)
+        except (IOError, OSError):
+            # e.g. a read-only directory
+            pass
         
     def _download(self):
         """Download GDS data file if not in local cache or forced download requested."""
@@ -242,10 +503,17 @@ class GDS():
             if include_spots and (spot not in include_spots):
                 continue 
             spot2gene[spot] = gene
-            gene2spots[gene] = gene2spots.get(gene, []) + [spot]
+            gene2spots.setdefault(gene, []).append(spot)
     
         self.spot2gene = spot2gene
         self.gene2spots = gene2spots
+
+    def _set_spotmap(self, spots, genes):
+        """Set gene to spot and spot to genes mappings."""
+        self.spot2gene = dict(zip(spots, genes))
+        self.gene2spots = {}
+        for spot, gene in zip(spots, genes):
+            self.gene2spots.setdefault(gene, []).append(spot)
         
     def sample_annotations(self, sample_type=None):
         """Return a dictionary with sample annotation."""
@@ -268,34 +536,36 @@ class GDS():
         return set([info["type"] for info in self.info["subsets"]])
     
     def _parse_soft(self, remove_unknown=None):
-        """Parse GDS data, returns data dictionary."""
+        """Parse GDS data table into a :class:`SoftTable`."""
+        if getattr(self, "_table", None) is not None:
+            self.gdsdata = self._table.remove_unknown(remove_unknown)
+            return
         f = gzip.open(self.filename, "rb")
         if six.PY3:
             f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+        with f:
+            self.gdsdata = parse_soft_table(
+                f, remove_unknown=remove_unknown,
+                size_hint=self.info.get("feature_count"))
+
+    def _table_rows(self, X):
+        # rows of X in the form accepted by compat.create_table
+        if compat.OR3:
+            return X
+        return [[compat.unknown if numpy.isnan(v) else float(v) for v in row]
+                for row in X]
 
-        mfloat = lambda x: float(x) if x != 'null' else compat.unknown
-    
-        data = {}
-        # find the start of the data part
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline()
-        
-        # load data
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            d = line.rstrip().split("\t")
-            if remove_unknown and (float(d[2:].count('null')) / len(d[2:]) > remove_unknown):
-#                print "ZZZ", float(d[2:].count('null')) / len(d[2:]), d[2:]
-                continue 
-            data[d[0]] = GeneData(d[0], d[1], [mfloat(v) for v in d[2:]])
-        self.gdsdata = data
-    
     def _to_ExampleTable(self, report_genes=True, merge_function=spots_mean,
                                 sample_type=None, transpose=False):
         """Convert parsed GEO format to orange, save by genes or by spots."""
+        table = self.gdsdata
+        if report_genes:
+            nameval, X = table.merge_spots(merge_function)
+        else:
+            order = sorted(range(len(table.spots)), key=table.spots.__getitem__)
+            nameval = [table.spots[i] for i in order]
+            X = table.X[order]
+
         if transpose: # samples in rows
             sample2class = self.sample_to_class(sample_type)
             cvalues = sorted(set(sample2class.values()))
@@ -314,25 +584,19 @@ class GDS():
                 sample_type = list(ad.keys())[0]
 
             classvar = DiscreteVariable(name=sample_type or "class", values=cvalues)
-            spots = self.genes if report_genes else self.spots
-            atts = [ContinuousVariable(name=gene) for gene in spots]
+            atts = [ContinuousVariable(name=gene) for gene in nameval]
     
             metasvar = [ DiscreteVariable(name=n, values=sorted(values)) 
                 for n,values in ad.items() if n != sample_type ]
 
-            X = []
             Y = []
             metas = []
-            for (i, sampleid) in enumerate(self.info["samples"]):
-                vals = [ ( (merge_function([self.gdsdata[spot].data[i] for spot in self.gene2spots[gene]]) )
-                         if report_genes else self.gdsdata[gene].data[i] ) 
-                         for gene in spots ]
-                X.append(vals)
+            for sampleid in self.info["samples"]:
                 Y.append(sample2class.get(sampleid, None))
                 metas.append([samp_ann[sampleid].get(n, None) for n,_ in ad.items() if n != sample_type ])
 
             domain = compat.create_domain(atts, classvar, metasvar)
-            return compat.create_table(domain, X, Y, metas)
+            return compat.create_table(domain, self._table_rows(X.T), Y, metas)
 
         else: # genes in rows
             annotations = self.sample_annotations(sample_type)
@@ -342,19 +606,10 @@ class GDS():
 
             geneatname = "gene" if report_genes else "spot"
             metasvar = [ StringVariable(geneatname) ]
-            nameval = self.genes if report_genes else self.spots
 
-            X = []
-            metas = []
-            for g in nameval:
-                if report_genes:
-                    X.append(list(map(lambda *x: merge_function(x),
-                        *[self.gdsdata[spot].data for spot in self.gene2spots[g]])))
-                else:
-                    X.append(self.gdsdata[g].data)
             metas = [ [a] for a in nameval]
             domain = compat.create_domain(atts, None, metasvar)
-            return compat.create_table(domain, X, None, metas)
+            return compat.create_table(domain, self._table_rows(X), None, metas)
 
     def getdata(self, report_genes=True, merge_function=spots_mean,
                  sample_type=None, transpose=False, remove_unknown=None):
@@ -380,14 +635,13 @@ class GDS():
         :param remove_unknown: Remove spots with sample profiles that
           include unknown values. They are removed if the proportion
           of samples with unknown values is above the threshold set by
-          ``remove_unknown``. If None, nothing is removed.
+          ``remove_unknown``. If None or 0, nothing is removed.
         """
         if self.verbose: print("Reading data ...")
 #        if not self.gdsdata:
         self._parse_soft(remove_unknown = remove_unknown)
-#        if remove_unknown:
-            # some spots were filtered out, need to revise spot<>gene mappings
-        self._getspotmap(include_spots=set(self.gdsdata.keys()))
+        # some spots may be filtered out, revise the spot<>gene mappings
+        self._set_spotmap(self.gdsdata.spots, self.gdsdata.genes)
         if self.verbose: print("Converting to example table ...")
         self.data = self._to_ExampleTable(merge_function=merge_function,
                                           sample_type=sample_type, transpose=transpose,
@@ -31,6 +31,14 @@ from gzip import GzipFile
 from collections import defaultdict
 from operator import attrgetter
 
+try:
+    from collections.abc import Mapping, MutableMapping, Sequence
+except ImportError:
+    from collections import Mapping, MutableMapping, Sequence
+
+import numpy
+import scipy.sparse
+
 from orangecontrib.bio.utils import progress_bar_milestones
 
 try:
@@ -47,8 +55,11 @@ except NameError:
 
 from orangecontrib.bio.utils import serverfiles
 from orangecontrib.bio.utils import stats
+from orangecontrib.bio.utils import multitest
+from orangecontrib.bio.utils import arraystore
 
 from orangecontrib.bio import gene as obiGene, taxonomy as obiTaxonomy
+from orangecontrib.bio.ontology import ClosureIndex
 
 default_database_path = os.path.join(serverfiles.localpath(), "GO")
 
@@ -267,6 +278,73 @@ class Instance(OBOObject):
     pass
 
 
+class _CompiledTerms(MutableMapping):
+    """
+    A mapping of term ids to :class:`Term` instances backed by the arrays
+    of a compiled ontology (see :func:`Ontology.save_compiled`). Terms are
+    parsed from their stanzas on first access.
+
+    """
+    def __init__(self, ontology, arrays):
+        self._ontology = ontology
+        self._ids = [intern(id) for id in
+                     arraystore.stored_strings(arrays, "term_ids")]
+        self._index = dict((id, i) for i, id in enumerate(self._ids))
+        self._stanzas = arraystore.stored_strings(arrays, "term_stanzas")
+        self._relations = [intern(r) for r in
+                           arraystore.stored_strings(arrays, "relations")]
+        self._children = (arrays["children_indptr"],
+                          arrays["children_indices"],
+                          arrays["children_relations"])
+        self._subsets = arraystore.stored_strings(arrays, "subsets").tolist()
+        self._subset_members = (arrays["subset_indptr"],
+                                arrays["subset_indices"])
+        self._terms = {}
+
+    def __getitem__(self, termid):
+        term = self._terms.get(termid)
+        if term is None:
+            i = self._index[termid]
+            term = Term(self._stanzas[i], self._ontology)
+            indptr, indices, relations = self._children
+            start, end = indptr[i], indptr[i + 1]
+            term.related_to = set(
+                (self._relations[r], self._ids[c])
+                for c, r in zip(indices[start:end], relations[start:end]))
+            self._terms[termid] = term
+        return term
+
+    def __setitem__(self, termid, term):
+        if termid not in self._index:
+            self._index[termid] = len(self._ids)
+            self._ids.append(termid)
+        self._terms[termid] = term
+
+    def __delitem__(self, termid):
+        # Only the term lookup is removed (the ids list keeps the
+        # compiled indices valid).
+        del self._index[termid]
+        self._terms.pop(termid, None)
+
+    def __contains__(self, termid):
+        return termid in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def named_subset(self, subset):
+        """Return the ids of all terms in a named `subset`."""
+        if subset not in self._subsets:
+            return []
+        indptr, indices = self._subset_members
+        i = self._subsets.index(subset)
+        return [self._ids[t] for t in indices[indptr[i]:indptr[i + 1]]
+                if self._ids[t] in self._index]
+
+
 class Ontology(object):
     """
     :class:`Ontology` is the class representing a gene ontology.
@@ -292,6 +370,11 @@ class Ontology(object):
     DOMAIN = "GO"
     FILENAME = "gene_ontology_edit.obo.tar.gz"
 
+    #: Suffix of the compiled ontology file stored next to the source
+    #: file (see :func:`save_compiled`).
+    COMPILED_SUFFIX = ".compiled"
+    _COMPILED_FORMAT = 1
+
     def __init__(self, filename=None, progress_callback=None, rev=None):
         self.terms = {}
         self.typedefs = {}
@@ -300,9 +383,13 @@ class Ontology(object):
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
         self.header = ""
+        #: Arrays of the compiled ontology (if loaded from one).
+        self._compiled = None
+        self._closure = None
+        self._slims_cache = (None, None, {})
 
         if filename is not None:
-            self.parse_file(filename, progress_callback)
+            self._load_file(filename, progress_callback)
         elif rev is not None:
             if not _CVS_REVISION_RE.match(rev):
                 raise ValueError("Invalid revision format.")
@@ -314,14 +401,14 @@ class Ontology(object):
                                     "gene_ontology_edit@rev%s.obo" % rev)
             if not os.path.exists(filename):
                 self.download_ontology_at_rev(rev, filename, pc)
-            self.parse_file(filename,
+            self._load_file(filename,
                             lambda v: progress_callback(v / 2.0 + 50)
                             if progress_callback else None)
         else:
             filename = serverfiles.localpath_download(
                 self.DOMAIN, self.FILENAME
             )
-            self.parse_file(filename, progress_callback)
+            self._load_file(filename, progress_callback)
 
     @classmethod
     def load(cls, progress_callback=None):
@@ -344,6 +431,13 @@ class Ontology(object):
         object. The optional progressCallback will be called with a single
         argument to report on the progress.
         """
+        header, blocks = self._read_blocks(file)
+        self._parse_blocks(header, blocks, progress_callback)
+
+    @staticmethod
+    def _read_blocks(file):
+        """ Read the file and return the header and a list of stanzas.
+        """
         if isinstance(file, basestring):
             if os.path.isfile(file) and tarfile.is_tarfile(file):
                 f = tarfile.open(file).extractfile("gene_ontology_edit.obo")
@@ -358,21 +452,32 @@ class Ontology(object):
 
         data = [line.decode() if not isinstance(line, str) else line for line in f.readlines()]
         data = "".join([line for line in data if not line.startswith("!")])
-        self.header = data[: data.index("[Term]")]
-        c = re.compile("\[.+?\].*?\n\n", re.DOTALL)
-        data = c.findall(data)
-
+        header = data[: data.index("[Term]")]
+        c = re.compile(r"\[.+?\].*?\n\n", re.DOTALL)
+        return header, c.findall(data)
+
+    def _parse_blocks(self, header, data, progress_callback=None):
+        """ Build the ontology from stanzas. Return a dictionary mapping
+        object types (:class:`Term`, :class:`Typedef` and
+        :class:`Instance`) to dictionaries of their stanzas by id.
+        """
+        self.header = header
+        self._closure = None
+        stanzas = {Term: {}, Typedef: {}, Instance: {}}
         milestones = progress_bar_milestones(len(data), 90)
         for i, block in enumerate(builtinOBOObjects + data):
             if block.startswith("[Term]"):
                 term = Term(block, self)
                 self.terms[term.id] = term
+                stanzas[Term][term.id] = block
             elif block.startswith("[Typedef]"):
                 typedef = Typedef(block, self)
                 self.typedefs[typedef.id] = typedef
+                stanzas[Typedef][typedef.id] = block
             elif block.startswith("[Instance]"):
                 instance = Instance(block, self)
                 self.instances[instance.id] = instance
+                stanzas[Instance][instance.id] = block
             if progress_callback and i in milestones:
                 progress_callback(90.0 * i / len(data))
 
@@ -385,11 +490,148 @@ class Ontology(object):
             try:
                 self.alias_mapper.update([(alt_id, id)
                                           for alt_id in term.alt_id])
-                self.reverse_alias_mapper[id].union_update(term.alt_id)
+                self.reverse_alias_mapper[id].update(term.alt_id)
             except AttributeError:
                 pass
             if progress_callback and i in milestones:
                 progress_callback(90.0 + 10.0 * i / len(self.terms))
+        return stanzas
+
+    def _load_file(self, filename, progress_callback=None):
+        """ Load the ontology from `filename` using its compiled form if it
+        exists and is up to date (and write it otherwise).
+        """
+        if not (isinstance(filename, basestring) and
+                os.path.isfile(filename)):
+            self.parse_file(filename, progress_callback)
+            return
+
+        compiled = filename + self.COMPILED_SUFFIX
+        if self.load_compiled(compiled, source=filename):
+            if progress_callback:
+                progress_callback(100.0)
+            return
+
+        header, blocks = self._read_blocks(filename)
+        stanzas = self._parse_blocks(header, blocks, progress_callback)
+        del blocks
+        try:
+            self.save_compiled(compiled, stanzas, source=filename)
+        except (IOError, OSError):
+            # e.g. a read-only directory
+            pass
+
+    def _compiled_meta(self, source):
+        meta = {"format": self._COMPILED_FORMAT, "version": self.version}
+        if source is not None:
+            meta["source"] = arraystore.file_stamp(source)
+        return meta
+
+    def save_compiled(self, filename, stanzas, source=None):
+        """ Save the ontology in a compact binary form to `filename`.
+
+        The compiled form stores integer coded term ids, the
+        term -> parent and term -> child relations as CSR arrays,
+        the alt_id table, subsets and the term stanzas (terms are parsed
+        lazily on access after :func:`load_compiled`).
+
+        :param dict stanzas: Stanzas of ontology objects as returned by
+            `_parse_blocks`.
+        :param str source: The source (.obo) file name. Its size and
+            modification time are recorded to check whether the
+            compiled file is up to date.
+
+        """
+        ids = sorted(self.terms)
+        index = dict((id, i) for i, id in enumerate(ids))
+        relations = sorted(set(typeId for term in self.terms.values()
+                               for typeId, _ in term.related))
+        relation_index = dict((r, i) for i, r in enumerate(relations))
+
+        def csr(attr):
+            pairs = [sorted((index[other], relation_index[typeId])
+                            for typeId, other in getattr(self.terms[id], attr))
+                     for id in ids]
+            indptr = numpy.cumsum([0] + [len(p) for p in pairs])
+            flat = [pair for p in pairs for pair in p]
+            indices = numpy.array([i for i, _ in flat], dtype=numpy.int32)
+            rels = numpy.array([r for _, r in flat], dtype=numpy.int16)
+            return indptr.astype(numpy.int64), indices, rels
+
+        arrays = {}
+        arrays["parents_indptr"], arrays["parents_indices"], \
+            arrays["parents_relations"] = csr("related")
+        arrays["children_indptr"], arrays["children_indices"], \
+            arrays["children_relations"] = csr("related_to")
+
+        alt_ids = sorted(self.alias_mapper)
+        arrays["alt_targets"] = numpy.array(
+            [index[self.alias_mapper[alt_id]] for alt_id in alt_ids],
+            dtype=numpy.int32)
+
+        subsets = sorted(set(subset for term in self.terms.values()
+                             for subset in getattr(term, "subset", [])))
+        members = [[index[id] for id in ids
+                    if subset in getattr(self.terms[id], "subset", [])]
+                   for subset in subsets]
+        arrays["subset_indptr"] = numpy.cumsum(
+            [0] + [len(m) for m in members]).astype(numpy.int64)
+        arrays["subset_indices"] = numpy.array(
+            [i for m in members for i in m], dtype=numpy.int32)
+
+        arraystore.store_strings(arrays, "term_ids", ids)
+        arraystore.store_strings(arrays, "term_stanzas",
+                                 [stanzas[Term][id] for id in ids])
+        arraystore.store_strings(arrays, "relations", relations)
+        arraystore.store_strings(arrays, "alt_ids", alt_ids)
+        arraystore.store_strings(arrays, "subsets", subsets)
+
+        meta = self._compiled_meta(source)
+        meta["header"] = self.header
+        meta["typedefs"] = [stanzas[Typedef][id] for id in self.typedefs
+                            if id in stanzas[Typedef] and
+                            stanzas[Typedef][id] not in builtinOBOObjects]
+        meta["instances"] = [stanzas[Instance][id] for id in self.instances
+                             if id in stanzas[Instance]]
+        arraystore.save(filename, arrays, meta)
+
+    def load_compiled(self, filename, source=None):
+        """ Load the ontology from a file written by :func:`save_compiled`.
+
+        The arrays are memory mapped. If `source` is given, the file is
+        only used if it was compiled from the current version of `source`.
+        Return `True` on success and `False` if the file is missing or
+        out of date.
+
+        """
+        loaded = arraystore.load_valid(filename, self._compiled_meta(source))
+        if loaded is None:
+            return False
+        arrays, meta = loaded
+
+        self.header = meta["header"]
+        self.terms = _CompiledTerms(self, arrays)
+        self._closure = None
+        self.typedefs = {}
+        for block in builtinOBOObjects + meta["typedefs"]:
+            if block.startswith("[Typedef]"):
+                typedef = Typedef(block, self)
+                self.typedefs[typedef.id] = typedef
+        self.instances = {}
+        for block in meta["instances"]:
+            instance = Instance(block, self)
+            self.instances[instance.id] = instance
+
+        ids = self.terms._ids
+        alt_ids = arraystore.stored_strings(arrays, "alt_ids").tolist()
+        targets = arrays["alt_targets"].tolist()
+        self.alias_mapper = dict((intern(alt_id), ids[t])
+                                 for alt_id, t in zip(alt_ids, targets))
+        self.reverse_alias_mapper = defaultdict(set)
+        for alt_id, t in six.iteritems(self.alias_mapper):
+            self.reverse_alias_mapper[t].add(alt_id)
+        self._compiled = arrays
+        return True
 
     def defined_slims_subsets(self):
         """
@@ -411,6 +653,8 @@ class Ontology(object):
         .. seealso:: :func:`defined_slims_subsets`
 
         """
+        if isinstance(self.terms, _CompiledTerms):
+            return self.terms.named_subset(subset)
         return [id for id, term in self.terms.items()
                 if subset in getattr(term, "subset", set())]
 
@@ -438,18 +682,70 @@ class Ontology(object):
         :param str term: Term ID.
 
         """
-        queue = set([term])
-        visited = set()
-        slims = set()
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            if term in self.slims_subset:
-                slims.add(term)
+        slims, mask, cache = self._slims_cache
+        if slims != self.slims_subset:
+            # Terms with a slim term among their super terms (the
+            # search below does not need to leave this set).
+            slims = set(self.slims_subset)
+            mask = self.closure_index().ancestor_mask(slims)
+            cache = {}
+            self._slims_cache = (slims, mask, cache)
+
+        if term not in cache:
+            closure = self.closure_index()
+            start = self.alias_mapper.get(term, term)
+            if start not in closure.index:
+                raise KeyError(term)
+            queue = set([start])
+            visited = set()
+            found = set()
+            while queue:
+                t = queue.pop()
+                visited.add(t)
+                if t in slims:
+                    found.add(t)
+                else:
+                    queue.update(p for p in closure.parents(t)
+                                 if mask[closure.index[p]] and
+                                 p not in visited)
+            cache[term] = found
+        return set(cache[term])
+
+    def closure_index(self):
+        """
+        Return a :class:`~orangecontrib.bio.ontology.ClosureIndex` of the
+        (term -> super term) relations (built on first use).
+
+        """
+        if self._closure is None:
+            if isinstance(self.terms, _CompiledTerms) and \
+                    len(self.terms._ids) == len(self.terms):
+                ids = self.terms._ids
+                indptr = self._compiled["parents_indptr"]
+                indices = numpy.asarray(self._compiled["parents_indices"])
+                parents = [indices[indptr[i]:indptr[i + 1]]
+                           for i in range(len(ids))]
             else:
-                queue.update(set(tid for _, tid in self[term].related) -
-                             visited)
-        return slims
+                ids = list(self.terms)
+                index = dict((id, i) for i, id in enumerate(ids))
+                index.update((alt, index[id]) for alt, id in
+                             six.iteritems(self.alias_mapper) if id in index)
+                parents = [[index[p] for _, p in self.terms[id].related
+                            if p in index]
+                           for id in ids]
+            self._closure = ClosureIndex(ids, parents)
+        return self._closure
+
+    def _closure_terms(self, terms):
+        terms = [terms] if isinstance(terms, basestring) else terms
+        closure = self.closure_index()
+        canonical = []
+        for term in terms:
+            term = self.alias_mapper.get(term, term)
+            if term not in closure.index:
+                raise KeyError(term)
+            canonical.append(term)
+        return terms, canonical
 
     def extract_super_graph(self, terms):
         """
@@ -458,15 +754,8 @@ class Ontology(object):
         :param list terms: A list of term IDs.
 
         """
-        terms = [terms] if isinstance(terms, basestring) else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related) -
-                         visited)
-        return visited
+        terms, canonical = self._closure_terms(terms)
+        return self.closure_index().super_graph(canonical) | set(terms)
 
     def extract_sub_graph(self, terms):
         """
@@ -475,28 +764,25 @@ class Ontology(object):
         :param list terms: A list of term IDs.
 
         """
-        terms = [terms] if type(terms) == str else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related_to) -
-                         visited)
-        return visited
+        terms, canonical = self._closure_terms(terms)
+        return self.closure_index().sub_graph(canonical) | set(terms)
 
-    def term_depth(self, term, cache_={}):
+    def is_super_term(self, super_term, term):
+        """
+        Return `True` if `super_term` is a (transitive) super term of `term`.
+        """
+        _, (super_term, term) = self._closure_terms([super_term, term])
+        return self.closure_index().is_ancestor(super_term, term)
+
+    def term_depth(self, term):
         """
         Return the minimum depth of a `term`.
 
         (length of the shortest path to this term from the top level term).
 
         """
-        if term not in cache_:
-            cache_[term] = min([self.term_depth(parent) + 1
-                                for _, parent in self[term].related] or
-                               [1])
-        return cache_[term]
+        _, (term,) = self._closure_terms([term])
+        return self.closure_index().depth(term)
 
     def __getitem__(self, termid):
         """
@@ -623,6 +909,336 @@ class AnnotationRecord(_AnnotationRecordBase):
         return list(map(intern, self.DB_Object_Synonym.split("|")))
 
 
+def _code_dtype(size):
+    """Return the smallest integer dtype able to index `size` items."""
+    for dtype in (numpy.int8, numpy.int16, numpy.int32):
+        if size <= numpy.iinfo(dtype).max:
+            return numpy.dtype(dtype)
+    return numpy.dtype(numpy.int64)
+
+
+def _group_index(codes, size):
+    """
+    Return an (`order`, `indptr`) pair grouping the rows by `codes`
+    (rows of the i-th group are ``order[indptr[i]:indptr[i + 1]]`` in
+    their original order).
+    """
+    order = numpy.argsort(codes, kind="mergesort").astype(numpy.int32)
+    indptr = numpy.zeros(size + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(codes, minlength=size), out=indptr[1:])
+    return order, indptr
+
+
+class _AnnotationColumns(object):
+    """
+    A columnar representation of annotation records.
+
+    Every :obj:`annotationFields` field is stored as an integer code
+    column indexing a (sorted) table of its distinct string values.
+    Rows are additionally indexed by gene (DB_Object_Symbol) and term
+    (GO_ID). All arrays can be memory mapped from a file written by
+    :func:`save`.
+
+    """
+    #: Format version of the stored files.
+    FORMAT = 1
+
+    GENE, TERM = "DB_Object_Symbol", "GO_ID"
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self._tables = {}
+        self._table_index = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Create the columns from a sequence of split GAF lines (lists of
+        :obj:`annotationFields` values).
+        """
+        arrays = {}
+        nfields = len(annotationFields)
+        columns = list(zip(*rows)) if rows else [()] * nfields
+        for name, values in zip(annotationFields, columns):
+            values = numpy.array(values, dtype=object)
+            table, codes = numpy.unique(values, return_inverse=True)
+            arrays[name] = codes.astype(_code_dtype(len(table)))
+            arraystore.store_strings(arrays, "table_" + name, table.tolist())
+        for name in (cls.GENE, cls.TERM):
+            ntable = len(arrays["table_%s_offsets" % name]) - 1
+            arrays[name + "_order"], arrays[name + "_indptr"] = \
+                _group_index(arrays[name], ntable)
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, filename, source=None):
+        """
+        Load the columns from `filename` (memory mapped) or return
+        `None` if the file does not exist or is out of date with the
+        `source` file.
+        """
+        loaded = arraystore.load_valid(filename, cls._meta(source))
+        if loaded is None:
+            return None
+        arrays, meta = loaded
+        columns = cls(arrays)
+        columns.header = meta["header"]
+        return columns
+
+    def save(self, filename, header="", source=None):
+        meta = self._meta(source)
+        meta["header"] = header
+        arraystore.save(filename, self.arrays, meta)
+
+    @classmethod
+    def _meta(cls, source):
+        meta = {"format": cls.FORMAT}
+        if source is not None:
+            meta["source"] = arraystore.file_stamp(source)
+        return meta
+
+    def __len__(self):
+        return len(self.arrays[self.GENE])
+
+    def table(self, name):
+        """Return the list of distinct values of field `name`."""
+        if name not in self._tables:
+            strings = arraystore.stored_strings(self.arrays, "table_" + name)
+            if six.PY2:
+                strings = (s.encode("utf-8") for s in strings)
+            self._tables[name] = [intern(s) for s in strings]
+        return self._tables[name]
+
+    def table_index(self, name):
+        """Return a dictionary mapping the values of field `name`
+        to their codes."""
+        if name not in self._table_index:
+            self._table_index[name] = dict(
+                (v, i) for i, v in enumerate(self.table(name)))
+        return self._table_index[name]
+
+    def codes(self, name, values):
+        """Return an array of codes of (existing) `values` of field `name`.
+        """
+        index = self.table_index(name)
+        return numpy.array([index[v] for v in values if v in index],
+                           dtype=numpy.int64)
+
+    def records(self, rows):
+        """Return a list of :class:`AnnotationRecord` for `rows`."""
+        rows = numpy.asarray(rows)
+        fields = [[table[c] for c in self.arrays[name][rows].tolist()]
+                  for name, table in ((name, self.table(name))
+                                      for name in annotationFields)]
+        return [AnnotationRecord._make(values) for values in zip(*fields)]
+
+    def group(self, name, value):
+        """Return the rows with `value` in field `name` (GO_ID or
+        DB_Object_Symbol)."""
+        code = self.table_index(name).get(value)
+        if code is None:
+            return numpy.zeros(0, dtype=numpy.int32)
+        indptr = self.arrays[name + "_indptr"]
+        return self.arrays[name + "_order"][indptr[code]:indptr[code + 1]]
+
+    def term_genes(self, evidence_codes, aspects):
+        """
+        Return a dictionary mapping GO_IDs to (sorted) arrays of gene
+        (DB_Object_Symbol table) indices directly annotated with one of
+        `evidence_codes` and `aspects`.
+        """
+        arrays = self.arrays
+        mask = numpy.isin(arrays["Evidence_Code"],
+                          self.codes("Evidence_Code", evidence_codes))
+        mask &= numpy.isin(arrays["Aspect"], self.codes("Aspect", aspects))
+        terms = numpy.asarray(arrays[self.TERM])[mask].astype(numpy.int64)
+        genes = numpy.asarray(arrays[self.GENE])[mask].astype(numpy.int32)
+        order = numpy.lexsort((genes, terms))
+        terms, genes = terms[order], genes[order]
+        if len(terms):
+            keep = numpy.ones(len(terms), dtype=bool)
+            keep[1:] = (terms[1:] != terms[:-1]) | (genes[1:] != genes[:-1])
+            terms, genes = terms[keep], genes[keep]
+        bounds = numpy.flatnonzero(numpy.diff(terms)) + 1
+        term_table = self.table(self.TERM)
+        return dict((term_table[t[0]], g) for t, g in
+                    zip(numpy.split(terms, bounds), numpy.split(genes, bounds))
+                    if len(t))
+
+    def alias_pairs(self):
+        """
+        Return (synonyms, symbol, id) string triples of distinct
+        annotated genes ordered by their last occurrence.
+        """
+        fields = ("DB_Object_Synonym", self.GENE, "DB_Object_ID")
+        if not len(self):
+            return []
+        keys = numpy.column_stack(
+            [numpy.asarray(self.arrays[name], dtype=numpy.int64)
+             for name in fields])
+        _, last = numpy.unique(keys[::-1], axis=0, return_index=True)
+        last = numpy.sort(len(keys) - 1 - last)
+        tables = [self.table(name) for name in fields]
+        return [tuple(table[c] for table, c in zip(tables, row))
+                for row in keys[last].tolist()]
+
+
+class _AnnotationRecordView(Sequence):
+    """
+    A read-only sequence of :class:`AnnotationRecord` instances created on
+    demand from :class:`_AnnotationColumns`.
+    """
+    _chunk_size = 10000
+
+    def __init__(self, columns):
+        self._columns = columns
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._columns.records(
+                numpy.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._columns.records([index])[0]
+
+    def __iter__(self):
+        for start in range(0, len(self), self._chunk_size):
+            end = min(start + self._chunk_size, len(self))
+            for record in self._columns.records(numpy.arange(start, end)):
+                yield record
+
+
+class _AnnotationIndex(Mapping):
+    """
+    A read-only mapping from gene names or term ids (depending on `field`)
+    to lists of :class:`AnnotationRecord` instances. Like a
+    `defaultdict(list)` missing keys map to an empty list.
+    """
+    def __init__(self, columns, field):
+        self._columns = columns
+        self._field = field
+
+    def __getitem__(self, key):
+        return self._columns.records(self._columns.group(self._field, key))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key):
+        return key in self._columns.table_index(self._field)
+
+    def __iter__(self):
+        return iter(self._columns.table(self._field))
+
+    def __len__(self):
+        return len(self._columns.table(self._field))
+
+
+class _TermGeneIncidence(object):
+    """
+    A term x gene boolean incidence matrix with the annotations already
+    propagated up the ontology (a gene annotated to a term is also
+    annotated to all of the term's super terms).
+
+    :param list genes: Gene names (column labels).
+    :param list terms: Term ids (row labels).
+    :param scipy.sparse.csr_matrix matrix: The (terms x genes) matrix.
+    :param dict unknown: Annotated term ids not found in the ontology
+        mapped to an array of (column) gene indices.
+
+    """
+    def __init__(self, genes, terms, matrix, unknown=None):
+        self.genes = genes
+        self.gene_index = dict((g, i) for i, g in enumerate(genes))
+        self.terms = terms
+        self.term_index = dict((t, i) for i, t in enumerate(terms))
+        self.matrix = matrix
+        self.unknown = unknown or {}
+
+    @classmethod
+    def from_annotations(cls, annotations, ontology, evidence_codes, aspects):
+        columns = annotations._columns
+        if columns is not None:
+            genes = list(columns.table(columns.GENE))
+            direct = columns.term_genes(evidence_codes, aspects)
+        else:
+            genes = sorted(annotations.gene_names)
+            gene_index = dict((g, i) for i, g in enumerate(genes))
+            direct = defaultdict(set)
+            for gene, gene_annots in six.iteritems(annotations.gene_annotations):
+                gi = gene_index[gene]
+                for ann in gene_annots:
+                    if ann.Evidence_Code in evidence_codes and \
+                            ann.Aspect in aspects:
+                        direct[ann.GO_ID].add(gi)
+            direct = dict((term, numpy.fromiter(ind, dtype=numpy.int32,
+                                                count=len(ind)))
+                          for term, ind in six.iteritems(direct))
+
+        terms = set()
+        propagated = []
+        unknown = {}
+        for term, gene_ind in six.iteritems(direct):
+            if term not in ontology:
+                unknown[term] = gene_ind
+                continue
+            term = ontology.alias_mapper.get(term, term)
+            supers = ontology.extract_super_graph([term])
+            terms.update(supers)
+            propagated.append((supers, gene_ind))
+
+        terms = sorted(terms)
+        term_index = dict((t, i) for i, t in enumerate(terms))
+        rows, cols = [], []
+        for supers, gene_ind in propagated:
+            for term in supers:
+                rows.append(numpy.repeat(term_index[term], len(gene_ind)))
+                cols.append(gene_ind)
+
+        if rows:
+            rows = numpy.concatenate(rows).astype(numpy.int32)
+            cols = numpy.concatenate(cols)
+        else:
+            rows = cols = numpy.zeros(0, dtype=numpy.int32)
+
+        matrix = scipy.sparse.coo_matrix(
+            (numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+            shape=(len(terms), len(genes))
+        ).tocsr()
+        # Duplicate (term, gene) entries were summed up; binarize.
+        matrix.data[:] = 1
+        return cls(genes, terms, matrix, unknown)
+
+    def gene_mask(self, genes):
+        """
+        Return a boolean mask over the matrix columns for `genes`.
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        ind = [self.gene_index[g] for g in genes if g in self.gene_index]
+        mask[ind] = True
+        return mask
+
+    def counts(self, mask):
+        """
+        Return the number of genes in `mask` annotated to each term.
+        """
+        return self.matrix.dot(mask.astype(numpy.int32))
+
+    def term_genes(self, term_ind, mask):
+        """
+        Return the names of genes in `mask` annotated to the
+        `term_ind`-th term.
+        """
+        start, end = self.matrix.indptr[term_ind], self.matrix.indptr[term_ind + 1]
+        cols = self.matrix.indices[start:end]
+        return [self.genes[i] for i in cols[mask[cols]]]
+
+
 class Annotations(object):
     """
     :class:`Annotations` object holds the annotations.
@@ -645,10 +1261,18 @@ class Annotations(object):
     """
     version = 2
 
+    #: Suffix of the columnar annotations cache file stored next to the
+    #: parsed file.
+    COMPILED_SUFFIX = ".compiled"
+
     def __init__(self, filename_or_organism=None, ontology=None, genematcher=None,
                  progress_callback=None, rev=None):
         self.ontology = ontology
 
+        #: Columnar store of the annotations if they were parsed from
+        #: a file (see :func:`parse_file`).
+        self._columns = None
+
         #: A dictionary mapping a gene name (DB_Object_Symbol) to a
         #: set of all annotations of that gene.
         self.gene_annotations = defaultdict(list)
@@ -672,12 +1296,12 @@ class Annotations(object):
         if type(filename_or_organism) in [list, set, dict, Annotations]:
             for ann in filename_or_organism:
                 self.add_annotation(ann)
-            if type(filename_or_organism, Annotations):
+            if isinstance(filename_or_organism, Annotations):
                 self.taxid = filename_or_organism.taxid
 
         elif isinstance(filename_or_organism, basestring) and \
                 os.path.exists(filename_or_organism):
-            self.parse_file(filename_or_organism, progress_callback)
+            self._load_file(filename_or_organism, progress_callback)
 
         elif isinstance(filename_or_organism, basestring):
             # Assuming organism code/name
@@ -696,7 +1320,7 @@ class Annotations(object):
                     self.DownloadAnnotationsAtRev(
                         code, rev, filename, progress_callback)
 
-                self.parse_file(filename, progress_callback)
+                self._load_file(filename, progress_callback)
                 self.taxid = to_taxid(code).pop()
             else:
                 a = self.Load(filename_or_organism, ontology, genematcher, progress_callback)
@@ -754,6 +1378,7 @@ class Annotations(object):
         """Set the ontology to use in the annotations mapping.
         """
         self.all_annotations = defaultdict(list)
+        self._incidence_cache = {}
         self._ontology = ontology
 
     def get_ontology(self):
@@ -814,19 +1439,90 @@ class Annotations(object):
                 raise ValueError("Cannot open %r for parsing." % file)
         else:
             f = file
+        header, columns = self._read_columns(f, progress_callback)
+        self.header = self.header + header
+        if self._columns is None and not self.annotations:
+            self._set_columns(columns)
+        else:
+            self.extend(_AnnotationRecordView(columns))
+
+    def _load_file(self, filename, progress_callback=None):
+        """Load the annotations from `filename` using the columnar cache
+        if it exists and is up to date (and write it otherwise).
+        """
+        compiled = filename + self.COMPILED_SUFFIX
+        if self._columns is None and not self.annotations and \
+                os.path.isfile(filename):
+            columns = _AnnotationColumns.load(compiled, source=filename)
+            if columns is not None:
+                self.header = columns.header
+                self._set_columns(columns)
+                if progress_callback:
+                    progress_callback(100.0)
+                return
+
+        self.parse_file(filename, progress_callback)
+        if self._columns is not None and os.path.isfile(filename):
+            try:
+                self._columns.save(compiled, self.header, source=filename)
+            except (IOError, OSError):
+                pass
+
+    @staticmethod
+    def _read_columns(f, progress_callback=None):
         lines = [line.decode() if not isinstance(line, str) else line for line in f.readlines()]
 
+        header = ""
+        rows = []
         milestones = progress_bar_milestones(len(lines), 100)
+        nfields = len(annotationFields)
+        gene_ind = annotationFields.index("DB_Object_Symbol")
+        term_ind = annotationFields.index("GO_ID")
+        qualifier_ind = annotationFields.index("Qualifier")
         for i, line in enumerate(lines):
             if line.startswith("!"):
-                self.header = self.header + line + "\n"
+                header = header + line + "\n"
                 continue
 
-            a = AnnotationRecord.from_string(line)
-            self.add_annotation(a)
+            fields = line.split("\t")
+            if len(fields) != nfields:
+                raise ValueError("Expected %i fields in an annotation "
+                                 "line (got %i)" % (nfields, len(fields)))
+            if fields[gene_ind] and fields[term_ind] and \
+                    fields[qualifier_ind] != "NOT":
+                rows.append(fields)
 
             if progress_callback and i in milestones:
                 progress_callback(100.0 * i / len(lines))
+        del lines
+        return header, _AnnotationColumns.from_rows(rows)
+
+    def _set_columns(self, columns):
+        self._columns = columns
+        self.annotations = _AnnotationRecordView(columns)
+        self.gene_annotations = _AnnotationIndex(columns, columns.GENE)
+        self.term_anotations = _AnnotationIndex(columns, columns.TERM)
+        self._invalidate()
+
+    def _materialize(self):
+        """Replace the columnar store with lists of records (so they can
+        be modified).
+        """
+        columns, self._columns = self._columns, None
+        self.annotations = list(_AnnotationRecordView(columns))
+        self.gene_annotations = defaultdict(list)
+        self.term_anotations = defaultdict(list)
+        for a in self.annotations:
+            self.gene_annotations[a.geneName].append(a)
+            self.term_anotations[a.GOId].append(a)
+        self._invalidate()
+
+    def _invalidate(self):
+        self.all_annotations = defaultdict(list)
+        self._incidence_cache = {}
+        self._gene_names_dict = None
+        self._gene_names = None
+        self._alias_mapper = None
 
     def add_annotation(self, a):
         """Add a single :class:`AnotationRecord` instance to this object.
@@ -836,14 +1532,13 @@ class Annotations(object):
         if not a.geneName or not a.GOId or a.Qualifier == "NOT":
             return
 
+        if self._columns is not None:
+            self._materialize()
+
         self.gene_annotations[a.geneName].append(a)
         self.annotations.append(a)
         self.term_anotations[a.GOId].append(a)
-        self.all_annotations = defaultdict(list)
-
-        self._gene_names_dict = None
-        self._gene_names = None
-        self._alias_mapper = None
+        self._invalidate()
 
     @property
     def gene_names_dict(self):
@@ -856,12 +1551,23 @@ class Annotations(object):
     @property
     def gene_names(self):
         if self._gene_names is None:
-            self._gene_names = set([ann.geneName for ann in self.annotations])
+            if self._columns is not None:
+                self._gene_names = set(
+                    self._columns.table(self._columns.GENE))
+            else:
+                self._gene_names = set([ann.geneName
+                                        for ann in self.annotations])
         return self._gene_names
 
     @property
     def alias_mapper(self):
-        if self._alias_mapper is None:
+        if self._alias_mapper is None and self._columns is not None:
+            self._alias_mapper = {}
+            for synonyms, name, id in self._columns.alias_pairs():
+                self._alias_mapper.update(
+                    [(alias, name) for alias in
+                     list(map(intern, synonyms.split("|"))) + [name, id]])
+        elif self._alias_mapper is None:
             self._alias_mapper = {}
             for ann in self.annotations:
                 self._alias_mapper.update([(alias, ann.geneName)
@@ -874,37 +1580,29 @@ class Annotations(object):
         to `genes`.
 
         """
+        if self.genematcher:
+            genes = list(genes)
+            indices, unmatched = self.genematcher.umatch_many(genes)
+            targets = self.genematcher.targets
+            return dict([(targets[i], gene) for gene, i, um in
+                         zip(genes, indices.tolist(), unmatched) if not um])
+
         def alias(gene):
-            if self.genematcher:
-                return self.genematcher.umatch(gene)
-            else:
-                return (gene if gene in self.gene_names
-                        else self.alias_mapper.get(gene, None))
+            return (gene if gene in self.gene_names
+                    else self.alias_mapper.get(gene, None))
 
         return dict([(alias(gene), gene) for gene in genes if alias(gene)])
 
-    def _collect_annotations(self, id, visited):
-        """ Recursive function collects and caches all annotations for id
+    def _collect_annotations(self, id, visited=None):
+        """ Return a list of annotation lists of `id` and all its sub terms
+        (including the annotations to their alt ids).
         """
-        if id not in self.all_annotations and id not in visited:
-            if id in self.ontology.reverse_alias_mapper:
-                annotations = [self.term_anotations.get(alt_id, [])
-                               for alt_id in
-                               self.ontology.reverse_alias_mapper[id]] + \
-                              [self.term_anotations[id]]
-            else:
-                ## annotations for this term alone
-                annotations = [self.term_anotations[id]]
-            visited.add(id)
-            for typeId, child in self.ontology[id].related_to:
-                aa = self._collect_annotations(child, visited)
-                if type(aa) == set:
-                    ## if it was already reduced in get_all_annotations
-                    annotations.append(aa)
-                else:
-                    annotations.extend(aa)
-            self.all_annotations[id] = annotations
-        return self.all_annotations[id]
+        annotations = []
+        for term in self.ontology.extract_sub_graph([id]):
+            annotations.append(self.term_anotations.get(term, []))
+            for alt_id in self.ontology.reverse_alias_mapper.get(term, ()):
+                annotations.append(self.term_anotations.get(alt_id, []))
+        return annotations
 
     _CollectAnnotations = _collect_annotations
 
@@ -941,6 +1639,30 @@ class Annotations(object):
         return list(set([ann.geneName for ann in annotations
                          if ann.Evidence_Code in evidence_codes]))
 
+    def term_gene_incidence(self, evidence_codes=None, aspect=None):
+        """ Return a term x gene incidence matrix (with annotations
+        propagated up the ontology) for annotations matching
+        `evidence_codes` and `aspect`.
+
+        The matrix is built once and cached for each distinct filter.
+
+        :param evidence_codes: List of evidence codes to consider.
+        :param aspect: Which aspects to use ("P", "F", "C" or a set
+            containing these elements). Use all by default.
+
+        """
+        if aspect is None:
+            aspect = ["P", "C", "F"]
+        elif isinstance(aspect, basestring):
+            aspect = [aspect]
+        key = (frozenset(evidence_codes or evidenceDict.keys()),
+               frozenset(aspect))
+        if key not in self._incidence_cache:
+            self._ensure_ontology()
+            self._incidence_cache[key] = _TermGeneIncidence.from_annotations(
+                self, self.ontology, key[0], key[1])
+        return self._incidence_cache[key]
+
     def get_enriched_terms(self, genes, reference=None, evidence_codes=None,
                            slims_only=False, aspect=None,
                            prob=stats.Binomial(), use_fdr=True,
@@ -976,21 +1698,6 @@ class Annotations(object):
             aspects_set = aspect
 
         evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = [ann
-                       for gene in genes for ann in self.gene_annotations[gene]
-                       if ann.Evidence_Code in evidence_codes and
-                       ann.Aspect in aspects_set]
-
-        refAnnotations = set(
-            [ann
-             for gene in reference for ann in self.gene_annotations[gene]
-             if ann.Evidence_Code in evidence_codes and
-             ann.Aspect in aspects_set]
-        )
-
-        annotationsDict = defaultdict(set)
-        for ann in annotations:
-            annotationsDict[ann.GO_ID].add(ann)
 
         self._ensure_ontology()
         if slims_only and not self.ontology.slims_subset:
@@ -998,42 +1705,44 @@ class Annotations(object):
                           "Using 'goslim_generic' subset", UserWarning)
             self.ontology.set_slims_subset("goslim_generic")
 
-        terms = annotationsDict.keys()
-        filteredTerms = [term for term in terms if term in self.ontology]
+        incidence = self.term_gene_incidence(evidence_codes, aspects_set)
+        genes_mask = incidence.gene_mask(genes)
+        ref_mask = incidence.gene_mask(reference)
 
-        if len(terms) != len(filteredTerms):
-            termDiff = set(terms) - set(filteredTerms)
+        termDiff = [term for term, gene_ind in incidence.unknown.items()
+                    if genes_mask[gene_ind].any()]
+        if termDiff:
             warnings.warn("%s terms in the annotations were not found in the "
                           "ontology." % ",".join(map(repr, termDiff)),
                           UserWarning)
 
-        terms = self.ontology.extract_super_graph(filteredTerms)
-        res = {}
-
-        milestones = progress_bar_milestones(len(terms), 100)
-        for i, term in enumerate(terms):
-            if slims_only and term not in self.ontology.slims_subset:
-                continue
-            allAnnotations = self.get_all_annotations(term).intersection(refAnnotations)
-##            allAnnotations.intersection_update(refAnnotations)
-            allAnnotatedGenes = set([ann.geneName for ann in allAnnotations])
-            mappedGenes = genes.intersection(allAnnotatedGenes)
+        # Only genes in the reference are counted as annotated (but all
+        # terms annotated by the query genes are reported).
+        annotated = numpy.flatnonzero(incidence.counts(genes_mask))
+        if slims_only:
+            annotated = [i for i in annotated
+                         if incidence.terms[i] in self.ontology.slims_subset]
+        annotated = numpy.asarray(annotated, dtype=int)
+        mapped_mask = genes_mask & ref_mask
+        mapped_counts = incidence.counts(mapped_mask)[annotated]
+        ref_counts = incidence.counts(ref_mask)[annotated]
+        p_values = stats.p_values(prob, mapped_counts, len(reference),
+                                  ref_counts, len(genes))
 
-            if len(reference) > len(allAnnotatedGenes):
-                mappedReferenceGenes = reference.intersection(allAnnotatedGenes)
-            else:
-                mappedReferenceGenes = allAnnotatedGenes.intersection(reference)
-            res[term] = ([revGenesDict[g] for g in mappedGenes],
-                         prob.p_value(len(mappedGenes), len(reference),
-                                      len(mappedReferenceGenes), len(genes)),
-                         len(mappedReferenceGenes))
+        res = {}
+        milestones = progress_bar_milestones(len(annotated), 100)
+        for i, term_ind in enumerate(annotated):
+            mappedGenes = incidence.term_genes(term_ind, mapped_mask)
+            res[incidence.terms[term_ind]] = (
+                [revGenesDict[g] for g in mappedGenes],
+                float(p_values[i]), int(ref_counts[i]))
             if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(terms))
+                progress_callback(100.0 * i / len(annotated))
         if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
-            res = dict([(id, (genes, p, ref))
-                        for (id, (genes, _, ref)), p in
-                        zip(res, stats.FDR([p for _, (_, p, _) in res]))])
+            terms = list(res)
+            fdrs = multitest.fdr_bh([res[term][1] for term in terms])
+            res = dict((term, (res[term][0], float(p), res[term][2]))
+                       for term, p in zip(terms, fdrs))
         return res
 
     def get_annotated_terms(self, genes, direct_annotation_only=False,
@@ -1072,9 +1781,9 @@ class Annotations(object):
                               file="graph.png", width=None, height=None,
                               precison=3):
         ref_size = len(self.gene_names) if ref_size == None else ref_size
-        sortedterms = sorted(terms.items(), key=lambda term: term[1][1])
-        fdr = dict(zip([t[0] for t in sortedterms],
-                       stats.FDR([t[1][1] for t in sortedterms])))
+        term_ids = list(terms)
+        fdr = dict(zip(term_ids,
+                       multitest.fdr_bh([terms[t][1] for t in term_ids])))
         termsList = [(term,
                       ((float(len(terms[term][0])) / cluster_size) /
                        (float(terms[term][2]) / ref_size)),
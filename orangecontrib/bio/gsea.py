@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 from collections import defaultdict
+from functools import partial
 import random
 import time
 
@@ -11,6 +12,11 @@ import Orange
 
 from . import geneset as obiGeneSets
 from .utils.expression import *
+from .utils.gsea import (
+    mean, nth, orderedPointersCorr, enrichmentScoreRanked, geneSetMembership,
+    enrichmentScoresBatch, shuffleList, gseapval, runOptCallbacks, gseaR,
+    genePermutationRanking, gseaSignificance, gseaSignificanceBatch, gseaBatch
+)
 from . import gene as obiGene
 
 """
@@ -29,116 +35,24 @@ def issequencens(x):
     "Is x a sequence and not string ? We say it is if it has a __getitem__ method and is not string."
     return hasattr(x, '__getitem__') and not isinstance(x, basestring)
 
-def mean(l):
-    return float(sum(l))/len(l)
-
 def rankingFromOrangeMeas(meas):
     """
     Creates a function that sequentally ranks all attributes and returns
     results in a list. Ranking function is build out of 
     orange.MeasureAttribute.
     """
-    return lambda d: [ meas(i,d) for i in range(len(d.domain.attributes)) ]
-
-def orderedPointersCorr(lcor):
-    """
-    Return a list of integers: indexes in original
-    lcor. Elements in the list are ordered by
-    their lcor[i] value. Higher correlations first.
-    """
-    ordered = [ (i,a) for i,a in enumerate(lcor) ] #original pos + correlation
-    ordered.sort(key=lambda x: -x[1]) #sort by correlation, descending
-    ordered = nth(ordered, 0) #contains positions in the original list
-    return ordered
+    return MeasureRanking(meas)
 
-def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+class MeasureRanking(object):
     """
-    Input data and subset. 
-    
-    subset: list of attribute indices of the input data belonging
-        to the same set.
-    lcor: correlations with class for each attribute in a list. 
-
-    Returns enrichment score on given data.
-
-    This implementation efficiently handles "sparse" genesets (that
-    cover only a small subset of all genes in the dataset).
+    Rank all attributes of data with an attribute measure (a picklable
+    callable, so it can be passed to worker processes).
     """
+    def __init__(self, meas):
+        self.meas = meas
 
-    #print lcor
-
-    subset = set(subset)
-
-    if rev2 == None:
-        def rev(l):
-            return numpy.argsort(l)
-        rev2 = rev(ordered)
-
-    #add if gene is not in the subset
-    notInA = -(1. / (len(lcor)-len(subset)))
-    #base for addition if gene is in the subset
-
-    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
-    sumcors = sum(cors)
-
-    #this should not happen
-    if sumcors == 0.0:
-        return (0.0, None)
-    
-    inAb = 1./sumcors
-
-    ess = [0.0]
-    
-    map = {}
-    for i in subset:
-        orderedpos = rev2[i]
-        map[orderedpos] = inAb*abs(lcor[i]**p)
-        
-    last = 0
-
-    maxSum = minSum = csum = 0.0
-
-    for a,b in sorted(map.items()):
-        diff = a-last
-        csum += notInA*diff
-        last = a+1
-        
-        if csum < minSum:
-            minSum = csum
-        
-        csum += b
-
-        if csum > maxSum:
-            maxSum = csum
-
-    #finish it
-    diff = (len(ordered))-last
-    csum += notInA*diff
-
-    if csum < minSum:
-        minSum = csum
-
-    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
-
-    """
-    #BY DEFINITION
-    print("subset", subset)
-
-    for i in ordered:
-        ess.append(ess[-1] + \
-            (inAb*abs(lcor[i]**p) if i in subset else notInA)
-        )
-        if i in subset:
-            print(ess[-2], ess[-1])
-            print(i, (inAb*abs(lcor[i]**p)))
-
-    maxEs = max(ess)
-    minEs = min(ess)
-    
-    print("REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:]))
-
-    """
-    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+    def __call__(self, d):
+        return [ self.meas(i,d) for i in range(len(d.domain.attributes)) ]
 
 #from mOrngData
 def shuffleAttribute(data, attribute, locations):
@@ -170,15 +84,6 @@ def shuffleClass(datai, rands=0):
     else:
         return [ shuffleOne(data) for data in datai ]
 
-def shuffleList(l, rand=random.Random(0)):
-    """
-    Returns a copy of a shuffled input list.
-    """
-    import copy
-    l2 = copy.copy(l)
-    rand.shuffle(l2)
-    return l2
-
 def shuffleAttributes(data, rand=random.Random(0)):
     """
     Returns a dataset with a new attribute order.
@@ -188,24 +93,6 @@ def shuffleAttributes(data, rand=random.Random(0)):
     d2 = orange.ExampleTable(dom2, data)
     return d2
 
-def gseapval(es, esnull):
-    """
-    From article (PNAS):
-    estimate nominal p-value for S from esnull by using the positive
-    or negative portion of the distribution corresponding to the sign 
-    of the observed ES(S).
-    """
-    
-    try:
-        if es < 0:
-            return float(len([ a for a in esnull if a <= es ]))/ \
-                len([ a for a in esnull if a < 0])    
-        else: 
-            return float(len([ a for a in esnull if a >= es ]))/ \
-                len([ a for a in esnull if a >= 0])
-    except:
-        return 1.0
-
 
 def enrichmentScore(data, subset, rankingf):
     """
@@ -217,7 +104,7 @@ def enrichmentScore(data, subset, rankingf):
     return es,l
 
 def gseaE(data, subsets, rankingf=None, \
-        n=100, permutation="class", callback=None):
+        n=100, permutation="class", callback=None, n_jobs=1):
     """
     Run GSEA algorithm on an example table.
 
@@ -228,247 +115,30 @@ def gseaE(data, subsets, rankingf=None, \
     n: number of random permutations to sample null distribution.
     permutation: "class" for permutating class, else permutate attribute 
         order.
+    n_jobs: number of worker processes for permutations (see gseaBatch).
 
     """
 
     if not rankingf:
         rankingf=rankingFromOrangeMeas(MA_signalToNoise())
 
-    enrichmentScores = []
- 
     lcor = rankingf(data)
-    #print lcor
-
-    ordered = orderedPointersCorr(lcor)
-
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-        es = enrichmentScoreRanked(subset, lcor, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-
-    runOptCallbacks(callback)
-
-    #print "PERMUTATION", permutation
-
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-
-        if permutation == "class":
-            d2 = shuffleClass(data, 2000+i) #fixed permutation
-            r2 = rankingf(d2)
-        else:
-            r2 = shuffleList(lcor, random.Random(2000+i))
-
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-        for si,subset in enumerate(subsets):
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
-
-
-def runOptCallbacks(callback):
-    if callback is not None:
-        try:
-            [ a() for a in callback ]
-        except:
-            callback()            
-
-def gseaR(rankings, subsets, n, callback=None):
-    """
-    """
-    enrichmentScores = []
-    ordered = orderedPointersCorr(rankings)
-    
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-
-        es = enrichmentScoreRanked(subset, rankings, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-    
-    runOptCallbacks(callback)
-
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-        
-        r2 = shuffleList(rankings, random.Random(2000+i))
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-
-        for si,subset in enumerate(subsets):
-
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
-
-
-def gseaSignificance(enrichmentScores, enrichmentNulls):
-
-    #print enrichmentScores
-
-    import time
-
-    tb1 = time.time()
-
-    enrichmentPVals = []
-    nEnrichmentScores = []
-    nEnrichmentNulls = []
-
-    for i in range(len(enrichmentScores)):
-        es = enrichmentScores[i]
-        enrNull = enrichmentNulls[i]
-        #print es, enrNull
-
-        enrichmentPVals.append(gseapval(es, enrNull))
-
-        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
-        #the positive and negative scores by divident by the mean of the 
-        #ES(S,pi)
-
-        #print es, enrNull
-
-        def normalize(s):
-            try:
-                if s == 0:
-                    return 0.0
-                if s >= 0:
-                    meanPos = mean([a for a in enrNull if a >= 0])
-                    #print s, meanPos
-                    return s/meanPos
-                else:
-                    meanNeg = mean([a for a in enrNull if a < 0])
-                    #print s, meanNeg
-                    return -s/meanNeg
-            except:
-                return 0.0 #return if according mean value is uncalculable
-
-
-        nes = normalize(es)
-        nEnrichmentScores.append(nes)
-        
-        nenrNull = [ normalize(s) for s in enrNull ]
-        nEnrichmentNulls.append(nenrNull)
- 
-
-    #print "First part", time.time() - tb1
-
-    #FDR computation
-    #create a histogram of all NES(S,pi) over all S and pi
-    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
 
+    if permutation == "class":
+        nullRanking = partial(classPermutationRanking, data, rankingf)
+    else:
+        nullRanking = partial(genePermutationRanking, lcor)
 
-    def shorten(l, p=10000):
-        """
-        Take each len(l)/p element, if len(l)/p >= 2.
-        """
-        e = len(l)/p
-        if e <= 1:
-            return l
-        else:
-            return [ l[i] for i in xrange(0, len(l), e) ]
+    return gseaBatch(lcor, nullRanking, n, subsets, callback=callback,
+                     n_jobs=n_jobs)
 
-    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
 
+def classPermutationRanking(data, rankingf, i):
     """
-    Use this null distribution to compute an FDR q value, for a given NES(S) =
-    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
-    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
-    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
-    = NES* <= 0.
+    Return the i-th null ranking obtained by permuting the class
+    (with a fixed seed).
     """
-
-    nvals = numpy.array(sorted(vals))
-    nnes = numpy.array(sorted(nEnrichmentScores))
-
-    #print "LEN VALS", len(vals), len(nEnrichmentScores)
-
-    fdrs = []
-
-    import operator
-
-    for i in range(len(enrichmentScores)):
-
-        nes = nEnrichmentScores[i]
-
-        """
-        #Strighfoward but slow implementation follows in comments.
-        #Useful as code description.
-        
-        if nes >= 0:
-            op0 = operator.ge
-            opn = operator.ge
-        else:
-            op0 = operator.lt
-            opn = operator.le
-
-        allPos = [a for a in vals if op0(a,0)]
-        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
-
-        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
-        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
-
-        top = len(allHigherAndPos)/float(len(allPos)) #p value
-        down = len(nesHigherAndPos)/float(len(nesPos))
-        
-        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
-
-        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
-
-        """
-
-        #this could be speed up twice with the same accuracy! 
-        if nes >= 0:
-            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
-            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
-        else:
-            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
-            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
-           
-        """
-        #Comparing results
-        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
-        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
-        sumd = sum( [ abs(a) for a in diffs ] )
-        if sumd > 0:
-            print(nes > 0)
-            print("orig", l1)
-            print("modi", l2)
-        """
-
-        try:
-            top = allHigherAndPos/float(allPos) #p value
-            down = nesHigherAndPos/float(nesPos)
-
-            fdrs.append(top/down)
-        except:
-            fdrs.append(1000000000.0)
-    
-    #print "Whole part", time.time() - tb1
-
-    return zip(enrichmentScores, nEnrichmentScores, enrichmentPVals, fdrs)
-
-
-def nth(l,n): return [ a[n] for a in l ]
+    return rankingf(shuffleClass(data, 2000+i))
 
 def itOrFirst(data):
     """ Returns input if input is of type ExampleTable, else returns first
@@ -895,10 +565,16 @@ class GSEA(object):
         to a self.genesets: key is genesetname, it's values are individual
         genes and match results.
         """
-        for g in obiGeneSets.GeneSets(genesets):
-            genes = g.genes
-            datamatch = filter(lambda x: x[1] != None, 
-                [ (gene, self.gm.umatch(gene)) for gene in genes])
+        genesets = list(obiGeneSets.GeneSets(genesets))
+        # match all distinct genes at once
+        allgenes = list(set(gene for g in genesets for gene in g.genes))
+        indices, unmatched = self.gm.umatch_many(allgenes)
+        targets = self.gm.targets
+        matched = dict((gene, targets[i]) for gene, i, um in
+                       zip(allgenes, indices, unmatched) if not um)
+        for g in genesets:
+            datamatch = [ (gene, matched[gene]) for gene in g.genes
+                          if gene in matched ]
             self.genesets[g] = datamatch
 
     def selectGenesets(self, minSize=3, maxSize=1000, minPart=0.1):
@@ -930,7 +606,7 @@ class GSEA(object):
         """
         return dict( (gs, self.genesIndices(nth(self.genesets[gs],1))) for gs in gsets)
 
-    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class"):
+    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class", n_jobs=1):
 
         subsetsok = self.selectGenesets(minSize=minSize, maxSize=maxSize, minPart=minPart)
 
@@ -944,10 +620,10 @@ class GSEA(object):
             return {} # quick return if no genesets
 
         if len(itOrFirst(self.data)) > 1:
-            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf)
+            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf, n_jobs=n_jobs)
         else:
             rankings = [ self.data[0][at].native() for at in self.data.domain.attributes ]
-            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None)
+            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None, n_jobs=n_jobs)
 
         res = {}
 
@@ -965,7 +641,7 @@ class GSEA(object):
         return res
 
 def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
-    gene_desc=None, n=100, callback=None):
+    gene_desc=None, n=100, callback=None, n_jobs=1):
     """ Gene Set Enrichment analysis for pre-computed correlations
     between genes and phenotypes. 
     
@@ -980,11 +656,12 @@ def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
 
     assert len(data.domain.attributes) == 1 or len(data) == 1
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
-        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback)
+        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback,
+        n_jobs=n_jobs)
 
 def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     at_least=3, phenotypes=None, gene_desc=None, phen_desc=None, n=100, 
-    permutation="phenotype", callback=None, rankingf=None):
+    permutation="phenotype", callback=None, rankingf=None, n_jobs=1):
     """ Run Gene Set Enrichment Analysis.
 
     :param Orange.data.Table data: Gene expression data.  
@@ -1015,6 +692,9 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
         specifies a sample, then the user should pass the meta variable
         containing the gene names. Defaults to attribute names if each
         example specifies one sample.
+    :param int n_jobs: Number of worker processes used to compute
+        the permutations (None for all processors). The results do
+        not depend on it. Default: 1.
 
     :return: | a dictionary where key is a gene set and values are:
         | { es: enrichment score, 
@@ -1033,19 +713,19 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
         maxSize=max_size, minPart=min_part, n=n, permutation=permutation, 
         geneVar=gene_desc, callback=callback, phenVar=phen_desc, 
-        classValues=phenotypes)
+        classValues=phenotypes, n_jobs=n_jobs)
 
 def runGSEA(data, organism=None, classValues=None, geneSets=None, n=100, 
         permutation="class", minSize=3, maxSize=1000, minPart=0.1, atLeast=3, 
         matcher=None, geneVar=None, phenVar=None, caseSensitive=False, 
-        rankingf=None, callback=None):
+        rankingf=None, callback=None, n_jobs=1):
     gso = GSEA(data, organism=organism, matcher=matcher, 
         classValues=classValues, atLeast=atLeast, caseSensitive=caseSensitive,
         geneVar=geneVar, phenVar=phenVar)
     gso.addGenesets(geneSets)
     res1 = gso.compute(n=n, permutation=permutation, minSize=minSize,
         maxSize=maxSize, minPart=minPart, rankingf=rankingf,
-        callback=callback)
+        callback=callback, n_jobs=n_jobs)
     return res1
 
 def etForAttribute(datal,a):
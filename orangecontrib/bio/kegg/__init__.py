@@ -58,6 +58,8 @@ from itertools import chain
 from datetime import datetime
 from contextlib import contextmanager
 
+import numpy
+
 from orangecontrib.bio import utils, taxonomy
 from orangecontrib.bio.utils import progress_bar_milestones
 from orangecontrib.bio.kegg import databases
@@ -189,40 +191,43 @@ class Organism(object):
         and (list_of_genes, p_value, num_of_reference_genes) tuples
         as items.
 
+        The p-values for all the pathways are computed at once using the
+        organism's :func:`pathway_index`. A gene is on a pathway if it is
+        in the GENE list of the pathway's DBGET entry. Duplicate genes
+        (in `genes` or `reference`) are counted once.
+
         """
         if reference is None:
             reference = self.genes.keys()
         reference = set(reference)
 
-        allPathways = defaultdict(lambda: [[], 1.0, []])
-        milestones = progress_bar_milestones(len(genes), 100)
-        pathways_db = KEGGPathways()
-
-        pathways_for_gene = []
-        for i, gene in enumerate(genes):
-            pathways_for_gene.append(self.pathways([gene]))
-            if callback and i in milestones:
-                callback(i * 50.0 / len(genes))
-
-        # pre-cache for speed
-        pathways_db.pre_cache([pid for pfg in pathways_for_gene
-                               for pid in pfg])
-        for i, (gene, pathways) in enumerate(zip(genes, pathways_for_gene)):
-            for pathway in pathways:
-                if pathways_db.get_entry(pathway).gene:
-                    allPathways[pathway][0].append(gene)
-            if callback and i in milestones:
-                callback(50.0 + i * 50.0 / len(genes))
-
-        pItems = allPathways.items()
-
-        for i, (p_id, entry) in enumerate(pItems):
-            pathway = pathways_db.get_entry(p_id)
-            entry[2].extend(reference.intersection(pathway.gene or []))
-            entry[1] = prob.p_value(len(entry[0]), len(reference),
-                                    len(entry[2]), len(genes))
-        return dict([(pid, (genes, p, len(ref)))
-                     for pid, (genes, p, ref) in allPathways.items()])
+        index = self.pathway_index(callback=callback)
+        counts, ref_counts, p_values = index.enrichment(genes, reference,
+                                                        prob)
+
+        # genes (in input order) on each pathway
+        positions = [i for i, gene in enumerate(genes)
+                     if gene in index._gene_index]
+        columns = [index._gene_index[genes[i]] for i in positions]
+        on_pathway = index.matrix[:, columns].tocsr()
+        on_pathway.sort_indices()
+
+        enriched = {}
+        for i in numpy.flatnonzero(counts):
+            start, end = on_pathway.indptr[i], on_pathway.indptr[i + 1]
+            pathway_genes = [genes[positions[j]]
+                             for j in on_pathway.indices[start:end]]
+            enriched[index.pathways[i]] = \
+                (pathway_genes, float(p_values[i]), int(ref_counts[i]))
+        return enriched
+
+    def pathway_index(self, callback=None):
+        """
+        Return a :class:`.pathway.PathwayIndex` of all the pathways for
+        this organism (built from the KGML files on first use).
+        """
+        return pathway.PathwayIndex.for_organism(self.org_code,
+                                                 callback=callback)
 
     def get_genes_by_enzyme(self, enzyme):
         enzyme = KEGGEnzyme().get_entry(enzyme)
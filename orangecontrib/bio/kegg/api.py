@@ -10,7 +10,7 @@ from operator import itemgetter
 import warnings
 import six
 
-from .service import web_service
+from .service import web_service, BatchFetcher
 from .types import OrganismSummary, Definition, BInfo, Link
 
 
@@ -360,7 +360,8 @@ class CachedKeggApi(KeggApi):
         path = conf.params["cache.path"]
         touch_dir(path)
         return caching.Sqlite3Store(os.path.join(path,
-                                                 "kegg_api_cache_2.sqlite3"))
+                                                 "kegg_api_cache_2.sqlite3"),
+                                    **caching.store_params())
 
     def last_modified(self, args, kwargs=None):
         return getattr(self, "default_release", "")
@@ -405,7 +406,6 @@ class CachedKeggApi(KeggApi):
 
         get = self.get
         uncached = []
-        unmatched = set()
 
         with closing(get.cache_store()) as store:
             # Which ids are already cached
@@ -418,35 +418,15 @@ class CachedKeggApi(KeggApi):
         if uncached:
             # in case there are duplicate ids
             uncached = sorted(set(uncached))
-
-            rval = KeggApi.get(self, uncached)
-
-            if rval is not None:
-                entries = rval.split("///\n")
-            else:
-                entries = []
-
-            if entries and not entries[-1].strip():
-                # Delete the last single newline entry if present
-                del entries[-1]
-
-            if len(entries) != len(uncached):
-                new_uncached, entries = match_by_ids(uncached, entries)
-                unmatched = set(uncached) - set(new_uncached)
-                uncached = new_uncached
-                warnings.warn("Unable to match entries for keys: %s." %
-                              ", ".join(map(repr, unmatched)))
+            entries = self._split_entries(uncached,
+                                          KeggApi.get(self, uncached))
 
             with closing(get.cache_store()) as store:
-                for id, entry in zip(uncached, entries):
-                    key = get.key_from_args((id,))
-                    if entry is not None:
-                        entry = entry + "///\n"
-                    store[key] = cache_entry(entry, mtime=datetime.now())
+                store.set_many(entries)
 
         # Finally join all the results, but drop all None objects
 
-        with closing(get.cache_store()):
+        with closing(get.cache_store()) as store:
             keys = [get.key_from_args((id,)) for id in ids]
             entries = [store[key].value for key in keys]
 
@@ -455,6 +435,73 @@ class CachedKeggApi(KeggApi):
         rval = "".join(entries)
         return rval
 
+    def _split_entries(self, ids, text):
+        """
+        Split the `text` of a batch ``get`` response for `ids` into a list
+        of (cache key, :class:`cache_entry`) tuples.
+        """
+        get = self.get
+        if text is not None:
+            entries = text.split("///\n")
+        else:
+            entries = []
+
+        if entries and not entries[-1].strip():
+            # Delete the last single newline entry if present
+            del entries[-1]
+
+        if len(entries) != len(ids):
+            matched, entries = match_by_ids(ids, entries)
+            unmatched = set(ids) - set(matched)
+            ids = matched
+            warnings.warn("Unable to match entries for keys: %s." %
+                          ", ".join(map(repr, unmatched)))
+
+        now = datetime.now()
+        return [(get.key_from_args((id,)), cache_entry(entry + "///\n",
+                                                       mtime=now))
+                for id, entry in zip(ids, entries)]
+
+    def pre_cache(self, ids, batch_size=10, progress_callback=None,
+                  fetcher=None, commit_size=1000):
+        """
+        Retrieve and cache all the entries for `ids` that are not yet
+        cached.
+
+        The entries are retrieved in batches of `batch_size` concurrently
+        using a :class:`.service.BatchFetcher` (`fetcher`) and stored in
+        the cache in transactions of (at least) `commit_size` entries.
+
+        """
+        if batch_size > 10 or batch_size < 1:
+            raise ValueError("Invalid batch_size")
+
+        get = self.get
+        with closing(get.cache_store()) as store:
+            ids = sorted(set(id for id in ids
+                             if not get.key_has_valid_cache(
+                                 get.key_from_args((id,)), store)))
+        if not ids:
+            return
+
+        if fetcher is None:
+            fetcher = BatchFetcher()
+
+        batches = [ids[i: i + batch_size]
+                   for i in range(0, len(ids), batch_size)]
+        pending = []
+        with closing(get.cache_store()) as store:
+            try:
+                for i, (batch, text) in enumerate(fetcher.get_many(batches)):
+                    pending.extend(self._split_entries(batch, text))
+                    if len(pending) >= commit_size:
+                        store.set_many(pending)
+                        pending = []
+                    if progress_callback:
+                        progress_callback(100.0 * (i + 1) / len(batches))
+            finally:
+                store.set_many(pending)
+
     @cached_method
     def conv(self, target_db, source):
         return KeggApi.conv(self, target_db, source)
@@ -4,12 +4,14 @@ Caching framework for cached kegg api calls.
 """
 import os
 import sqlite3
+import time
+import zlib
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-from contextlib import closing
+from contextlib import closing, contextmanager
 
 from datetime import datetime, date, timedelta
 from . import conf
@@ -19,7 +21,10 @@ import six
 try:
     from UserDict import DictMixin
 except ImportError:
-    from collections import MutableMapping as DictMixin
+    try:
+        from collections.abc import MutableMapping as DictMixin
+    except ImportError:
+        from collections import MutableMapping as DictMixin
 
 class Store(object):
     def __init__(self):
@@ -36,71 +41,305 @@ class Store(object):
 
 
 class Sqlite3Store(Store, DictMixin):
+    """
+    A persistent mapping of string keys to (pickled) values in an sqlite3
+    database.
+
+    The database is opened in WAL mode, so readers do not block (or get
+    blocked by) a writer, and a writer waits up to `timeout` seconds for
+    a lock held by another connection. Writes in a :func:`transaction`
+    block are committed together.
+
+    Entries older than `ttl` seconds are expired, and when the total size
+    of the stored values exceeds `max_size` bytes the least recently used
+    entries are evicted (down to 90% of `max_size`) when the store is
+    closed. The total size is maintained by triggers in a `cache_meta`
+    table, so checking it does not scan the stored values.
+
+    :param str filename: The database filename.
+    :param int max_size: Maximum size (in bytes) of the stored values.
+    :param float ttl: Time to live (in seconds) of an entry.
+    :param bool compress: Compress the stored values with zlib.
+    :param float timeout: Lock timeout (in seconds).
 
-    def __init__(self, filename):
+    """
+    def __init__(self, filename, max_size=None, ttl=None, compress=False,
+                 timeout=30.0):
         self.filename = filename
-        self.con = sqlite3.connect(filename)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.compress = compress
+        self.con = sqlite3.connect(filename, timeout=timeout)
+        # the rows deleted by INSERT OR REPLACE fire the delete trigger
+        self.con.execute("PRAGMA recursive_triggers = ON")
+        self._depth = 0
+        self._accessed = {}
+        self._modified = False
+
+        cur = self.con.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='cache'
+        """)
+        if not cur.fetchall():
+            # Can only be enabled in a new database
+            self.con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._enable_wal()
+
         self.con.execute("""
             CREATE TABLE IF NOT EXISTS cache
                 (key TEXT UNIQUE,
-                 value TEXT
+                 value BLOB,
+                 compressed INTEGER DEFAULT 0,
+                 size INTEGER DEFAULT 0,
+                 mtime REAL DEFAULT 0,
+                 atime REAL DEFAULT 0
                 )
         """)
         self.con.execute("""
             CREATE INDEX IF NOT EXISTS cache_index
             ON cache (key)
         """)
+        self._upgrade()
+        self.con.execute("""
+            CREATE INDEX IF NOT EXISTS cache_atime
+            ON cache (atime)
+        """)
+        self.con.execute("""
+            CREATE INDEX IF NOT EXISTS cache_mtime
+            ON cache (mtime)
+        """)
+        self._init_meta()
         self.con.commit()
 
+    def _init_meta(self):
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS cache_meta
+                (name TEXT PRIMARY KEY,
+                 value INTEGER
+                )
+        """)
+        self.con.execute("""
+            CREATE TRIGGER IF NOT EXISTS cache_size_insert
+            AFTER INSERT ON cache
+            BEGIN
+                UPDATE cache_meta SET value=value+NEW.size
+                WHERE name='size';
+            END
+        """)
+        self.con.execute("""
+            CREATE TRIGGER IF NOT EXISTS cache_size_delete
+            AFTER DELETE ON cache
+            BEGIN
+                UPDATE cache_meta SET value=value-OLD.size
+                WHERE name='size';
+            END
+        """)
+        self.con.execute("""
+            CREATE TRIGGER IF NOT EXISTS cache_size_update
+            AFTER UPDATE OF size ON cache
+            BEGIN
+                UPDATE cache_meta SET value=value+NEW.size-OLD.size
+                WHERE name='size';
+            END
+        """)
+        cur = self.con.execute(
+            "SELECT 1 FROM cache_meta WHERE name='size'")
+        if not cur.fetchall():
+            # Created after the triggers so no concurrent write is missed
+            # (only scans the table once, for a new or older database)
+            self.con.execute("""
+                INSERT OR IGNORE INTO cache_meta
+                SELECT 'size', COALESCE(SUM(size), 0) FROM cache
+            """)
+
+    def _enable_wal(self):
+        # WAL mode is persistent, so this only changes databases created
+        # in (or by an older version in) another journal mode. Changing
+        # it needs an exclusive lock; if other connections are using the
+        # database the mode is switched by a later connection.
+        mode = self.con.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode.lower() != "wal":
+            try:
+                self.con.execute("PRAGMA journal_mode = WAL").fetchall()
+            except sqlite3.OperationalError:
+                pass
+
+    def _upgrade(self):
+        # Add the columns missing in a database created by an older version
+        columns = [r[1] for r in self.con.execute("PRAGMA table_info(cache)")]
+        if "size" not in columns:
+            for column in ["compressed INTEGER DEFAULT 0",
+                           "size INTEGER DEFAULT 0",
+                           "mtime REAL DEFAULT 0",
+                           "atime REAL DEFAULT 0"]:
+                self.con.execute("ALTER TABLE cache ADD COLUMN " + column)
+            now = time.time()
+            self.con.execute("""
+                UPDATE cache
+                SET size=length(value), mtime=?, atime=?
+            """, (now, now))
+
+    def _cutoff(self):
+        # mtime of the oldest valid entry
+        return time.time() - self.ttl if self.ttl else -1
+
+    @contextmanager
+    def transaction(self):
+        """
+        Return a context manager committing all the writes in its block
+        in a single transaction (or rolling them back on an exception).
+        """
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if not self._depth:
+                self.con.rollback()
+            raise
+        else:
+            self._depth -= 1
+            if not self._depth:
+                self.con.commit()
+
+    def _commit(self):
+        if not self._depth:
+            self.con.commit()
+
     def __getitem__(self, key):
         cur = self.con.execute("""
-            SELECT value
+            SELECT value, compressed
             FROM cache
-            WHERE key=?
-        """, (key,))
+            WHERE key=? AND mtime>=?
+        """, (key, self._cutoff()))
         r = cur.fetchall()
         if not r:
             raise KeyError(key)
         else:
-            pickle_str = r[0][0]
+            pickle_str, compressed = r[0]
             if not six.PY3:
                 pickle_str = str(pickle_str)
             try:
-                return pickle.loads(pickle_str)
+                if compressed:
+                    pickle_str = zlib.decompress(pickle_str)
+                value = pickle.loads(pickle_str)
             except Exception:
                 raise KeyError(key)
+            self._accessed[key] = time.time()
+            return value
 
     def __setitem__(self, key, value):
-        value = pickle.dumps(value)
-        self.con.execute("""
-            INSERT OR REPLACE INTO cache
-            VALUES (?, ?)
-        """, (key, value))
-        self.con.commit()
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """
+        Store all (key, value) pairs from `items` in a single transaction.
+        """
+        now = time.time()
+        rows = []
+        for key, value in items:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if self.compress:
+                value = zlib.compress(value)
+            rows.append((key, sqlite3.Binary(value), int(self.compress),
+                         len(value), now, now))
+        with self.transaction():
+            self.con.executemany("""
+                INSERT OR REPLACE INTO cache
+                    (key, value, compressed, size, mtime, atime)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+        self._modified = True
 
     def __delitem__(self, key):
         self.con.execute("""
             DELETE FROM cache
             WHERE key=?
         """, (key,))
-        self.con.commit()
+        self._commit()
+
+    def __contains__(self, key):
+        cur = self.con.execute("""
+            SELECT 1
+            FROM cache
+            WHERE key=? AND mtime>=?
+        """, (key, self._cutoff()))
+        return bool(cur.fetchall())
 
     def keys(self):
         cur = self.con.execute("""
             SELECT key
             FROM cache
-        """)
+            WHERE mtime>=?
+        """, (self._cutoff(),))
         return [str(r[0]) for r in cur.fetchall()]
 
+    def size(self):
+        """
+        Return the total size (in bytes) of the stored values.
+        """
+        cur = self.con.execute(
+            "SELECT value FROM cache_meta WHERE name='size'")
+        return cur.fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the expired entries, and if the store exceeds `max_size`
+        the least recently used ones.
+        """
+        with self.transaction():
+            if self.ttl:
+                self.con.execute("DELETE FROM cache WHERE mtime<?",
+                                 (self._cutoff(),))
+            total = self.size() if self.max_size else 0
+            if self.max_size and total > self.max_size:
+                excess = total - int(0.9 * self.max_size)
+                cur = self.con.execute("""
+                    SELECT key, size
+                    FROM cache
+                    ORDER BY atime
+                """)
+                evicted = []
+                for key, size in cur:
+                    if excess <= 0:
+                        break
+                    evicted.append((key,))
+                    excess -= size
+                cur.close()
+                self.con.executemany("DELETE FROM cache WHERE key=?",
+                                     evicted)
+        self.con.execute("PRAGMA incremental_vacuum").fetchall()
+
     def close(self):
-        pass
+        """
+        Record the entry access times, evict the expired/least recently
+        used entries (if anything was written) and close the database.
+        """
+        if self.con is None:
+            return
+        with self.transaction():
+            if self._accessed:
+                self.con.executemany("""
+                    UPDATE cache
+                    SET atime=?
+                    WHERE key=?
+                """, [(t, key) for key, t in self._accessed.items()])
+                self._accessed = {}
+        if self._modified and (self.ttl or self.max_size):
+            self.evict()
+        self.con.close()
+        self.con = None
 
     def __len__(self):
-        return None
+        cur = self.con.execute("""
+            SELECT COUNT(*)
+            FROM cache
+            WHERE mtime>=?
+        """, (self._cutoff(),))
+        return cur.fetchone()[0]
 
     def __iter__(self):
-        return None
-
+        return iter(self.keys())
 
 
 class DictStore(Store, DictMixin):
@@ -262,6 +501,18 @@ class bget_cached_method(cached_method):
             return instance.last_modified
 
 
+def store_params():
+    """
+    Return the :class:`Sqlite3Store` size limit, time to live and
+    compression parameters as configured in :mod:`.conf`.
+    """
+    params = conf.params
+    max_size = int(float(params["cache.max_size"]) * 2 ** 20)
+    ttl = float(params["cache.ttl"]) * 24 * 3600
+    compress = params["cache.compress"].lower() in ("1", "yes", "true", "on")
+    return dict(max_size=max_size or None, ttl=ttl or None, compress=compress)
+
+
 def touch_dir(path):
     path = os.path.expanduser(path)
     if not os.path.exists(path):
@@ -288,3 +539,6 @@ def clear_cache():
 
     for png_filename in glob.glob(os.path.join(path, "*.png")):
         os.remove(png_filename)
+
+    for index_filename in glob.glob(os.path.join(path, "pathway_index_*")):
+        os.remove(index_filename)
@@ -23,10 +23,22 @@ default = """
 path = %(kegg_dir)s/
 store = sqlite3
 invalidate = weekly
+# maximum size of the api cache in MB (0 for no limit)
+max_size = 2048
+# maximum age of the api cache entries in days (0 for no limit)
+ttl = 0
+# compress the api cache entries
+compress = true
 
 [service]
 transport = urllib2
 # transport = requests
+# number of concurrent connections used for bulk retrieval
+workers = 4
+# maximum number of requests per second (0 for no limit)
+rate_limit = 10
+# number of retries (with backoff) of failed requests
+retries = 3
 
 """
 
@@ -49,7 +61,13 @@ _ALL_PARAMS = [
     "cache.path",
     "cache.store",
     "cache.invalidate",
-    "service.transport"
+    "cache.max_size",
+    "cache.ttl",
+    "cache.compress",
+    "service.transport",
+    "service.workers",
+    "service.rate_limit",
+    "service.retries",
 ]
 
 for p in _ALL_PARAMS:
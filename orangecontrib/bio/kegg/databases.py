@@ -7,7 +7,6 @@ from __future__ import absolute_import
 
 import sys
 import re
-from contextlib import closing
 
 from . import entry
 from .entry import fields
@@ -210,6 +209,9 @@ class DBDataBase(object):
         subsequent retrieval. If `keys` is ``None`` then all entries will be
         retrieved.
 
+        The entries are retrieved concurrently (see
+        :class:`.service.BatchFetcher` for the relevant configuration).
+
         """
         if not isinstance(self.api, api.CachedKeggApi):
             raise TypeError("Not an instance of api.CachedKeggApi")
@@ -221,36 +223,33 @@ class DBDataBase(object):
             keys = self.keys()
 
         keys = map(self._add_db, keys)
+        self.api.pre_cache(keys, batch_size=batch_size,
+                           progress_callback=progress_callback)
 
-        get = self.api.get
-
-        # drop all keys with a valid cache entry to minimize the number
-        # of 'get' requests.
-        with closing(get.cache_store()) as store:
-            def is_uncached(key):
-                cache_key = get.key_from_args((key,))
-                return not get.key_has_valid_cache(cache_key, store)
-            keys = [key for key in keys if is_uncached(key)]
-
-        start = 0
-
-        while start < len(keys):
-            batch = keys[start: start + batch_size]
-            self.api.get(batch)
-
-            if progress_callback:
-                progress_callback(100.0 * start / len(keys))
-
-            start += batch_size
-
-    def batch_get(self, keys):
+    def batch_get(self, keys, lazy=False):
         """
         Batch retrieve all entries for keys. This can be significantly
         faster then getting each entry separately especially if entries
         are not yet cached.
 
+        If `lazy` is True the entries' fields are parsed on first access.
+
         """
         entries = []
+        for batch_entries in self.batch_get_text(keys):
+            batch_entries = batch_entries.split("///\n")
+            # Remove possible empty last line
+            batch_entries = [e for e in batch_entries if e.strip()]
+            entries.extend(self.ENTRY_TYPE(e, lazy=lazy)
+                           for e in batch_entries)
+
+        return entries
+
+    def batch_get_text(self, keys):
+        """
+        Batch retrieve all entries for keys. Return an iterator over the
+        plain text of (``///`` separated) entries in batches of 10.
+        """
         batch_size = 10
         keys = list(map(self._add_db, keys))
 
@@ -262,14 +261,9 @@ class DBDataBase(object):
             batch = keys[start: start + batch_size]
             batch_entries = self.api.get(batch)
             if batch_entries is not None:
-                batch_entries = batch_entries.split("///\n")
-                # Remove possible empty last line
-                batch_entries = [e for e in batch_entries if e.strip()]
-                entries.extend(map(self.ENTRY_TYPE, batch_entries))
+                yield batch_entries
             start += batch_size
 
-        return entries
-
     def _add_db(self, key):
         """
         Prefix the key with '%(DB)s:' string if not already prefixed.
@@ -304,8 +298,8 @@ class GenomeEntry(entry.DBEntry):
 
     MULTIPLE_FIELDS = ["REFERENCE"]
 
-    def __init__(self, text):
-        entry.DBEntry.__init__(self, text)
+    def __init__(self, text, lazy=False):
+        entry.DBEntry.__init__(self, text, lazy=lazy)
 
     @property
     def organism_code(self):
@@ -398,6 +392,13 @@ class Genome(DBDataBase):
         return res
 
 
+def _gene_aliases(entry_key, name, dblinks):
+    return [entry_key] + \
+           (name.split(",") if name else []) + \
+           ([link[1][0] for link in dblinks.items()]
+            if dblinks else [])
+
+
 @entry.entry_decorate
 class GeneEntry(entry.DBEntry):
     FIELDS = [
@@ -421,10 +422,7 @@ class GeneEntry(entry.DBEntry):
     ]
 
     def aliases(self):
-        return [self.entry_key] + \
-               (self.name.split(",") if self.name else []) + \
-               ([link[1][0] for link in self.dblinks.items()]
-                if self.dblinks else [])
+        return _gene_aliases(self.entry_key, self.name, self.dblinks)
 
     @property
     def alt_names(self):
@@ -453,11 +451,15 @@ class Genes(DBDataBase):
 
     def gene_aliases(self):
         aliases = {}
-        for entry in self.itervalues():
-            aliases.update(
-                dict.fromkeys(entry.aliases(),
-                              self.org_code + ":" + entry.entry_key)
-            )
+        for text in self.batch_get_text(self.keys()):
+            for values in self.ENTRY_TYPE.extract_fields(
+                    text, ["ENTRY", "NAME", "DBLINKS"]):
+                entry_key = values["ENTRY"].split(" ", 1)[0]
+                aliases.update(
+                    dict.fromkeys(_gene_aliases(entry_key, values["NAME"],
+                                                values["DBLINKS"]),
+                                  self.org_code + ":" + entry_key)
+                )
 
         return aliases
 
@@ -3,6 +3,7 @@ DBGET entry
 """
 from __future__ import absolute_import
 
+import re
 import warnings
 from collections import defaultdict
 
@@ -55,18 +56,87 @@ def entry_decorate(cls):
     return cls
 
 
+# A section title at the start of a line
+_SECTION_RE = re.compile(r"\n(\S+)")
+
+
+def _section_offsets(text):
+    """
+    Return a mapping of section titles in an entry `text` to lists of
+    (start, end) character offsets of the sections (sections following
+    an entry end ('///') are ignored).
+    """
+    sections = defaultdict(list)
+    last = None
+    # (the match start in the prefixed text is the line start in `text`)
+    for match in _SECTION_RE.finditer("\n" + text):
+        start = match.start()
+        if last is not None:
+            sections[last[0]].append((last[1], start))
+        title = match.group(1)
+        if title.startswith("///"):
+            last = None
+            break
+        last = (title, start)
+    if last is not None:
+        sections[last[0]].append((last[1], len(text)))
+    return dict(sections)
+
+
 class DBEntry(object):
     """
     A DBGET entry object.
+
+    :param str text: A DBGET formated entry.
+    :param bool lazy: If True only the section offsets in `text` are
+        recorded and the fields are parsed on first access.
+
     """
     FIELDS = [("ENTRY", fields.DBEntryField)]
     MULTIPLE_FIELDS = []
 
-    def __init__(self, text=None):
+    def __init__(self, text=None, lazy=False):
         self._sections = {}
+        self._text = None
         self.fields = []
         if text is not None:
-            self.parse(text)
+            if lazy:
+                self._text = text
+                self._sections = _section_offsets(text)
+            else:
+                self.parse(text)
+
+    @property
+    def fields(self):
+        """
+        A list of all the entry's fields.
+        """
+        if self._sections:
+            # Parse the whole (lazy) entry
+            for title in self._sections:
+                self.__dict__.pop(title, None)
+            self._sections = {}
+            self.parse(self._text)
+            self._text = None
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields):
+        self._fields = fields
+
+    def __getattr__(self, name):
+        # Parse a field of a lazy entry on first access
+        sections = self.__dict__.get("_sections")
+        if not sections or name not in sections:
+            raise AttributeError(name)
+
+        parsed = self._parse_sections(self._text, sections, [name])[name]
+        if name in self.MULTIPLE_FIELDS:
+            value = parsed
+        else:
+            value = parsed[-1]
+        setattr(self, name, value)
+        return value
 
     @property
     def entry_key(self):
@@ -79,9 +149,17 @@ class DBEntry(object):
         """
         Parse `text` string containing a formated DBGET entry.
         """
+        self.fields = self._parse_fields(text)
+        self._consolidate()
+
+    @classmethod
+    def _parse_fields(cls, text):
+        """
+        Parse `text` into a list of fields.
+        """
         parser = DBGETEntryParser()
         gen = parser.parse_string(text)
-        field_constructors = dict(self.FIELDS)
+        field_constructors = dict(cls.FIELDS)
 
         current = None
         current_subfield = None
@@ -118,8 +196,60 @@ class DBEntry(object):
             elif event == DBGETEntryParser.ENTRY_END:
                 break
 
-        self.fields = entry_fields
-        self._consolidate()
+        return entry_fields
+
+    @classmethod
+    def _parse_sections(cls, text, sections, titles):
+        """
+        Parse the `titles` sections of an entry `text` (with section
+        offsets `sections`). Return a {title: list of fields} dictionary.
+        """
+        ranges = sorted((start, end, title) for title in set(titles)
+                        if title != "ENTRY"
+                        for start, end in sections.get(title, []))
+        # The ENTRY line determines the text indentation
+        entry_start, entry_end = sections["ENTRY"][0]
+        parsed = cls._parse_fields(
+            text[entry_start:entry_end] +
+            "".join(text[start:end] for start, end, _ in ranges))
+
+        rval = defaultdict(list)
+        if "ENTRY" in titles:
+            rval["ENTRY"].append(parsed[0])
+        for (_, _, title), field in zip(ranges, parsed[1:]):
+            rval[title].append(field)
+        return rval
+
+    @classmethod
+    def extract_fields(cls, text, titles):
+        """
+        Extract the `titles` fields from all the entries in a multiple
+        entry (``///`` separated) DBGET `text` without constructing the
+        entry objects.
+
+        Return a list with a {title: value} dictionary for each entry,
+        where the values are converted the same way as the entry
+        properties (``None`` if the entry does not have the field).
+
+        """
+        rval = []
+        for entry_text in text.split("///\n"):
+            if not entry_text.strip():
+                continue
+            sections = _section_offsets(entry_text)
+            fields_by_title = cls._parse_sections(entry_text, sections,
+                                                  titles)
+            values = {}
+            for title in titles:
+                parsed = fields_by_title.get(title)
+                if not parsed:
+                    values[title] = None
+                elif title in cls.MULTIPLE_FIELDS:
+                    values[title] = [f._convert() for f in parsed]
+                else:
+                    values[title] = parsed[-1]._convert()
+            rval.append(values)
+        return rval
 
     def _consolidate(self):
         """
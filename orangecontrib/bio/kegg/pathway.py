@@ -11,15 +11,19 @@ import io
 
 import xml.parsers
 from xml.dom import minidom
+from xml.etree import ElementTree
 
 from contextlib import closing
 from functools import reduce
 
+import numpy
 import requests
+import six
 
 from . import conf
 from . import caching
 from . import api
+from ..utils import arraystore
 
 
 def cached_method(func, cache_name="_cached_method_cache", store=None):
@@ -310,3 +314,331 @@ class Pathway(object):
         """
         kegg = api.CachedKeggApi()
         return kegg.list_pathways(organism)
+
+
+def parse_kgml(source):
+    """
+    Parse a KGML file (a filename or a file-like object) with a streaming
+    XML parser.
+
+    Return a (`attributes`, `entries`, `relations`) tuple, where
+    `attributes` is a dictionary of pathway attributes, `entries` a list
+    of entry attribute dictionaries (with additional "graphics" (a
+    dictionary) and "components" items) and `relations` a list of
+    (`entry1`, `entry2`, `type`, `subtypes`) tuples.
+
+    """
+    attributes = {}
+    entries = []
+    relations = []
+    for event, element in ElementTree.iterparse(source,
+                                                events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == "pathway":
+                attributes = dict(element.attrib)
+        elif tag == "entry":
+            entry = dict(element.attrib)
+            graphics = element.find("graphics")
+            entry["graphics"] = \
+                dict(graphics.attrib) if graphics is not None else {}
+            entry["components"] = [c.get("id")
+                                   for c in element.findall("component")]
+            entries.append(entry)
+            element.clear()
+        elif tag == "relation":
+            subtypes = [(s.get("name"), s.get("value"))
+                        for s in element.findall("subtype")]
+            relations.append((element.get("entry1"), element.get("entry2"),
+                              element.get("type"), subtypes))
+            element.clear()
+        elif tag == "reaction":
+            element.clear()
+    return attributes, entries, relations
+
+
+def _coordinate(graphics, name):
+    try:
+        return float(graphics[name])
+    except (KeyError, ValueError):
+        return numpy.nan
+
+
+def _get_or_none(kegg, id):
+    """
+    Return the text of the KEGG entry `id` (using the `kegg` api) or
+    ``None`` if it does not exist (the server responds with 404).
+    """
+    try:
+        return kegg.get(id)
+    except Exception as err:
+        response = getattr(err, "response", None)
+        if getattr(response, "status_code", None) == 404:
+            return None
+        raise
+
+
+class PathwayIndex(object):
+    """
+    A precomputed index of the KGML contents of (all) the pathways of an
+    organism.
+
+    :ivar list pathways: Pathway ids.
+    :ivar list titles: Pathway titles.
+    :ivar list genes: Sorted gene ids (of genes on any of the pathways).
+    :ivar matrix: A (pathways x genes) boolean
+        :class:`scipy.sparse.csr_matrix` of gene membership (by default
+        from the GENE lists of the pathways' DBGET entries, see
+        :func:`for_organism`).
+
+    The pathway entries and relations are stored in arrays sorted by
+    pathway (see :func:`entries` and :func:`relations`).
+
+    """
+    #: Format version of the stored index.
+    FORMAT = 2
+
+    def __init__(self, pathways, titles, genes, matrix, entry_arrays,
+                 entry_types, entry_names, relation_arrays,
+                 relation_types):
+        self.pathways = pathways
+        self.titles = titles
+        self.genes = genes
+        self.matrix = matrix
+        self._entry_arrays = entry_arrays
+        self._entry_types = entry_types
+        self._entry_names = entry_names
+        self._relation_arrays = relation_arrays
+        self._relation_types = relation_types
+        self._pathway_index = dict((p, i) for i, p in enumerate(pathways))
+        self._gene_index = dict((g, i) for i, g in enumerate(genes))
+
+    @classmethod
+    def build(cls, pathways, kgml, callback=None, genes=None):
+        """
+        Build the index of `pathways` (a list of pathway ids).
+
+        :param kgml: A function returning a KGML file-like object (or
+            ``None`` if not available) for a pathway id.
+        :param callback: A progress callback function.
+        :param genes: A function returning the gene ids on a pathway
+            (default: the names of the KGML ``gene`` entries).
+
+        """
+        import scipy.sparse
+
+        titles = []
+        pathway_genes = []
+        entry_pathway, entry_ids, entry_coords = [], [], []
+        entry_types, entry_names = [], []
+        relations, relation_types = [], []
+        for i, pathway_id in enumerate(pathways):
+            attributes, entries, rels = {}, [], []
+            source = kgml(pathway_id)
+            if source is not None:
+                try:
+                    attributes, entries, rels = parse_kgml(source)
+                except ElementTree.ParseError:
+                    pass
+            titles.append(attributes.get("title", ""))
+            members = set()
+            for entry in entries:
+                if genes is None and entry.get("type") == "gene":
+                    members.update(entry.get("name", "").split())
+                graphics = entry["graphics"]
+                entry_pathway.append(i)
+                entry_ids.append(int(entry["id"]))
+                entry_coords.append([_coordinate(graphics, name) for name in
+                                     ["x", "y", "width", "height"]])
+                entry_types.append(entry.get("type", ""))
+                entry_names.append(entry.get("name", ""))
+            if genes is not None:
+                members.update(genes(pathway_id))
+            pathway_genes.append(members)
+            for entry1, entry2, type_, _ in rels:
+                relations.append((i, int(entry1), int(entry2)))
+                relation_types.append(type_ or "")
+            if callback is not None:
+                callback(100.0 * (i + 1) / len(pathways))
+
+        genes = sorted(set().union(*pathway_genes))
+        gene_index = dict((g, i) for i, g in enumerate(genes))
+        indptr = numpy.zeros(len(pathways) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(g) for g in pathway_genes], out=indptr[1:])
+        indices = numpy.array([gene_index[g] for genes_ in pathway_genes
+                               for g in sorted(genes_)], dtype=numpy.int32)
+        matrix = scipy.sparse.csr_matrix(
+            (numpy.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(len(pathways), len(genes)))
+
+        entry_arrays = {
+            "pathway": numpy.array(entry_pathway, dtype=numpy.int32),
+            "id": numpy.array(entry_ids, dtype=numpy.int32),
+            "coords": numpy.array(entry_coords,
+                                  dtype=float).reshape(-1, 4)}
+        relation_arrays = {
+            "relations": numpy.array(relations,
+                                     dtype=numpy.int32).reshape(-1, 3)}
+        return cls(list(pathways), titles, genes, matrix, entry_arrays,
+                   entry_types, entry_names, relation_arrays, relation_types)
+
+    def save(self, filename, meta=None):
+        """
+        Save the index (and JSON serializable `meta`) to `filename`.
+        """
+        arrays = {"indptr": self.matrix.indptr,
+                  "indices": self.matrix.indices}
+        for name, arr in self._entry_arrays.items():
+            arrays["entry_" + name] = arr
+        arrays.update(self._relation_arrays)
+        strings = [("pathways", self.pathways), ("titles", self.titles),
+                   ("genes", self.genes), ("entry_types", self._entry_types),
+                   ("entry_names", self._entry_names),
+                   ("relation_types", self._relation_types)]
+        for name, values in strings:
+            arraystore.store_strings(arrays, name, values)
+        arraystore.save(filename, arrays, meta)
+
+    @classmethod
+    def load(cls, filename, meta=None):
+        """
+        Load an index saved with :func:`save`. Return ``None`` if the file
+        is missing or its metadata does not contain all the items in
+        `meta`.
+        """
+        import scipy.sparse
+
+        loaded = arraystore.load_valid(filename, meta or {})
+        if loaded is None:
+            return None
+        arrays, _ = loaded
+        strings = lambda name: \
+            arraystore.stored_strings(arrays, name).tolist()
+        pathways, genes = strings("pathways"), strings("genes")
+        indices = arrays["indices"]
+        matrix = scipy.sparse.csr_matrix(
+            (numpy.ones(len(indices), dtype=bool), indices, arrays["indptr"]),
+            shape=(len(pathways), len(genes)))
+        entry_arrays = dict((name, arrays["entry_" + name])
+                            for name in ["pathway", "id", "coords"])
+        return cls(pathways, strings("titles"), genes, matrix, entry_arrays,
+                   strings("entry_types"), strings("entry_names"),
+                   {"relations": arrays["relations"]},
+                   strings("relation_types"))
+
+    @classmethod
+    def for_organism(cls, org, callback=None):
+        """
+        Return the index of all the pathways of the KEGG organism `org`.
+
+        The index is built (from the locally cached KGML files and
+        DBGET entries) on first use and stored in the KEGG cache
+        directory. The gene membership is taken from the GENE lists of
+        the DBGET pathway entries. Pathways without a KGML file have no entries or relations.
+
+        """
+        from . import databases
+        kegg = api.CachedKeggApi()
+        pathways = [p.entry_id for p in kegg.list_pathways(org)]
+        path = conf.params["cache.path"]
+        caching.touch_dir(path)
+        filename = os.path.join(path, "pathway_index_%s.bin" % org)
+        meta = {"format": cls.FORMAT, "org": org, "pathways": pathways}
+        index = cls.load(filename, meta)
+        if index is None:
+            def kgml(pathway_id):
+                text = _get_or_none(kegg, pathway_id + "/kgml")
+                if not text:
+                    return None
+                if isinstance(text, six.text_type):
+                    text = text.encode("utf-8")
+                return io.BytesIO(text)
+
+            def genes(pathway_id):
+                text = _get_or_none(kegg, pathway_id)
+                if not text:
+                    return []
+                return databases.PathwayEntry(text).gene or []
+
+            kegg.pre_cache(pathways)
+            index = cls.build(pathways, kgml, callback=callback, genes=genes)
+            try:
+                index.save(filename, meta)
+            except (IOError, OSError):
+                pass
+        return index
+
+    def gene_mask(self, genes):
+        """
+        Return a boolean array over :obj:`genes` marking the given
+        `genes` (genes not in the index are ignored).
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        index = self._gene_index
+        mask[[index[g] for g in genes if g in index]] = True
+        return mask
+
+    def pathway_genes(self, pathway_id):
+        """
+        Return a list of genes on the pathway `pathway_id`.
+        """
+        i = self._pathway_index[pathway_id]
+        start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+        return [self.genes[j] for j in self.matrix.indices[start:end]]
+
+    def counts(self, genes):
+        """
+        Return an array with the number of (unique) `genes` on each
+        pathway.
+        """
+        return self.matrix.dot(self.gene_mask(genes).astype(numpy.int32))
+
+    def _pathway_slice(self, pathway, array):
+        i = self._pathway_index[pathway]
+        return numpy.searchsorted(array, [i, i + 1])
+
+    def entries(self, pathway_id):
+        """
+        Return a list of (`id`, `type`, `name`, (`x`, `y`, `width`,
+        `height`)) tuples of all the entries on the pathway `pathway_id`.
+        """
+        start, end = self._pathway_slice(pathway_id,
+                                         self._entry_arrays["pathway"])
+        ids = self._entry_arrays["id"][start:end].tolist()
+        coords = self._entry_arrays["coords"][start:end].tolist()
+        return [(id, self._entry_types[start + i],
+                 self._entry_names[start + i], tuple(coords[i]))
+                for i, id in enumerate(ids)]
+
+    def relations(self, pathway_id):
+        """
+        Return a list of (`entry1`, `entry2`, `type`) tuples of all the
+        relations on the pathway `pathway_id`.
+        """
+        relations = self._relation_arrays["relations"]
+        start, end = self._pathway_slice(pathway_id, relations[:, 0])
+        return [(e1, e2, self._relation_types[start + i])
+                for i, (_, e1, e2) in enumerate(relations[start:end].tolist())]
+
+    def enrichment(self, genes, reference, prob=None):
+        """
+        Compute the enrichment of `genes` on all pathways at once.
+
+        Return a (`counts`, `reference_counts`, `p_values`) tuple of
+        arrays with the number of `genes` and `reference` genes on each
+        pathway, and the p-values (computed using `prob`, a
+        :class:`~orangecontrib.bio.utils.stats.Binomial` (default) or
+        :class:`~orangecontrib.bio.utils.stats.Hypergeometric`
+        instance).
+
+        """
+        from ..utils import stats
+        if prob is None:
+            prob = stats.Binomial()
+        genes = set(genes)
+        reference = set(reference)
+        counts = self.counts(genes)
+        ref_counts = self.counts(reference)
+        p_values = stats.p_values(prob, counts, len(reference), ref_counts,
+                                  len(genes))
+        return counts, ref_counts, numpy.asarray(p_values, dtype=float)
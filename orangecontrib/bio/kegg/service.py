@@ -3,6 +3,14 @@
 """
 from __future__ import absolute_import
 
+import socket
+import threading
+import time
+
+import six
+from six.moves import http_client, queue
+from six.moves.urllib.parse import urlsplit, quote
+
 REST_API = "http://rest.kegg.jp/"
 
 
@@ -29,6 +37,182 @@ def slumber_service():
 
 from . import conf
 
+
+class RateLimiter(object):
+    """
+    Space out calls to :func:`wait` (from any number of threads) to at most
+    `rate` per second. A `rate` of 0 or ``None`` disables the limit.
+
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class ServiceError(IOError):
+    """
+    A KEGG REST request failed (after all retries).
+    """
+
+
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class BatchFetcher(object):
+    """
+    Concurrently retrieve KEGG REST ``get`` requests.
+
+    Requests are made from a bounded pool of `workers` threads, each
+    reusing a single (keep-alive) HTTP connection, and are globally
+    limited to `rate_limit` requests per second. Failed requests
+    (connection errors and 429/5xx responses) are retried up to
+    `retries` times with an exponential backoff (`backoff`,
+    ``2 * backoff``, ...  seconds).
+
+    Unspecified parameters are taken from :mod:`.conf` (``service.*``).
+
+    """
+    def __init__(self, base_url=None, workers=None, rate_limit=None,
+                 retries=None, backoff=0.5, timeout=60):
+        params = conf.params
+        if base_url is None:
+            base_url = REST_API
+        if workers is None:
+            workers = int(params["service.workers"])
+        if rate_limit is None:
+            rate_limit = float(params["service.rate_limit"])
+        if retries is None:
+            retries = int(params["service.retries"])
+
+        url = urlsplit(base_url)
+        if url.scheme == "https":
+            self._connection_class = http_client.HTTPSConnection
+        else:
+            self._connection_class = http_client.HTTPConnection
+        self.netloc = url.netloc
+        self.path = url.path.rstrip("/") + "/"
+        self.workers = max(workers, 1)
+        self.limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        con = getattr(self._local, "connection", None)
+        if con is None:
+            con = self._connection_class(self.netloc, timeout=self.timeout)
+            self._local.connection = con
+        return con
+
+    def _reset(self):
+        con = getattr(self._local, "connection", None)
+        if con is not None:
+            con.close()
+        self._local.connection = None
+
+    def request(self, path):
+        """
+        Return the response body for (the base url relative) `path` as
+        text or ``None`` if the service responds with 404 (Not Found).
+        """
+        path = self.path + path
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.limiter.wait()
+            try:
+                con = self._connection()
+                con.request("GET", path)
+                response = con.getresponse()
+                body = response.read()
+            except (http_client.HTTPException, socket.error) as err:
+                self._reset()
+                error = err
+                continue
+
+            if response.getheader("connection", "").lower() == "close":
+                self._reset()
+
+            if response.status == 200:
+                return body.decode("utf-8")
+            elif response.status == 404:
+                return None
+            error = "HTTP %i %s" % (response.status, response.reason)
+            if response.status not in _RETRY_STATUS:
+                break
+
+        raise ServiceError("Request for %r failed (%s)" % (path, error))
+
+    def get(self, ids):
+        """
+        Retrieve the database entries for the `ids` list as text (or
+        ``None`` if none are found).
+        """
+        if not isinstance(ids, six.string_types):
+            ids = "+".join(ids)
+        return self.request("get/" + quote(ids, safe=":+"))
+
+    def get_many(self, batches):
+        """
+        Retrieve all the id `batches` concurrently. Return an iterator
+        over ``(batch, text)`` tuples in the order of completion.
+
+        The first failed request is raised from the iterator after all the
+        other batches have been retrieved.
+
+        """
+        batches = list(batches)
+        tasks = queue.Queue()
+        results = queue.Queue()
+        for batch in batches:
+            tasks.put(batch)
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        batch = tasks.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        results.put((batch, self.get(batch), None))
+                    except Exception as err:
+                        results.put((batch, None, err))
+            finally:
+                self._reset()
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(self.workers, len(batches)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        error = None
+        for _ in range(len(batches)):
+            batch, text, err = results.get()
+            if err is not None:
+                error = error or err
+            else:
+                yield batch, text
+
+        for t in threads:
+            t.join()
+        if error is not None:
+            raise error
+
+
 default_service = slumber_service
 
 web_service = slumber_service
@@ -0,0 +1,115 @@
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from contextlib import closing
+
+from orangecontrib.bio.kegg import caching
+
+
+class TestSqlite3Store(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "cache.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_mapping(self):
+        for compress in [False, True]:
+            with closing(caching.Sqlite3Store(self.filename,
+                                              compress=compress)) as store:
+                store["a"] = caching.cache_entry("A" * 1000)
+                store.set_many([("b", [1, 2]), ("c", None)])
+                self.assertEqual(len(store), 3)
+                self.assertEqual(sorted(store), ["a", "b", "c"])
+                self.assertEqual(store["a"].value, "A" * 1000)
+                self.assertEqual(store["b"], [1, 2])
+                self.assertIn("c", store)
+                self.assertNotIn("d", store)
+                self.assertRaises(KeyError, store.__getitem__, "d")
+                self.assertEqual(store.get("d", 1), 1)
+                if compress:
+                    self.assertLess(store.size(), 500)
+                del store["c"]
+                self.assertEqual(sorted(store.keys()), ["a", "b"])
+
+        with closing(caching.Sqlite3Store(self.filename)) as store:
+            journal = store.con.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal.lower(), "wal")
+
+    def test_transaction(self):
+        with closing(caching.Sqlite3Store(self.filename)) as store:
+            with store.transaction():
+                store["a"] = 1
+                store["b"] = 2
+                # not visible to other connections before the commit
+                with closing(caching.Sqlite3Store(self.filename)) as other:
+                    self.assertEqual(len(other), 0)
+            try:
+                with store.transaction():
+                    store["c"] = 3
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertEqual(sorted(store), ["a", "b"])
+
+    def test_eviction(self):
+        value = os.urandom(1000)
+        store = caching.Sqlite3Store(self.filename, max_size=10000)
+        for i in range(9):
+            store[str(i)] = value
+        store.close()
+
+        store = caching.Sqlite3Store(self.filename, max_size=10000)
+        store["0"]
+        store.close()
+
+        store = caching.Sqlite3Store(self.filename, max_size=10000)
+        store.set_many([("9", value), ("10", value)])
+        store.close()
+
+        with closing(caching.Sqlite3Store(self.filename)) as store:
+            self.assertLessEqual(store.size(), 9000)
+            # the least recently used entries were evicted
+            self.assertEqual(sorted(store, key=int),
+                             ["0", "4", "5", "6", "7", "8", "9", "10"])
+
+        with closing(caching.Sqlite3Store(self.filename, ttl=60)) as store:
+            store.con.execute("UPDATE cache SET mtime=? WHERE key='0'",
+                              (time.time() - 120,))
+            self.assertNotIn("0", store)
+            self.assertRaises(KeyError, store.__getitem__, "0")
+            self.assertEqual(len(store), 7)
+            store["1"] = 1
+        with closing(caching.Sqlite3Store(self.filename)) as store:
+            self.assertNotIn("0", store)
+            # the maintained total matches the stored values
+            self.assertEqual(store.size(), store.con.execute(
+                "SELECT SUM(size) FROM cache").fetchone()[0])
+
+    def test_upgrade(self):
+        con = sqlite3.connect(self.filename)
+        con.execute("CREATE TABLE cache (key TEXT UNIQUE, value TEXT)")
+        con.execute("INSERT INTO cache VALUES (?, ?)",
+                    ("a", pickle.dumps("A", 0)))
+        con.commit()
+        con.close()
+        with closing(caching.Sqlite3Store(self.filename, ttl=60)) as store:
+            self.assertEqual(store["a"], "A")
+            self.assertGreater(store.size(), 0)
+            # an existing database is switched to WAL mode
+            journal = store.con.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal.lower(), "wal")
+            store["a"] = "AA"
+            store["b"] = "B"
+            del store["b"]
+            self.assertEqual(store.size(), store.con.execute(
+                "SELECT SUM(size) FROM cache").fetchone()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ import doctest
 import unittest
 
 from orangecontrib.bio.kegg.entry import parser, fields, DBEntry, entry_decorate
+from orangecontrib.bio.kegg import databases
 
 
 TEST_ENTRY = """\
@@ -34,6 +35,62 @@ class TestEntry(unittest.TestCase):
         self.assertEqual(str(entry), TEST_ENTRY[:-4])
 
 
+GENE_ENTRIES = """\
+ENTRY       7157              CDS       T01001
+NAME        TP53, BCC7, LFS1, P53
+DEFINITION  tumor protein p53
+PATHWAY     hsa04110  Cell cycle
+            hsa04115  p53 signaling pathway
+DBLINKS     NCBI-GeneID: 7157
+            HGNC: 11998
+            UniProt: P04637 K7PPA8
+            Ensembl: ENSG00000141510
+///
+ENTRY       672               CDS       T01001
+NAME        BRCA1
+DEFINITION  BRCA1, DNA repair associated
+DBLINKS     NCBI-GeneID: 672
+///
+ENTRY       999               CDS       T01001
+DEFINITION  no name
+///
+"""
+
+
+class TestLazyEntry(unittest.TestCase):
+    def test_lazy(self):
+        texts = [t + "///\n" for t in GENE_ENTRIES.split("///\n")[:-1]]
+        for text in texts + [TEST_ENTRY]:
+            eager = databases.GeneEntry(text)
+            lazy = databases.GeneEntry(text, lazy=True)
+            for name in ["entry", "name", "pathway", "dblinks"]:
+                self.assertEqual(getattr(lazy, name), getattr(eager, name))
+            self.assertEqual(lazy.aliases(), eager.aliases())
+            self.assertEqual(lazy.entry_key, eager.entry_key)
+            self.assertEqual(str(lazy), str(eager))
+
+        entry = Entry(TEST_ENTRY, lazy=True)
+        self.assertEqual(entry.DESCRIPTION.subsections[0].TITLE, "SUB")
+        self.assertNotIn("NAME", entry.__dict__)
+        self.assertEqual([f.TITLE for f in entry.fields],
+                         ["ENTRY", "NAME", "DESCRIPTION"])
+        self.assertEqual(entry.NAME.text, "test\n")
+
+    def test_extract_fields(self):
+        values = databases.GeneEntry.extract_fields(
+            GENE_ENTRIES, ["ENTRY", "NAME", "DBLINKS"])
+        self.assertEqual(len(values), 3)
+        texts = GENE_ENTRIES.split("///\n")
+        for value, text in zip(values, texts):
+            entry = databases.GeneEntry(text + "///\n")
+            self.assertEqual(value, {"ENTRY": entry.entry,
+                                     "NAME": entry.name,
+                                     "DBLINKS": entry.dblinks})
+        self.assertEqual(values[0]["DBLINKS"]["UniProt"],
+                         ["P04637", "K7PPA8"])
+        self.assertIsNone(values[2]["NAME"])
+
+
 class TestParser(unittest.TestCase):
     def test_parser(self):
         parse = parser.DBGETEntryParser()
@@ -0,0 +1,181 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+import numpy
+
+from orangecontrib.bio.kegg import pathway, conf
+from orangecontrib.bio.utils import stats
+
+
+KGML = {
+    "path:xyz00001": b"""\
+<?xml version="1.0"?>
+<!DOCTYPE pathway SYSTEM "https://www.kegg.jp/kegg/xml/KGML_v0.7.2_.dtd">
+<pathway name="path:xyz00001" org="xyz" number="00001" title="First">
+    <entry id="1" name="xyz:1 xyz:2" type="gene">
+        <graphics name="A" x="10" y="20" width="46" height="17"/>
+    </entry>
+    <entry id="2" name="xyz:3" type="gene">
+        <graphics name="B" x="30" y="40" width="46" height="17"/>
+    </entry>
+    <entry id="3" name="cpd:C00001" type="compound">
+        <graphics name="C" type="circle" x="5" y="5" width="8" height="8"/>
+    </entry>
+    <entry id="4" name="undefined" type="group">
+        <graphics type="line" coords="1,2,3,4"/>
+        <component id="1"/>
+        <component id="2"/>
+    </entry>
+    <relation entry1="1" entry2="2" type="PPrel">
+        <subtype name="activation" value="--&gt;"/>
+    </relation>
+    <reaction id="5" name="rn:R00001" type="reversible">
+        <substrate id="3" name="cpd:C00001"/>
+    </reaction>
+</pathway>
+""",
+    "path:xyz00002": b"""\
+<?xml version="1.0"?>
+<pathway name="path:xyz00002" org="xyz" number="00002" title="Second">
+    <entry id="7" name="xyz:3 xyz:4" type="gene">
+        <graphics x="1" y="2" width="3" height="4"/>
+    </entry>
+    <relation entry1="7" entry2="7" type="ECrel"/>
+</pathway>
+""",
+    "path:xyz00003": None,
+}
+
+
+def kgml(pathway_id):
+    text = KGML[pathway_id]
+    return io.BytesIO(text) if text is not None else None
+
+
+DBGET = {
+    "path:xyz00001": "ENTRY       xyz00001          Pathway\n"
+                     "ORGANISM    Xyz [GN:xyz]\n"
+                     "GENE        1  A\n"
+                     "            5  E\n"
+                     "///\n",
+    "path:xyz00003": "ENTRY       xyz00003          Pathway\n"
+                     "ORGANISM    Xyz [GN:xyz]\n"
+                     "GENE        6  F\n"
+                     "///\n",
+}
+
+
+class NotFound(Exception):
+    # like slumber's HttpNotFoundError
+    response = mock.Mock(status_code=404)
+
+
+class FakeKeggApi(object):
+    def list_pathways(self, org):
+        return [mock.Mock(entry_id=p) for p in sorted(KGML)]
+
+    def pre_cache(self, ids, **kwargs):
+        pass
+
+    def get(self, id):
+        if id.endswith("/kgml"):
+            text = KGML[id[:-len("/kgml")]]
+        else:
+            text = DBGET.get(id)
+        if text is None:
+            raise NotFound(id)
+        return text
+
+
+class TestPathwayIndex(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parse(self):
+        attributes, entries, relations = pathway.parse_kgml(
+            kgml("path:xyz00001"))
+        self.assertEqual(attributes["title"], "First")
+        self.assertEqual([e["id"] for e in entries], ["1", "2", "3", "4"])
+        self.assertEqual(entries[0]["graphics"]["x"], "10")
+        self.assertEqual(entries[3]["components"], ["1", "2"])
+        self.assertEqual(relations, [("1", "2", "PPrel",
+                                      [("activation", "-->")])])
+
+    def test_index(self):
+        pathways = sorted(KGML)
+        index = pathway.PathwayIndex.build(pathways, kgml)
+        filename = os.path.join(self.path, "index.bin")
+        index.save(filename, {"org": "xyz"})
+        self.assertIsNone(pathway.PathwayIndex.load(filename, {"org": "a"}))
+        loaded = pathway.PathwayIndex.load(filename, {"org": "xyz"})
+
+        for index in [index, loaded]:
+            self.assertEqual(index.pathways, pathways)
+            self.assertEqual(index.titles, ["First", "Second", ""])
+            self.assertEqual(index.genes, ["xyz:1", "xyz:2", "xyz:3",
+                                           "xyz:4"])
+            self.assertEqual(index.matrix.toarray().tolist(),
+                             [[True, True, True, False],
+                              [False, False, True, True],
+                              [False, False, False, False]])
+            self.assertEqual(index.pathway_genes("path:xyz00002"),
+                             ["xyz:3", "xyz:4"])
+            entries = index.entries("path:xyz00001")
+            self.assertEqual(entries[0], (1, "gene", "xyz:1 xyz:2",
+                                          (10.0, 20.0, 46.0, 17.0)))
+            self.assertTrue(numpy.isnan(entries[3][3][0]))
+            self.assertEqual(index.entries("path:xyz00003"), [])
+            self.assertEqual(index.relations("path:xyz00001"),
+                             [(1, 2, "PPrel")])
+            self.assertEqual(index.relations("path:xyz00002"),
+                             [(7, 7, "ECrel")])
+
+    def test_for_organism(self):
+        # path:xyz00003 has no KGML (404) and path:xyz00002 no DBGET entry
+        params = dict(conf.params, **{"cache.path": self.path})
+        with mock.patch.object(pathway.api, "CachedKeggApi", FakeKeggApi), \
+                mock.patch.dict(conf.params, params):
+            index = pathway.PathwayIndex.for_organism("xyz")
+        self.assertEqual(index.pathways, sorted(KGML))
+        self.assertEqual(index.titles, ["First", "Second", ""])
+        # membership from the DBGET GENE lists
+        self.assertEqual(index.pathway_genes("path:xyz00001"),
+                         ["xyz:1", "xyz:5"])
+        self.assertEqual(index.pathway_genes("path:xyz00002"), [])
+        self.assertEqual(index.pathway_genes("path:xyz00003"), ["xyz:6"])
+        self.assertEqual(index.entries("path:xyz00003"), [])
+        self.assertEqual(len(index.entries("path:xyz00001")), 4)
+
+        # other errors are not ignored
+        kegg = FakeKeggApi()
+        kegg.get = mock.Mock(side_effect=IOError)
+        self.assertRaises(IOError, pathway._get_or_none, kegg, "path:x")
+
+    def test_enrichment(self):
+        index = pathway.PathwayIndex.build(sorted(KGML), kgml)
+        genes = ["xyz:1", "xyz:3", "other"]
+        reference = ["xyz:%i" % i for i in range(1, 10)]
+        for prob in [stats.Binomial(), stats.Hypergeometric()]:
+            counts, ref_counts, p = index.enrichment(genes, reference, prob)
+            self.assertEqual(counts.tolist(), [2, 1, 0])
+            self.assertEqual(ref_counts.tolist(), [3, 2, 0])
+            expected = [prob.p_value(k, 9, m, 3)
+                        for k, m in zip(counts, ref_counts)]
+            numpy.testing.assert_allclose(p, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
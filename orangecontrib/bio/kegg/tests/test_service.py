@@ -0,0 +1,133 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+from six.moves import BaseHTTPServer
+
+from orangecontrib.bio.kegg import api as keggapi
+from orangecontrib.bio.kegg import conf as keggconf
+from orangecontrib.bio.kegg import service
+
+
+ENTRY = """\
+ENTRY       {0}               CDS       T01001
+NAME        G{0}
+///
+"""
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address))
+            fail = server.failures > 0
+            server.failures -= 1
+        if fail:
+            self.respond(503, b"")
+            return
+        ids = self.path.split("/get/", 1)[1].split("+")
+        ids = [i.split(":", 1)[1] for i in ids if not i.endswith("missing")]
+        if ids:
+            self.respond(200, "".join(ENTRY.format(i) for i in ids).encode())
+        else:
+            self.respond(404, b"")
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBatchFetcher(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%i/kegg/" % self.server.server_port
+
+        self.path = tempfile.mkdtemp()
+        self._cache_path = keggconf.params["cache.path"]
+        keggconf.params["cache.path"] = self.path
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        keggconf.params["cache.path"] = self._cache_path
+        shutil.rmtree(self.path)
+
+    def fetcher(self, **kwargs):
+        params = dict(workers=2, rate_limit=0, retries=2, backoff=0.01)
+        params.update(kwargs)
+        return service.BatchFetcher(self.url, **params)
+
+    def test_get_many(self):
+        fetcher = self.fetcher()
+        batches = [["hsa:%i" % (10 * b + i) for i in range(10)]
+                   for b in range(6)]
+        batches.append(["hsa:missing"])
+        results = dict((tuple(b), text) for b, text in
+                       fetcher.get_many(batches))
+        self.assertEqual(len(results), 7)
+        self.assertIsNone(results[("hsa:missing",)])
+        self.assertEqual(results[tuple(batches[1])].count("///\n"), 10)
+        self.assertTrue(self.server.requests[0][0].startswith("/kegg/get/"))
+        # at most one (keep-alive) connection per worker
+        clients = set(addr for _, addr in self.server.requests)
+        self.assertLessEqual(len(clients), 2)
+
+    def test_retry(self):
+        self.server.failures = 2
+        fetcher = self.fetcher(workers=1)
+        self.assertEqual(fetcher.get(["hsa:1"]), ENTRY.format(1))
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.server.failures = 3
+        with self.assertRaises(service.ServiceError):
+            fetcher.get(["hsa:1"])
+
+    def test_rate_limit(self):
+        limiter = service.RateLimiter(50)
+        start = time.time()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - start, 0.075)
+
+    def test_pre_cache(self):
+        with mock.patch("orangecontrib.bio.kegg.api.web_service",
+                        lambda: None):
+            api = keggapi.CachedKeggApi()
+        ids = ["hsa:%i" % i for i in range(25)]
+        progress = []
+        api.pre_cache(ids, progress_callback=progress.append,
+                      fetcher=self.fetcher(), commit_size=7)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(progress[-1], 100.0)
+
+        # all entries are served from the cache
+        self.assertEqual(api.get(ids[3:5]), ENTRY.format(3) + ENTRY.format(4))
+        api.pre_cache(ids, fetcher=self.fetcher())
+        self.assertEqual(len(self.server.requests), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
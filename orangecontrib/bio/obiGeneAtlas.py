@@ -35,6 +35,7 @@ from contextlib import closing, contextmanager
 from Orange.utils import serverfiles
 
 from . import obiGene
+from .utils import httpcache
 
 GeneResults = namedtuple("GeneResults", "id name synonyms expressions")
 ExpressionResults = namedtuple("ExpressionResults", "ef efv up down experiments")
@@ -327,7 +328,7 @@ that are up regulated in the liver in at least three experiments) ::
 """
 
 import urllib2
-from io import StringIO
+from io import BytesIO
 import json
 from xml.etree.ElementTree import ElementTree
 
@@ -349,12 +350,14 @@ class GeneExpressionAtlasConenction(object):
     :param timeout:
         Socket timeout (default 30).
     :param cache:
-        A dict like object to use as a cache.
+        A response cache directory, a :class:`~.utils.httpcache.HTTPCache`
+        or a dict like object to use as a cache.
 
     """
     DEFAULT_ADDRESS = "http://www-test.ebi.ac.uk/gxa/api/deprecated"
-    DEFAULT_CACHE = serverfiles.localpath(
-        "GeneAtlas", "GeneAtlasConnectionCache.shelve")
+    DEFAULT_CACHE = serverfiles.localpath("GeneAtlas", "http-cache")
+    DEFAULT_CACHE_SIZE = 2 ** 28
+    DEFAULT_CACHE_TTL = 24 * 60 * 60
 
     def __init__(self, address=None, timeout=30, cache=None):
 
@@ -383,56 +386,45 @@ class GeneExpressionAtlasConenction(object):
 
     def _query_cached(self, url, format):
         if self.cache is not None:
-            with self.open_cache("r") as cache:
-                if url in cache:
-                    return StringIO(cache[url])
-
-            response = urllib2.urlopen(url)
-            contents = response.read()
             # Test if the contents is a valid json or xml string (some
             # times the stream just stops in the middle, so this makes
             # sure we don't cache an invalid response
             # TODO: what about errors (e.g. 'cannot handle the
             # query in a timely fashion'
-            if format == "json":
-                parse_json(StringIO(contents))
-            else:
-                parse_xml(StringIO(contents))
+            def validate(contents):
+                if format == "json":
+                    parse_json(BytesIO(contents))
+                else:
+                    parse_xml(BytesIO(contents))
 
             with self.open_cache("w") as cache:
-                cache[url] = contents
-
-            return StringIO(contents)
+                if isinstance(cache, httpcache.HTTPCache):
+                    return cache.urlopen(url, timeout=self.timeout,
+                                         validate=validate)
+                if url not in cache:
+                    contents = urllib2.urlopen(url).read()
+                    validate(contents)
+                    cache[url] = contents
+                return BytesIO(cache[url])
         else:
             return urllib2.urlopen(url)
 
     def open_cache(self, flag="r"):
         """
-        Return a context manager for a dict like object.
+        Return a context manager for a dict like object (or an
+        :class:`~.utils.httpcache.HTTPCache`).
         """
         if isinstance(self.cache, basestring):
             try:
-                return closing(_open_shelve(self.cache, flag))
+                return fake_closing(httpcache.shared(
+                    self.cache, max_size=self.DEFAULT_CACHE_SIZE,
+                    ttl=self.DEFAULT_CACHE_TTL))
             except Exception:
                 return fake_closing({})
         else:
             return fake_closing(self.cache)
 
 
-def _open_shelve(filename, flag="r"):
-    dirname = os.path.dirname(filename)
-    if not os.path.isdir(dirname):
-        os.makedirs(dirname)
-    exists = os.path.exists(filename)
-    if flag in ["r", "w"] and not exists:
-        # needs to be created first
-        # XXX: Race condition
-        s = shelve.open(filename, "c")
-        s.close()
-
-    return shelve.open(filename, flag)
-
-
 @contextmanager
 def fake_closing(obj):
     yield obj
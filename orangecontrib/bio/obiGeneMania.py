@@ -450,7 +450,7 @@ from . import obiPPI
 from Orange.orng import orngServerFiles
 
 from . import obiTaxonomy
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 from operator import itemgetter
 from Orange.utils import lru_cache
 
@@ -646,7 +646,45 @@ class GeneManiaDatabase(obiPPI.PPIDatabase):
             """, (id,))
         res += cur.fetchall()
         return [GeneManiaInteraction(*r) for r in res]
-    
+
+    def graph(self, taxid=None):
+        """ Return a :class:`~.ppi.PPIGraph` of all the links (the
+        largest weight over all networks is used for each pair of genes).
+
+        """
+        def edges():
+            con = self._db(self.taxid)
+            cur = con.execute("""\
+                SELECT links.gene_a, links.gene_b, links.weight
+                FROM links""")
+            id_to_name = self._gene_id_to_name()
+            return [(id_to_name[a], id_to_name[b], w) for a, b, w in cur]
+
+        filename = orngServerFiles.localpath_download(
+            "PPI", self.SERVER_FILE.format(taxid=self.taxid))
+        return self._cached_graph(filename, lambda: self.ids(self.taxid),
+                                  edges, {"taxid": self.taxid})
+    
+    def network_graphs(self):
+        """ Return a dictionary mapping network names to
+        :class:`~.ppi.PPIGraph` of their links (e.g. for a
+        :class:`~.ppi.NetworkPropagation` with per network weights).
+
+        """
+        con = self._db(self.taxid)
+        cur = con.execute("""\
+            SELECT links.gene_a, links.gene_b, links.weight, links.network_id
+            FROM links""")
+        id_to_name = self._gene_id_to_name()
+        network_to_description = self._network_id_to_description()
+        edges = defaultdict(list)
+        for gene_a, gene_b, w, n_id in cur:
+            edges[network_to_description[n_id][0]].append(
+                (id_to_name[gene_a], id_to_name[gene_b], w))
+        ids = self.ids(self.taxid)
+        return dict((name, obiPPI.PPIGraph.from_edges(links, ids))
+                    for name, links in edges.items())
+
     def search_id(self, name, taxid=None):
         """ Search the database for gene name. Return a list of matching 
         primary ids. Use `taxid` to limit the results to a single organism.
@@ -51,9 +51,11 @@ import keyword
 import operator
 
 from functools import reduce
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import six
+import numpy
+import scipy.sparse
 
 from six import StringIO
 
@@ -575,6 +577,170 @@ class OBOParser(object):
         return self.parse()
 
 
+def _csr_from_lists(lists, n):
+    indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum([len(l) for l in lists], out=indptr[1:])
+    if lists:
+        indices = numpy.concatenate(
+            [numpy.asarray(l, dtype=numpy.int32) for l in lists] +
+            [numpy.zeros(0, dtype=numpy.int32)])
+    else:
+        indices = numpy.zeros(0, dtype=numpy.int32)
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices), dtype=bool), indices, indptr),
+        shape=(n, n))
+
+
+class ClosureIndex(object):
+    """
+    A precomputed transitive closure of the (term -> parent) relation
+    of an ontology.
+
+    The ancestors and descendants of every term are stored as sorted
+    index arrays (in a CSR layout), so listing them takes O(k) time (k
+    being the number of returned terms) and testing whether a term is an
+    ancestor of another takes O(log k). The index is built in a single
+    pass over the terms in topological order.
+
+    :param list ids: Term ids.
+    :param list parents:
+        A list of (direct) parent indices (into `ids`) for each term.
+
+    """
+    def __init__(self, ids, parents):
+        self.ids = list(ids)
+        self.index = dict((id, i) for i, id in enumerate(self.ids))
+        n = len(self.ids)
+        parents = [numpy.unique(numpy.asarray(p, dtype=numpy.int32))
+                   for p in parents]
+        self._parents = _csr_from_lists(parents, n)
+        self._children = self._parents.T.tocsr()
+        self._children.sort_indices()
+        self._ancestors = _csr_from_lists(self._closure(parents), n)
+        self._descendants = self._ancestors.T.tocsr()
+        self._descendants.sort_indices()
+        self._depth = self._depths()
+
+    def _closure(self, parents):
+        n = len(parents)
+        children = self._children
+        remaining = numpy.diff(self._parents.indptr)
+        ancestors = [None] * n
+        queue = deque(numpy.flatnonzero(remaining == 0).tolist())
+        while queue:
+            i = queue.popleft()
+            p = parents[i]
+            if len(p):
+                ancestors[i] = numpy.unique(numpy.concatenate(
+                    [p] + [ancestors[j] for j in p]))
+            else:
+                ancestors[i] = p
+            for c in children.indices[children.indptr[i]:
+                                      children.indptr[i + 1]].tolist():
+                remaining[c] -= 1
+                if remaining[c] == 0:
+                    queue.append(c)
+
+        # Terms on (or below) a cycle were not reached in topological
+        # order; collect their ancestors by a search.
+        for i in [i for i in range(n) if ancestors[i] is None]:
+            visited = set()
+            stack = parents[i].tolist()
+            while stack:
+                j = stack.pop()
+                if j in visited:
+                    continue
+                visited.add(j)
+                if ancestors[j] is not None:
+                    visited.update(ancestors[j].tolist())
+                else:
+                    stack.extend(parents[j].tolist())
+            visited.discard(i)
+            ancestors[i] = numpy.array(sorted(visited), dtype=numpy.int32)
+        return ancestors
+
+    def _depths(self):
+        # Breadth first search from the root terms along child edges.
+        n = len(self.ids)
+        depth = numpy.zeros(n, dtype=numpy.int32)
+        frontier = numpy.flatnonzero(numpy.diff(self._parents.indptr) == 0)
+        level = 1
+        while len(frontier):
+            depth[frontier] = level
+            level += 1
+            frontier = numpy.unique(self._children[frontier].indices)
+            frontier = frontier[depth[frontier] == 0]
+        return depth
+
+    @staticmethod
+    def _row(matrix, i):
+        return matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+
+    def _ids(self, indices):
+        ids = self.ids
+        return [ids[i] for i in indices.tolist()]
+
+    def _rows(self, matrix, terms):
+        rows = [self._row(matrix, self.index[term]) for term in terms]
+        if not rows:
+            return numpy.zeros(0, dtype=numpy.int32)
+        return numpy.unique(numpy.concatenate(rows))
+
+    def parents(self, term):
+        """Return a list of direct parents of `term`."""
+        return self._ids(self._row(self._parents, self.index[term]))
+
+    def children(self, term):
+        """Return a list of direct children of `term`."""
+        return self._ids(self._row(self._children, self.index[term]))
+
+    def ancestors(self, term):
+        """Return a list of all (transitive) ancestors of `term`."""
+        return self._ids(self._row(self._ancestors, self.index[term]))
+
+    def descendants(self, term):
+        """Return a list of all (transitive) descendants of `term`."""
+        return self._ids(self._row(self._descendants, self.index[term]))
+
+    def super_graph(self, terms):
+        """Return a set of `terms` and all their ancestors."""
+        return set(self._ids(self._rows(self._ancestors, terms))) | \
+            set(terms)
+
+    def sub_graph(self, terms):
+        """Return a set of `terms` and all their descendants."""
+        return set(self._ids(self._rows(self._descendants, terms))) | \
+            set(terms)
+
+    def is_ancestor(self, ancestor, term):
+        """Return `True` if `ancestor` is a (transitive) ancestor of `term`.
+        """
+        row = self._row(self._ancestors, self.index[term])
+        i = self.index[ancestor]
+        pos = numpy.searchsorted(row, i)
+        return bool(pos < len(row) and row[pos] == i)
+
+    def depth(self, term):
+        """
+        Return the minimum depth of `term` (the length of the shortest path
+        to it from a root term, which has depth 1). Terms on a cycle not
+        reachable from any root have depth 0.
+        """
+        return int(self._depth[self.index[term]])
+
+    def ancestor_mask(self, terms):
+        """
+        Return a boolean array over :obj:`ids` marking the terms that are
+        in `terms` or have an ancestor in `terms`.
+        """
+        mask = numpy.zeros(len(self.ids), dtype=bool)
+        ind = [self.index[t] for t in terms if t in self.index]
+        mask[ind] = True
+        mask[self._rows(self._descendants,
+                        [t for t in terms if t in self.index])] = True
+        return mask
+
+
 class OBOOntology(object):
     """
     An class representing an OBO ontology.
@@ -594,6 +760,7 @@ class OBOOntology(object):
         self._resolved_imports = []
         self._invalid_cache_flag = False
         self._related_to = {}
+        self._closure = None
 
         # First load the built in OBO objects
         builtins = StringIO("\n" + "\n\n".join(self.BUILTINS) + "\n")
@@ -727,8 +894,26 @@ class OBOOntology(object):
                 related_to[term].append((rel_type, obj))
 
         self._related_to = related_to
+        self._closure = None
         self._invalid_cache_flag = False
 
+    def closure_index(self):
+        """
+        Return a :class:`ClosureIndex` of the (term -> parent) relations
+        of all objects in the ontology (built on first use).
+        """
+        self._cache_validate()
+        if self._closure is None:
+            ids = [obj.id for obj in self.objects]
+            index = dict((id, i) for i, id in enumerate(ids))
+            index.update((alt, index[id]) for alt, id in self.alt2id.items()
+                         if id in index)
+            parents = [[index[id] for _, id in self.related_terms(obj)
+                        if id in index]
+                       for obj in self.objects]
+            self._closure = ClosureIndex(ids, parents)
+        return self._closure
+
     def term(self, id):
         """
         Return the :class:`OBOObject` associated with this id.
@@ -824,27 +1009,31 @@ class OBOOntology(object):
         """
         Return a set of all super terms of `term` up to the most general one.
         """
-        terms = self.parent_terms(term)
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(self.parent_terms(term) - visited)
-        return visited
+        term = self.term(term)
+        return set(self.term(id) for id in
+                   self.closure_index().ancestors(term.id))
 
     def sub_terms(self, term):
         """
         Return a set of all sub terms for `term`.
         """
-        terms = self.child_terms(term)
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(self.child_terms(term) - visited)
-        return visited
+        term = self.term(term)
+        return set(self.term(id) for id in
+                   self.closure_index().descendants(term.id))
+
+    def term_depth(self, term):
+        """
+        Return the minimum depth of `term` (the length of the shortest path
+        to it from a root term).
+        """
+        return self.closure_index().depth(self.term(term).id)
+
+    def is_super_term(self, super_term, term):
+        """
+        Return `True` if `super_term` is a (transitive) super term of `term`.
+        """
+        return self.closure_index().is_ancestor(self.term(super_term).id,
+                                                self.term(term).id)
 
     def child_terms(self, term):
         """
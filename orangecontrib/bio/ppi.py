@@ -14,13 +14,18 @@ import sqlite3
 import errno
 import posixpath
 import textwrap
+import io
+import multiprocessing
 
+from contextlib import contextmanager
 
 from io import StringIO, BytesIO
 from collections import defaultdict, namedtuple
 from operator import itemgetter
 
-from .utils import serverfiles
+import numpy
+
+from .utils import serverfiles, arraystore
 try:
     from Orange.utils import ConsoleProgressBar, wget
 except ImportError:
@@ -153,6 +158,34 @@ class PPIDatabase(object):
 
         return graph
 
+    def graph(self, taxid=None):
+        """
+        Return a :class:`PPIGraph` of all the interactions (for organism
+        `taxid` if not ``None``).
+        """
+        raise NotImplementedError
+
+    def _cached_graph(self, filename, ids, edges, meta=None):
+        """
+        Load a :class:`PPIGraph` of database `filename` from its cache or
+        build it from `ids` and `edges` (functions returning the node ids
+        and edges) and store it. The cache is rebuilt when the database
+        file changes.
+        """
+        if filename is None:
+            return PPIGraph.from_edges(edges(), ids())
+        meta = dict(meta or {}, format=PPIGraph.FORMAT,
+                    source=arraystore.file_stamp(filename))
+        cache = filename + "." + str(meta.get("taxid") or "all") + ".graph"
+        graph = PPIGraph.load(cache, meta)
+        if graph is None:
+            graph = PPIGraph.from_edges(edges(), ids())
+            try:
+                graph.save(cache, meta)
+            except (IOError, OSError):
+                pass
+        return graph
+
     @classmethod
     def download_data(self):
         """
@@ -161,6 +194,412 @@ class PPIDatabase(object):
         raise NotImplementedError
 
 
+class PPIGraph(object):
+    """
+    An undirected graph of protein interactions stored as integer
+    indexed compressed sparse row (CSR) adjacency arrays.
+
+    Use :func:`PPIDatabase.graph` to get the graph of a database.
+
+    :ivar list ids: Node (protein) ids.
+    :ivar indptr: CSR row pointers (an array of ``len(ids) + 1``).
+    :ivar indices: Neighbour node indices (sorted within each row).
+    :ivar scores: Edge scores (NaN if not available).
+
+    """
+    #: Format version of the stored graph.
+    FORMAT = 1
+
+    def __init__(self, ids, indptr, indices, scores):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self._index = dict((id, i) for i, id in enumerate(ids))
+
+    @classmethod
+    def from_edges(cls, edges, ids=None):
+        """
+        Build the graph from `edges` (a sequence of (id1, id2, score)
+        tuples). Edges are undirected; for multiple edges between the same
+        pair of nodes the largest score is used.
+
+        :param ids: The node ids (default: all the ids in `edges`). If
+            given, edges to other nodes are ignored.
+
+        """
+        edges = list(edges)
+        if ids is None:
+            ids = sorted(set(e[0] for e in edges) | set(e[1] for e in edges))
+        ids = list(ids)
+        index = dict((id, i) for i, id in enumerate(ids))
+        edges = [(index[id1], index[id2], score)
+                 for id1, id2, score in edges
+                 if id1 in index and id2 in index]
+        n = len(ids)
+        if edges:
+            a, b, scores = zip(*edges)
+        else:
+            a, b, scores = (), (), ()
+        a = numpy.array(a, dtype=numpy.int32)
+        b = numpy.array(b, dtype=numpy.int32)
+        scores = numpy.array([numpy.nan if s is None else s for s in scores],
+                             dtype=float)
+
+        # both directions, sorted by (row, column) with duplicates merged
+        rows = numpy.concatenate([a, b])
+        cols = numpy.concatenate([b, a])
+        scores = numpy.concatenate([scores, scores])
+        order = numpy.lexsort((cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        if len(rows):
+            first = numpy.ones(len(rows), dtype=bool)
+            first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            starts = numpy.flatnonzero(first)
+            scores = numpy.fmax.reduceat(scores, starts)
+            rows, cols = rows[starts], cols[starts]
+        indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rows, minlength=n), out=indptr[1:])
+        return cls(ids, indptr, cols, scores)
+
+    def save(self, filename, meta=None):
+        """
+        Save the graph (and JSON serializable `meta`) to `filename`.
+        """
+        arrays = {"indptr": self.indptr, "indices": self.indices,
+                  "scores": self.scores}
+        arraystore.store_strings(arrays, "ids", self.ids)
+        arraystore.save(filename, arrays, meta)
+
+    @classmethod
+    def load(cls, filename, meta=None):
+        """
+        Load a graph saved with :func:`save` (the arrays are memory
+        mapped). Return ``None`` if the file is missing or its metadata
+        does not contain all the items in `meta`.
+        """
+        loaded = arraystore.load_valid(filename, meta or {})
+        if loaded is None:
+            return None
+        arrays, _ = loaded
+        ids = arraystore.stored_strings(arrays, "ids").tolist()
+        return cls(ids, arrays["indptr"], arrays["indices"], arrays["scores"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def node_indices(self, ids):
+        """
+        Return an array of node indices of `ids` (unknown ids are
+        ignored).
+        """
+        index = self._index
+        return numpy.array([index[id] for id in ids if id in index],
+                           dtype=numpy.int64)
+
+    def _gather(self, nodes, min_score=None):
+        # Return (source, neighbour, score) arrays of all the edges of
+        # `nodes` (an array of node indices)
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        total = int(counts.sum())
+        offsets = numpy.repeat(starts - numpy.cumsum(counts) + counts,
+                               counts) + numpy.arange(total)
+        sources = numpy.repeat(nodes, counts)
+        neighbours = self.indices[offsets]
+        scores = self.scores[offsets]
+        if min_score is not None:
+            keep = scores >= min_score
+            sources, neighbours, scores = \
+                sources[keep], neighbours[keep], scores[keep]
+        return sources, neighbours, scores
+
+    def _edge_list(self, sources, neighbours, scores):
+        ids = self.ids
+        return [(ids[a], ids[b], None if score != score else score)
+                for a, b, score in zip(sources.tolist(), neighbours.tolist(),
+                                       scores.tolist())]
+
+    def edges(self, id, min_score=None):
+        """
+        Return a list of all edges (id, neighbour_id, score) of `id`.
+        """
+        return self._edge_list(
+            *self._gather(self.node_indices([id]), min_score))
+
+    def neighbours(self, ids, min_score=None):
+        """
+        Return a sorted list of all the neighbours of `ids` (not
+        including `ids`).
+        """
+        nodes = self.node_indices(ids)
+        _, neighbours, _ = self._gather(nodes, min_score)
+        neighbours = numpy.setdiff1d(neighbours, nodes)
+        return [self.ids[i] for i in neighbours]
+
+    def k_hop(self, ids, k=1, min_score=None):
+        """
+        Return a sorted list of all the nodes within `k` edges of `ids`
+        (including `ids`).
+        """
+        visited = numpy.zeros(len(self.ids), dtype=bool)
+        frontier = numpy.unique(self.node_indices(ids))
+        visited[frontier] = True
+        for _ in range(k):
+            if not len(frontier):
+                break
+            _, neighbours, _ = self._gather(frontier, min_score)
+            frontier = numpy.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        return [self.ids[i] for i in numpy.flatnonzero(visited)]
+
+    def subgraph(self, ids, min_score=None):
+        """
+        Return a list of all edges (id1, id2, score) between `ids` (the
+        induced subgraph). Each edge is reported once.
+        """
+        nodes = numpy.unique(self.node_indices(ids))
+        member = numpy.zeros(len(self.ids), dtype=bool)
+        member[nodes] = True
+        sources, neighbours, scores = self._gather(nodes, min_score)
+        keep = member[neighbours] & (sources < neighbours)
+        return self._edge_list(sources[keep], neighbours[keep], scores[keep])
+
+    def threshold(self, min_score):
+        """
+        Return a new graph with only the edges with score at least
+        `min_score`.
+        """
+        keep = self.scores >= min_score
+        rows = numpy.repeat(numpy.arange(len(self.ids)),
+                            numpy.diff(self.indptr))
+        indptr = numpy.zeros_like(self.indptr)
+        numpy.cumsum(numpy.bincount(rows[keep], minlength=len(self.ids)),
+                     out=indptr[1:])
+        return PPIGraph(self.ids, indptr, self.indices[keep],
+                        self.scores[keep])
+
+    def matrix(self, ids=None, min_score=None):
+        """
+        Return the (symmetric) weighted adjacency matrix of the graph as a
+        :class:`scipy.sparse.csr_matrix`. Edges without a score have
+        weight 1.
+
+        :param list ids: Node ids defining the rows/columns of the matrix
+            (default: :obj:`ids`). Nodes not in the graph have no edges
+            and edges to nodes not in `ids` are ignored.
+        :param float min_score: Only include edges with score at least
+            `min_score`.
+
+        """
+        import scipy.sparse
+
+        graph = self if min_score is None else self.threshold(min_score)
+        scores = numpy.where(numpy.isnan(graph.scores), 1.0, graph.scores)
+        n = len(graph.ids)
+        matrix = scipy.sparse.csr_matrix(
+            (scores, numpy.asarray(graph.indices), numpy.asarray(graph.indptr)),
+            shape=(n, n))
+        if ids is None or list(ids) == graph.ids:
+            return matrix
+
+        # map the graph's nodes to the positions in `ids`
+        position = dict((id, i) for i, id in enumerate(ids))
+        target = numpy.array([position.get(id, -1) for id in graph.ids],
+                             dtype=numpy.int64)
+        matrix = matrix.tocoo()
+        rows, cols = target[matrix.row], target[matrix.col]
+        keep = (rows >= 0) & (cols >= 0)
+        return scipy.sparse.csr_matrix(
+            (matrix.data[keep], (rows[keep], cols[keep])),
+            shape=(len(ids), len(ids)))
+
+
+class NetworkPropagation(object):
+    """
+    Score genes by propagating seed gene sets over one or more
+    (weighted) interaction networks.
+
+    Two methods are supported:
+
+      - ``"rwr"``: random walk with restart. Scores are the stationary
+        probabilities of a walk that follows the (column normalized)
+        edge weights and jumps back to a (uniformly chosen) seed gene
+        with probability `restart` at each step.
+      - ``"label"``: label propagation (Zhou et al., 2004; as used by
+        GeneMANIA) over the symmetrically normalized network with the
+        propagation strength ``1 - restart``.
+
+    Both compute the fixed point of ``F = (1 - restart) * M * F +
+    restart * Y`` by power iteration, where the columns of `Y` are the
+    seed gene sets. Many gene sets are propagated at once as a
+    (genes x sets) seed matrix, with a sparse-dense matrix product per
+    iteration.
+
+    :param graphs: A :class:`PPIGraph` or a list of graphs (e.g. one
+        for each source network).
+    :param list weights: Network weights (default: equal). The scores of
+        each network are scaled to a maximum of 1 before weighting.
+    :param str method: ``"rwr"`` or ``"label"``.
+    :param float restart: Restart probability (``0 < restart <= 1``).
+    :param float min_score: Ignore edges with lower scores.
+    :param float tol: Stop iterating when no score changes by more than
+        `tol`.
+    :param int max_iter: The maximum number of iterations.
+    :param int block_size: The number of seed sets propagated together.
+
+    Example::
+
+        >>> graph = STRING("9606").graph("9606")
+        >>> prop = NetworkPropagation(graph, restart=0.3)
+        >>> prop.rank([["9606.ENSP00000269305"]], n=5)
+
+    """
+    def __init__(self, graphs, weights=None, method="rwr", restart=0.5,
+                 min_score=None, tol=1e-6, max_iter=200, block_size=256):
+        import scipy.sparse
+
+        if isinstance(graphs, PPIGraph):
+            graphs = [graphs]
+        if weights is None:
+            weights = [1.0] * len(graphs)
+        if len(weights) != len(graphs):
+            raise ValueError("'weights' and 'graphs' differ in length")
+        if method not in ("rwr", "label"):
+            raise ValueError("Unknown method %r" % method)
+        if not 0 < restart <= 1:
+            raise ValueError("'restart' must be in (0, 1]")
+
+        self.method = method
+        self.restart = restart
+        self.tol = tol
+        self.max_iter = max_iter
+        self.block_size = block_size
+        #: The number of iterations of the last :func:`propagate` call.
+        self.iterations = 0
+
+        if len(graphs) == 1:
+            self.ids = list(graphs[0].ids)
+        else:
+            self.ids = sorted(set().union(*[g.ids for g in graphs]))
+        self._index = dict((id, i) for i, id in enumerate(self.ids))
+
+        n = len(self.ids)
+        W = scipy.sparse.csr_matrix((n, n))
+        for graph, weight in zip(graphs, weights):
+            if not weight:
+                continue
+            A = graph.matrix(self.ids, min_score)
+            if A.nnz:
+                W = W + A * (float(weight) / A.data.max())
+
+        degree = numpy.asarray(W.sum(axis=0)).ravel()
+        inv = numpy.zeros(n)
+        nonzero = degree > 0
+        if method == "rwr":
+            # column stochastic transition matrix (W is symmetric)
+            inv[nonzero] = 1.0 / degree[nonzero]
+            M = W.dot(scipy.sparse.diags(inv))
+        else:
+            inv[nonzero] = 1.0 / numpy.sqrt(degree[nonzero])
+            D = scipy.sparse.diags(inv)
+            M = D.dot(W).dot(D)
+        #: The propagation operator (a :class:`scipy.sparse.csr_matrix`).
+        self.matrix = scipy.sparse.csr_matrix(M)
+
+    def seed_matrix(self, gene_sets):
+        """
+        Return a (genes x sets) seed matrix for a list of gene sets.
+        The columns are normalized to sum to 1 (gene ids not in the
+        network are ignored; a set without known genes has a zero
+        column).
+        """
+        index = self._index
+        Y = numpy.zeros((len(self.ids), len(gene_sets)))
+        for j, genes in enumerate(gene_sets):
+            rows = [index[g] for g in set(genes) if g in index]
+            if rows:
+                Y[rows, j] = 1.0 / len(rows)
+        return Y
+
+    def propagate(self, seeds, x0=None):
+        """
+        Propagate the `seeds` and return a (genes x sets) score matrix
+        (the rows correspond to :obj:`ids`).
+
+        :param seeds: A seed matrix (see :func:`seed_matrix`) or a list
+            of gene sets.
+        :param x0: Initial scores (e.g. the result of a previous call
+            with similar seeds) to warm start the iteration.
+
+        """
+        if not isinstance(seeds, numpy.ndarray):
+            seeds = self.seed_matrix(seeds)
+        Y = numpy.asarray(seeds, dtype=float)
+        vector = Y.ndim == 1
+        if vector:
+            Y = Y[:, numpy.newaxis]
+        if Y.shape[0] != len(self.ids):
+            raise ValueError("Seeds do not match the network size")
+
+        if x0 is not None:
+            x0 = numpy.asarray(x0, dtype=float).reshape(Y.shape)
+
+        # propagate in blocks of columns (better cache use than a very
+        # wide dense matrix, and each block stops when it converges)
+        F = numpy.zeros(Y.shape)
+        iterations = 0
+        for start in range(0, Y.shape[1], self.block_size):
+            block = slice(start, start + self.block_size)
+            F[:, block], n_iter = self._propagate_block(
+                Y[:, block], None if x0 is None else x0[:, block])
+            iterations = max(iterations, n_iter)
+        self.iterations = iterations
+        return F[:, 0] if vector else F
+
+    def _propagate_block(self, Y, x0):
+        alpha = 1.0 - self.restart
+        Y = self.restart * Y
+        F = Y.copy() if x0 is None else x0.copy()
+        M = self.matrix
+        iteration = 0
+        for iteration in range(1, self.max_iter + 1):
+            F_next = M.dot(F)
+            F_next *= alpha
+            F_next += Y
+            delta = numpy.abs(F_next - F).max() if F.size else 0.0
+            F = F_next
+            if delta < self.tol:
+                break
+        return F, iteration
+
+    def rank(self, gene_sets, n=10, exclude_seeds=True, x0=None):
+        """
+        Return for each gene set in `gene_sets` a list of the `n`
+        highest scoring (gene id, score) pairs (excluding the seed
+        genes if `exclude_seeds` is ``True``).
+        """
+        F = self.propagate(gene_sets, x0=x0)
+        ranked = []
+        for j, genes in enumerate(gene_sets):
+            scores = F[:, j].copy()
+            if exclude_seeds:
+                scores[self.node_indices(genes)] = -numpy.inf
+            order = numpy.argsort(-scores, kind="mergesort")[:n]
+            ranked.append([(self.ids[i], float(scores[i])) for i in order
+                           if scores[i] > -numpy.inf])
+        return ranked
+
+    def node_indices(self, ids):
+        """
+        Return an array of row indices of `ids` (unknown ids are
+        ignored).
+        """
+        index = self._index
+        return numpy.array([index[id] for id in ids if id in index],
+                           dtype=numpy.int64)
+
+
 class BioGRID(PPIDatabase):
     """
     Access `BioGRID <http://thebiogrid.org>`_ PPI data.
@@ -373,6 +812,24 @@ class BioGRID(PPIDatabase):
         """, (id, id))
         return cur.fetchall()
 
+    def graph(self, taxid=None):
+        """
+        Return a :class:`PPIGraph` of all the interactions (between
+        proteins of organism `taxid` if not ``None``).
+
+        .. note:: BioGRID scores are not comparable between publications.
+
+        """
+        def edges():
+            cur = self.db.execute("""\
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+                from links
+            """)
+            return cur.fetchall()
+
+        return self._cached_graph(self.filename, lambda: self.ids(taxid),
+                                  edges, {"taxid": taxid})
+
     def search_id(self, name, taxid=None):
         """
         Search the database for protein name. Return a list of matching
@@ -519,6 +976,70 @@ class BioGRID(PPIDatabase):
         """)
 
 
+@contextmanager
+def _bulk_import(dbfilename):
+    """
+    A context manager returning a connection to a fresh database tuned
+    for a single bulk import (no rollback journal and no syncing). The
+    rows are inserted in a single transaction and the result replaces
+    `dbfilename` only if the import completes.
+    """
+    tmpfilename = dbfilename + ".tmp"
+    if os.path.exists(tmpfilename):
+        os.remove(tmpfilename)
+
+    con = sqlite3.connect(tmpfilename)
+    try:
+        con.executescript("""
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            PRAGMA locking_mode=EXCLUSIVE;
+        """)
+        with con:
+            yield con
+        con.execute("PRAGMA journal_mode=DELETE")
+    except BaseException:
+        con.close()
+        os.remove(tmpfilename)
+        raise
+    con.close()
+
+    if os.path.exists(dbfilename):
+        os.remove(dbfilename)
+    os.rename(tmpfilename, dbfilename)
+
+
+def _read_flatfile(filename, sep=None, chunk_size=2 ** 16, progress=None):
+    """
+    Read a gzipped STRING flat file and yield its rows (without the
+    header line) in lists of split lines, reading about `chunk_size`
+    uncompressed bytes at a time.
+
+    :param str sep: Field separator (any whitespace if ``None``).
+    :param progress: Called with the percentage of the file read.
+    """
+    with open(filename, "rb") as raw:
+        filesize = max(os.fstat(raw.fileno()).st_size, 1)
+        f = io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding="utf-8")
+        f.readline()  # header line
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            if sep is None:
+                yield [line.split() for line in lines]
+            else:
+                yield [line.rstrip("\r\n").split(sep) for line in lines]
+            if progress is not None:
+                progress(100.0 * raw.tell() / filesize)
+
+
+def _init_db_task(args):
+    cls, version, taxid, cache_dir = args
+    cls.init_db(version, taxid, cache_dir=cache_dir)
+    return taxid
+
+
 STRINGInteraction = namedtuple(
     "STRINGInteraciton",
     ["protein_id1",
@@ -701,10 +1222,26 @@ class STRING(PPIDatabase):
         return cur.fetchall()
 
     def all_edges_annotated(self, taxid=None):
-        res = []
-        for id in self.ids(taxid):
-            res.extend(self.edges_annotated(id))
-        return res
+        """
+        Return a list of all annotated edges (in a single query). If
+        `taxid` is not None return the edges for this organism only.
+
+        """
+        query = """\
+            select links.protein_id1, links.protein_id2, links.score,
+                   actions.action, actions.mode, actions.score
+            from links left join actions on
+                   links.protein_id1=actions.protein_id1 and
+                   links.protein_id2=actions.protein_id2
+        """
+        if taxid is not None:
+            cur = self.db.execute(query + """\
+                join proteins on links.protein_id1=proteins.protein_id
+                where proteins.taxid=?
+            """, (taxid,))
+        else:
+            cur = self.db.execute(query)
+        return list(map(STRINGInteraction._make, cur.fetchall()))
 
     def edges_annotated(self, id):
         cur = self.db.execute("""\
@@ -717,6 +1254,21 @@ class STRING(PPIDatabase):
         """, (id,))
         return map(STRINGInteraction._make, cur.fetchall())
 
+    def graph(self, taxid=None):
+        """
+        Return a :class:`PPIGraph` of all the links (between proteins of
+        organism `taxid` if not ``None``).
+        """
+        def edges():
+            cur = self.db.execute("""\
+                select protein_id1, protein_id2, score
+                from links
+            """)
+            return cur.fetchall()
+
+        return self._cached_graph(self.filename, lambda: self.ids(taxid),
+                                  edges, {"taxid": taxid})
+
     def search_id(self, name, taxid=None):
         if taxid is None:
             cur = self.db.execute("""\
@@ -733,16 +1285,29 @@ class STRING(PPIDatabase):
         return map(itemgetter(0), cur)
 
     @classmethod
-    def download_data(cls, version, taxids=None):
+    def download_data(cls, version, taxids=None, cache_dir=None,
+                      processes=1):
         """
         Download the  PPI data for local work (this may take some time).
         Pass the version of the  STRING release e.g. v9.1.
+
+        With `processes` > 1 the databases for different taxids are
+        built in parallel.
         """
         if taxids is None:
             taxids = cls.common_taxids()
 
-        for taxid in taxids:
-            cls.init_db(version, taxid)
+        tasks = [(cls, version, taxid, cache_dir) for taxid in taxids]
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                pool.map(_init_db_task, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                _init_db_task(task)
 
     @classmethod
     def init_db(cls, version, taxid, cache_dir=None, dbfilename=None):
@@ -761,9 +1326,6 @@ class STRING(PPIDatabase):
             url = url.format(flatfile=flatfile, version=version, taxid=taxid)
             return posixpath.basename(url), base_url + url
 
-        def ffname(pattern):
-            return pattern.format(taxid=taxid, version=version)
-
         links_filename, links_url = paths("protein.links")
 
         actions_filename, actions_url = paths("protein.actions")
@@ -783,107 +1345,72 @@ class STRING(PPIDatabase):
             if not os.path.exists(pjoin(cache_dir, fname)):
                 download(fname, url)
 
-        links_fileobj = open(pjoin(cache_dir, links_filename), "rb")
-        actions_fileobj = open(pjoin(cache_dir, actions_filename), "rb")
-        aliases_fileobj = open(pjoin(cache_dir, aliases_filename), "rb")
+        cls.import_db(version, dbfilename,
+                      pjoin(cache_dir, links_filename),
+                      pjoin(cache_dir, actions_filename),
+                      pjoin(cache_dir, aliases_filename))
 
-        # python 3 support
-        links_file = gzip.open(pjoin(cache_dir, links_filename), mode='rt')
-        actions_file = gzip.open(pjoin(cache_dir, actions_filename), mode='rt')
-        aliases_file = gzip.open(pjoin(cache_dir, aliases_filename), mode='rt')
-
-        progress = ConsoleProgressBar("Processing {}:".format(links_filename))
-        progress(0.0)
-
-        def st_size(filename):
-            return os.stat(pjoin(cache_dir, filename)).st_size
-
-        filesize = st_size(links_filename)
-
-        con = sqlite3.connect(dbfilename)
+    @classmethod
+    def import_db(cls, version, dbfilename, links_filename,
+                  actions_filename, aliases_filename, chunk_size=2 ** 16):
+        """
+        Build the database at `dbfilename` from the (gzipped) STRING
+        links, actions and aliases flat files.
 
-        with con:
+        The files are read in chunks of about `chunk_size` bytes which
+        are inserted in a single transaction; the indices are created
+        after all the rows are inserted.
+        """
+        with _bulk_import(dbfilename) as con:
             cls.clear_db(con)
 
-            links_file.readline()  # read the header line
-
-            reader = csv.reader(links_file, delimiter=" ")
-
-            def read_links(reader, progress):
-                for i, (p1, p2, score) in enumerate(reader):
-                    yield p1, p2, int(score)
-
-                    if i % 100000 == 0:
-                        # Update the progress every 100000 lines
-                        progress(100.0 * links_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO links VALUES (?, ?, ?)",
-                            read_links(reader, progress))
-
+            progress = ConsoleProgressBar(
+                "Processing {}:".format(os.path.basename(links_filename)))
+            progress(0.0)
+            proteins = set()
+            for rows in _read_flatfile(links_filename, None, chunk_size,
+                                       progress):
+                proteins.update([row[0] for row in rows])
+                # the INT column affinity converts the scores
+                con.executemany("INSERT INTO links VALUES (?, ?, ?)", rows)
             progress.finish()
 
-            def part(string, sep, part):
-                return string.split(sep)[part]
-
-            con.create_function("part", 3, part)
-            con.execute("""
-                INSERT INTO proteins
-                SELECT protein_id1, part(protein_id1, '.', 0)
-                FROM (SELECT DISTINCT(protein_id1)
-                     FROM links
-                     ORDER BY protein_id1)
-            """)
-
-            filesize = st_size(actions_filename)
-
-            actions_file.readline()  # read header line
+            con.executemany(
+                "INSERT INTO proteins VALUES (?, ?)",
+                ((protein, protein.split(".", 1)[0])
+                 for protein in sorted(proteins)))
 
             progress = ConsoleProgressBar("Processing actions:")
-            reader = csv.reader(actions_file, delimiter="\t")
-
-            def read_actions(reader):
-                for i, (p1, p2, mode, action, a_is_acting, score) in \
-                        enumerate(reader):
-                    yield p1, p2, mode, action, int(score)
-
-                    if i % 10000 == 0:
-                        progress(100.0 * actions_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
-                            read_actions(reader))
-
+            for rows in _read_flatfile(actions_filename, "\t", chunk_size,
+                                       progress):
+                con.executemany(
+                    "INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
+                    [(p1, p2, mode, action, score)
+                     for p1, p2, mode, action, _, score in rows])
             progress.finish()
 
-            filesize = st_size(aliases_filename)
-            aliases_file.readline()  # read header line
             progress = ConsoleProgressBar("Processing aliases:")
-
-            reader = csv.reader(aliases_file, delimiter="\t")
-
-            def read_aliases(reader, progress):
-                for i, (taxid_proteinid, alias, source) in enumerate(reader):
-                    yield (taxid_proteinid, alias, source)
-                    if i % 10000 == 0:
-                        progress(100.0 * aliases_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO aliases VALUES (?, ?, ?)",
-                            read_aliases(reader, progress))
-
+            for rows in _read_flatfile(aliases_filename, "\t", chunk_size,
+                                       progress):
+                con.executemany("INSERT INTO aliases VALUES (?, ?, ?)", rows)
             progress.finish()
 
             print("Indexing the database")
             cls.create_db_index(con)
+            cls._write_version(con, version)
 
-            con.executescript("""
-                DROP TABLE IF EXISTS version;
-                CREATE TABLE version (
-                     string_version text,
-                     api_version text
-                );""")
-
-            con.execute("""
-                INSERT INTO version
-                VALUES (?, ?)""", (version, cls.VERSION))
+    @classmethod
+    def _write_version(cls, con, version):
+        con.executescript("""
+            DROP TABLE IF EXISTS version;
+            CREATE TABLE version (
+                 string_version text,
+                 api_version text
+            );""")
+
+        con.execute("""
+            INSERT INTO version
+            VALUES (?, ?)""", (version, cls.VERSION))
 
     @classmethod
     def clear_db(cls, dbcon):
@@ -1004,6 +1531,10 @@ class STRINGDetailed(STRING):
         self.db_detailed = sqlite3.connect(detailed_database)
         self.db_detailed.execute("ATTACH DATABASE ? as string", (db_file,))
 
+    def all_edges_annotated(self, taxid=None):
+        # per id, to include the detailed evidence
+        return PPIDatabase.all_edges_annotated(self, taxid)
+
     def edges_annotated(self, id):
         edges = STRING.edges_annotated(self, id)
         edges_nc = []
@@ -1031,9 +1562,7 @@ class STRINGDetailed(STRING):
             cache_dir = serverfiles.localpath(cls.DOMAIN)
         if dbfilename is None:
             dbfilename = serverfiles.localpath(
-                cls.DOMAIN,
-                "string-protein-detailed.{taxid}.sqlite".format(taxid=taxid)
-            )
+                cls.DOMAIN, cls.FILENAME_DETAILED.format(taxid=taxid))
 
         pjoin = os.path.join
 
@@ -1047,15 +1576,16 @@ class STRINGDetailed(STRING):
             with open(pjoin(cache_dir, filename), "wb") as dest:
                 wget(url, dest, progress=True)
 
-        links_fileobj = open(pjoin(cache_dir, filename), "rb")
-        links_file = gzip.open(pjoin(cache_dir, filename), mode='rt')
-
-        con = sqlite3.connect(dbfilename)
-        with con:
-            con.execute("""
-                DROP TABLE IF EXISTS evidence
-            """)
+        cls.import_detailed_db(version, dbfilename, pjoin(cache_dir, filename))
 
+    @classmethod
+    def import_detailed_db(cls, version, dbfilename, links_filename,
+                           chunk_size=2 ** 16):
+        """
+        Build the evidence database at `dbfilename` from the (gzipped)
+        STRING detailed links flat file (see :func:`STRING.import_db`).
+        """
+        with _bulk_import(dbfilename) as con:
             con.execute("""
                 CREATE TABLE evidence(
                      protein_id1 TEXT,
@@ -1070,27 +1600,15 @@ class STRINGDetailed(STRING):
                     )
                 """)
 
-            links_file.readline()  # Read header
-            links = csv.reader(links_file, delimiter=" ")
-
-            filesize = os.stat(pjoin(cache_dir, filename)).st_size
-
             progress = ConsoleProgressBar("Processing links file:")
             progress(1.0)
-
-            def read_links(reader):
-                for i, (p1, p2, n, f, c, cx, ex, db, t, _) in \
-                        enumerate(reader):
-                    yield p1, p2, n, f, c, cx, ex, db, t
-
-                    if i % 10000 == 0:
-                        progress(100.0 * links_fileobj.tell() / filesize)
-
-            con.executemany("""
-                INSERT INTO evidence
-                VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, read_links(links))
-
+            for rows in _read_flatfile(links_filename, None, chunk_size,
+                                       progress):
+                # drop the trailing combined score
+                con.executemany("""
+                    INSERT INTO evidence
+                    VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, [row[:9] for row in rows])
             progress.finish()
 
             print("Indexing")
@@ -1098,27 +1616,7 @@ class STRINGDetailed(STRING):
                 CREATE INDEX IF NOT EXISTS index_evidence
                     ON evidence (protein_id1, protein_id2)
             """)
-
-            con.executescript("""
-                DROP TABLE IF EXISTS version;
-
-                CREATE TABLE version (
-                     string_version text,
-                     api_version text
-                );
-                """)
-
-            con.execute("""
-                INSERT INTO version
-                VALUES (?, ?)""", (version, cls.VERSION))
-
-    @classmethod
-    def download_data(cls, version, taxids=None):
-        if taxids is None:
-            taxids = cls.common_taxids()
-
-        for taxid in taxids:
-            cls.init_db(version, taxid)
+            cls._write_version(con, version)
 
 
 ##########
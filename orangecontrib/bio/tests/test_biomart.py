@@ -0,0 +1,162 @@
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from orangecontrib.bio import biomart
+from orangecontrib.bio.utils import httpcache
+
+
+REGISTRY = b"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<MartRegistry>
+  <virtualSchema name="default">
+    <MartURLLocation database="test" default="1" displayName="Test"
+        host="127.0.0.1" name="test_mart" path="/biomart/martservice"
+        port="80" serverVirtualSchema="default" visible="1" />
+  </virtualSchema>
+</MartRegistry>
+"""
+
+DATASETS = b"\nTableSet\tgenes\tGenes\t1\t\t\t\tdefault\t2016-01-01\n"
+
+CONFIGURATION = b"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<DatasetConfig dataset="genes" softwareVersion="0.7"></DatasetConfig>
+"""
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        args = parse_qs(urlparse(self.path).query)
+        if "type" in args:
+            body = {"registry": REGISTRY, "datasets": DATASETS,
+                    "configuration": CONFIGURATION}[args["type"][0]]
+            self.respond(200, body)
+            return
+
+        query = args["query"][0]
+        values = re.search('Filter name = "gene_id" value="([^"]*)"', query)
+        values = values.group(1).split(",") if values else ["all"]
+        with server.lock:
+            server.queries.append(values)
+            fail = any(v in server.failing for v in values)
+        if fail:
+            self.respond(500, b"")
+        elif "bad" in values:
+            self.respond(200, b"Query ERROR: caught BioMart::Exception")
+        else:
+            body = "Gene ID\tName\n" + "".join(
+                "%s\tname %s\n" % (v, v) for v in values if v != "empty")
+            self.respond(200, body.encode("utf-8"))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestQueryExecutor(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.queries = []
+        self.server.failing = set()
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.path = tempfile.mkdtemp()
+        self.connection = biomart.BioMartConnection(
+            "http://127.0.0.1:%i/biomart/martservice" %
+            self.server.server_port,
+            cache=httpcache.HTTPCache(self.path))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.connection.cache.close()
+        shutil.rmtree(self.path)
+
+    def query(self, values):
+        return biomart.BioMartQuery(
+            self.connection, dataset="genes",
+            attributes=["gene_id", "name"],
+            filters=[("chromosome", "1"), ("gene_id", values)])
+
+    def test_run(self):
+        values = ["g%i" % i for i in range(23)] + ["empty"]
+        executor = biomart.BioMartQueryExecutor(
+            self.query(values), chunk_size=5, workers=3)
+        progress = []
+        header, columns = executor.run(progress_callback=progress.append)
+        self.assertEqual(header, ["Gene ID", "Name"])
+        self.assertEqual(columns[0].tolist(), values[:-1])
+        self.assertEqual(columns[1][3], "name g3")
+        self.assertEqual(len(self.server.queries), 5)
+        self.assertEqual(progress[-1], 100.0)
+
+        # served from the cache
+        header, columns = biomart.BioMartQueryExecutor(
+            self.query(values), chunk_size=5).run()
+        self.assertEqual(columns[0].tolist(), values[:-1])
+        self.assertEqual(len(self.server.queries), 5)
+
+        table = biomart.BioMartQueryExecutor(
+            self.query(values), chunk_size=5).get_table()
+        self.assertEqual([m.name for m in table.domain.metas],
+                         ["Gene ID", "Name"])
+        self.assertEqual(list(table.metas[:, 1][:2]),
+                         ["name g0", "name g1"])
+
+        # without list filters the query runs in one piece
+        header, columns = biomart.BioMartQueryExecutor(
+            self.query("g1"), cache=False).run()
+        self.assertEqual(columns[0].tolist(), ["g1"])
+        self.assertEqual(len(self.server.queries), 6)
+
+    def test_resume(self):
+        values = ["g%i" % i for i in range(10)]
+        self.server.failing = set(["g7"])
+        executor = biomart.BioMartQueryExecutor(
+            self.query(values), chunk_size=3, workers=2)
+        self.assertRaises(HTTPError, executor.run)
+        self.assertEqual(len(self.server.queries), 4)
+
+        self.server.failing = set()
+        header, columns = executor.run()
+        self.assertEqual(columns[0].tolist(), values)
+        # only the failed chunk is repeated
+        self.assertEqual(self.server.queries[-1], ["g6", "g7", "g8"])
+        self.assertEqual(len(self.server.queries), 5)
+
+    def test_default_cache(self):
+        default = biomart.HTTP_CACHE
+        biomart.HTTP_CACHE = self.path
+        try:
+            cache = biomart.BioMartConnection().http_cache()
+        finally:
+            biomart.HTTP_CACHE = default
+        # responses in the default cache are revalidated
+        self.assertEqual(cache.ttl, biomart.HTTP_CACHE_TTL)
+        self.assertEqual(cache.max_size, biomart.HTTP_CACHE_SIZE)
+        cache.close()
+
+    def test_error(self):
+        executor = biomart.BioMartQueryExecutor(
+            self.query(["g1", "bad"]), chunk_size=1)
+        self.assertRaises(biomart.BioMartQueryError, executor.run)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import unittest
+
+import numpy
+import numpy.ma as ma
+
+from orangecontrib.bio.utils import expression
+
+
+def significance_test(cls, array, classes):
+    # Bypass __init__ (which requires an Orange 2 data table)
+    test = cls.__new__(cls, None, False)
+    test.useAttributeLabels = False
+    test.array = array
+    test.classes = numpy.array(classes)
+    test.keys = list(range(array.shape[1]))
+    test.dim = 0
+    return test
+
+
+class TestNullStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        X = rng.normal(size=(12, 40))
+        mask = rng.uniform(size=X.shape) < 0.05
+        self.array = ma.array(X, mask=mask)
+        self.classes = ["a"] * 5 + ["b"] * 4 + ["c"] * 3
+
+    def check(self, cls, target, stat=lambda v: v):
+        test = significance_test(cls, self.array, self.classes)
+        classes = test.classes.copy()
+        null = test.null_statistics(7, target, random_state=42)
+        self.assertEqual(null.shape, (7, 40))
+        # the instance is not modified
+        numpy.testing.assert_array_equal(test.classes, classes)
+
+        permutations = test.permutations(7, random_state=42)
+        for row, permutation in zip(null, permutations):
+            permuted = significance_test(cls, self.array, classes[permutation])
+            expected = [float(stat(v)) for _, v in permuted(target)]
+            numpy.testing.assert_allclose(row, expected, rtol=1e-8)
+
+        null_dist = test.null_distribution(7, target, random_state=42)
+        for row, run in zip(null, null_dist):
+            numpy.testing.assert_allclose(
+                row, [float(stat(v)) for _, v in run], rtol=1e-8)
+        numpy.testing.assert_array_equal(test.classes, classes)
+
+    def test_two_sample(self):
+        target = set(["a"])
+        self.check(expression.ExpressionSignificance_FoldChange, target)
+        self.check(expression.ExpressionSignificance_SignalToNoise, target)
+        self.check(expression.ExpressionSignificance_TTest, target,
+                   stat=lambda v: v[0])
+
+        class TTestPValue(expression.ExpressionSignificance_TTest):
+            _null_p_values = True
+
+        self.check(TTestPValue, target, stat=lambda v: v[1])
+
+    def test_anova(self):
+        test = significance_test(expression.ExpressionSignificance_ANOVA,
+                                 self.array, self.classes)
+        target = ["a", "b", "c"]
+        null = test.null_statistics(5, target, random_state=1)
+        permutations = test.permutations(5, random_state=1)
+        for row, permutation in zip(null, permutations):
+            masks = test.group_masks(target, test.classes[permutation])
+            f, _ = expression.aF_oneway(
+                *[self.array[mask] for mask in masks], dim=0)
+            numpy.testing.assert_allclose(row, f, rtol=1e-8)
+
+    def test_group_masks(self):
+        test = significance_test(expression.ExpressionSignificance_Test,
+                                 self.array, self.classes)
+        ind1, ind2 = test.test_indices(set(["a", "c"]))
+        self.assertEqual(list(ind1), [0, 1, 2, 3, 4, 9, 10, 11])
+        self.assertEqual(list(ind2), [5, 6, 7, 8])
+        masks = test.group_masks(["b", "c"])
+        self.assertEqual(masks.shape, (2, 12))
+        self.assertEqual(list(masks.sum(axis=1)), [4, 3])
+
+
+class TestMAZScore(unittest.TestCase):
+    def test_reference(self):
+        rng = numpy.random.RandomState(0)
+        for n in [7, 100]:
+            G = ma.array(rng.lognormal(size=n), mask=rng.uniform(size=n) < 0.1)
+            R = ma.array(rng.lognormal(size=n))
+            R[2] = 0
+            _, intensity = expression.ratio_intensity(G, R)
+            rank = numpy.empty(n, dtype=int)
+            rank[ma.argsort(intensity)] = numpy.arange(n)
+            for window in [1. / 5, 1. / 3]:
+                r = int(numpy.ceil(n * window))
+                for padded in [False, True]:
+                    z = expression.MA_zscore(G, R, window, padded)
+                    ref = expression._MA_zscore_reference(G, R, window,
+                                                          padded)
+                    # the reference pads the windows past the end with
+                    # sorted[k:] instead of the last k points
+                    compare = ~(padded & (rank + r // 2 + r % 2 > n))
+                    numpy.testing.assert_allclose(z.filled(0)[compare],
+                                                  ref.filled(0)[compare])
+                    # masked (or zero) ratios have masked z-scores
+                    self.assertTrue(z.mask[2])
+                    self.assertTrue(numpy.all(z.mask[G.mask]))
+
+    def test_padding(self):
+        # windows past either end are padded with the first/last points
+        rng = numpy.random.RandomState(1)
+        n = 40
+        G = ma.array(rng.lognormal(size=n), mask=rng.uniform(size=n) < 0.1)
+        R = ma.array(rng.lognormal(size=n))
+        ratio, intensity = expression.ratio_intensity(G, R)
+        order = list(ma.argsort(intensity))
+        for window in [1. / 5, 1. / 3]:
+            r = int(numpy.ceil(n * window))
+            expected = ma.zeros(n)
+            for i, ind in enumerate(order):
+                start, end = i - r // 2, i + r // 2 + r % 2
+                indices = (order[:max(-start, 0)] +
+                           order[max(start, 0):min(end, n)] +
+                           order[n - max(end - n, 0):])
+                self.assertEqual(len(indices), r)
+                expected[ind] = ratio[ind] / ma.std(ratio[indices])
+            z = expression.MA_zscore(G, R, window, padded=True)
+            numpy.testing.assert_allclose(z.filled(0), expected.filled(0))
+
+
+def naive_lowess(x, y, xest, f, iter):
+    # a direct (quadratic) implementation of robust lowess
+    n = len(x)
+    r = min(int(numpy.ceil(f * n)), n - 1)
+    robust = numpy.ones(n)
+
+    def fit(points):
+        est = []
+        for x0 in points:
+            h = numpy.sort(numpy.abs(x - x0))[r]
+            w = (1 - numpy.clip(numpy.abs(x - x0) / h, 0, 1) ** 3) ** 3
+            w = w * robust
+            A = numpy.array([[w.sum(), (w * x).sum()],
+                             [(w * x).sum(), (w * x * x).sum()]])
+            b = numpy.array([(w * y).sum(), (w * x * y).sum()])
+            beta = numpy.linalg.solve(A, b)
+            est.append(beta[0] + beta[1] * x0)
+        return numpy.array(est)
+
+    for _ in range(iter - 1):
+        residuals = y - fit(x)
+        s = numpy.median(numpy.abs(residuals))
+        robust = (1 - numpy.clip(residuals / (6 * s), -1, 1) ** 2) ** 2
+    return fit(xest)
+
+
+class TestLowess(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.x = rng.normal(size=200)
+        self.y = numpy.sin(self.x) + rng.normal(size=200) * 0.3
+
+    def test_naive(self):
+        xest = numpy.linspace(-2, 2, 15)
+        for f in [0.1, 2. / 3]:
+            for iter in [1, 3]:
+                numpy.testing.assert_allclose(
+                    expression.lowess(self.x, self.y, f, iter),
+                    naive_lowess(self.x, self.y, self.x, f, iter))
+                numpy.testing.assert_allclose(
+                    expression.lowess2(self.x, self.y, xest, f, iter),
+                    naive_lowess(self.x, self.y, xest, f, iter))
+
+    def test_channels(self):
+        Y = numpy.column_stack([self.y, -self.y, self.y * 2])
+        progress = []
+        est = expression.lowess_fit(self.x, Y, f=0.3,
+                                    progressCallback=progress.append)
+        self.assertEqual(est.shape, (200, 3))
+        single = expression.lowess_fit(self.x, self.y, f=0.3)
+        numpy.testing.assert_allclose(est[:, 0], single)
+        numpy.testing.assert_allclose(est[:, 1], -single)
+        self.assertEqual(progress, sorted(progress))
+        self.assertAlmostEqual(progress[-1], 100)
+
+    def test_delta(self):
+        exact = expression.lowess_fit(self.x, self.y, f=0.5)
+        approx = expression.lowess_fit(self.x, self.y, f=0.5, delta=0.05)
+        numpy.testing.assert_allclose(approx, exact, atol=0.02)
+
+    def test_ma_center(self):
+        rng = numpy.random.RandomState(1)
+        G = ma.array(rng.lognormal(5, 1, size=(300, 2)))
+        R = G * rng.lognormal(0.5, 0.1, size=G.shape)
+        G[3, 0] = ma.masked
+        for center in [expression.MA_center_lowess,
+                       expression.MA_center_lowess_fast]:
+            Gc, Rc = center(G, R)
+            self.assertEqual(Gc.shape, G.shape)
+            self.assertTrue(Gc.mask[3, 0])
+            ratio = numpy.log2(Rc / Gc)
+            self.assertLess(abs(ma.median(ratio[:, 0])), 0.05)
+            Gc1, _ = center(G[:, 1], R[:, 1])
+            numpy.testing.assert_allclose(Gc[:, 1], Gc1)
+
+
+if __name__ == "__main__":
+    unittest.main()
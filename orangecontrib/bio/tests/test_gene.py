@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from orangecontrib.bio import gene
+
+
+ALIASES = [
+    set(["ABC1", "abc-1", "1001"]),
+    set(["XYZ", "xyz-2", "1002"]),
+    set(["DUP", "1003"]),
+    set(["DUP", "1004"]),
+    set(["Q", "1005"]),
+]
+
+
+class TestMatchMany(unittest.TestCase):
+    def setUp(self):
+        self.targets = ["1001", "1002", "1003", "1004", "q", "Other"]
+        self.matcher = gene.MatcherSequence(
+            [gene.MatcherDirect(ignore_case=True),
+             gene.MatcherAliases(ALIASES, ignore_case=True)])
+        self.matcher.set_targets(self.targets)
+        self.genes = ["abc1", "XYZ-2", "dup", "1003", "unknown", "ABC1",
+                      "other", "Q", "xyz-2"]
+
+    def test_match_many(self):
+        matches = self.matcher.match_many(self.genes)
+        self.assertEqual([sorted(m) for m in matches],
+                         [sorted(self.matcher.match(g)) for g in self.genes])
+        self.assertEqual(sorted(matches[2]), ["1003", "1004"])
+
+    def test_umatch_many(self):
+        indices, unmatched = self.matcher.umatch_many(self.genes)
+        self.assertEqual(len(indices), len(self.genes))
+        for g, i, um in zip(self.genes, indices, unmatched):
+            expected = self.matcher.umatch(g)
+            if expected is None:
+                self.assertTrue(um)
+                self.assertEqual(i, -1)
+            else:
+                self.assertFalse(um)
+                self.assertEqual(self.targets[i], expected)
+        self.assertEqual(list(unmatched),
+                         [False, False, True, False, True, False, False,
+                          False, False])
+        # the input does not need to be a list
+        indices, _ = self.matcher.umatch_many(iter(["Q"]))
+        self.assertEqual(list(indices), [4])
+
+    def test_case_sensitive(self):
+        matcher = gene.MatcherAliases(ALIASES, ignore_case=False)
+        matcher.set_targets(self.targets)
+        self.assertEqual(matcher.match_many(["abc1", "ABC1"]),
+                         [[], ["1001"]])
+        indices, unmatched = matcher.umatch_many(["abc1", "ABC1"])
+        self.assertEqual(list(indices), [-1, 0])
+
+
+class TestJoinSets(unittest.TestCase):
+    SOURCES = [
+        [set(["A", "a1"]), set(["B", "b1"]), set(["C"])],
+        [set(["a1", "AB"]), set(["AB2", "b1"]), set(["D"])],
+        [set(["ab", "ab2"]), set(["E", "c"])],
+    ]
+
+    def test_components(self):
+        joined = gene.join_sets_l(self.SOURCES, lower=True)
+        self.assertEqual(joined, [set(["A", "a1", "AB", "B", "b1", "AB2",
+                                       "ab", "ab2"]),
+                                  set(["C", "E", "c"]),
+                                  set(["D"])])
+        # case sensitive: "AB" and "ab" differ
+        joined = gene.join_sets_l(self.SOURCES)
+        self.assertEqual(joined, [set(["A", "a1", "AB"]),
+                                  set(["B", "b1", "AB2"]),
+                                  set(["C"]), set(["D"]),
+                                  set(["ab", "ab2"]), set(["E", "c"])])
+
+    def test_pairwise(self):
+        pairwise = gene.join_sets_l(self.SOURCES, lower=True, pairwise=True)
+        expected = gene.join_sets(
+            gene.join_sets(self.SOURCES[0], self.SOURCES[1], lower=True),
+            self.SOURCES[2], lower=True)
+        self.assertEqual(pairwise, expected)
+        # the pairwise join does not merge transitively
+        self.assertIn(set(["ab", "ab2", "a1", "AB", "A"]), pairwise)
+        self.assertIn(set(["ab", "ab2", "AB2", "b1", "B"]), pairwise)
+
+    def test_pairwise_equivalent(self):
+        # without transitive overlaps both joins give the same groups
+        sources = [[set(["A", "a1"]), set(["B"])],
+                   [set(["A1", "x"]), set(["y"])]]
+        key = lambda groups: sorted(sorted(g) for g in groups)
+        self.assertEqual(key(gene.join_sets_l(sources, lower=True)),
+                         key(gene.join_sets_l(sources, lower=True,
+                                              pairwise=True)))
+
+    def test_ambiguous_alias(self):
+        # an alias shared by two groups of the same source does not
+        # join them (as in join_sets)
+        sources = [[set(["GENEA", "ALIAS1", "SHARED"]),
+                    set(["GENEB", "ALIAS2", "SHARED"])],
+                   [set(["GENEA", "X1"]), set(["GENEB", "X2"])]]
+        expected = [set(["GENEA", "ALIAS1", "SHARED", "X1"]),
+                    set(["GENEB", "ALIAS2", "SHARED", "X2"])]
+        self.assertEqual(gene.join_sets_l(sources), expected)
+        self.assertEqual(gene.join_sets_l(sources, pairwise=True), expected)
+        # other sources can still be joined through it
+        sources.append([set(["SHARED", "Y"])])
+        sources.append([set(["shared", "Z"])])
+        self.assertEqual(gene.join_sets_l(sources, lower=True),
+                         expected + [set(["SHARED", "Y", "shared", "Z"])])
+
+    def test_matcher_ambiguous_alias(self):
+        sources = [[set(["GENEA", "ALIAS1", "SHARED"]),
+                    set(["GENEB", "ALIAS2", "SHARED"])],
+                   [set(["GENEA", "X1"]), set(["GENEB", "X2"])]]
+        matcher = gene.MatcherAliases(gene.join_sets_l(sources))
+        matcher.set_targets(["GENEA", "GENEB"])
+        self.assertEqual(matcher.umatch("X1"), "GENEA")
+        self.assertEqual(matcher.umatch("ALIAS2"), "GENEB")
+        self.assertIsNone(matcher.umatch("SHARED"))
+
+
+class AliasesMatcher(gene.MatcherAliasesPickled):
+    version = "v1"
+    created = 0
+
+    def create_aliases(self):
+        AliasesMatcher.created += 1
+        return ALIASES
+
+    def create_aliases_version(self):
+        return self.version
+
+    def filename(self):
+        return "test_aliases"
+
+
+class TestAliasIndex(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self._matcher_path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.path
+        AliasesMatcher.created = 0
+
+    def tearDown(self):
+        gene.gene_matcher_path = self._matcher_path
+        shutil.rmtree(self.path)
+
+    def test_index(self):
+        index = gene.AliasIndex.from_aliases(ALIASES, ignore_case=True)
+        mapping = gene.create_mapping(ALIASES, lower=True)
+        self.assertEqual(len(index), len(mapping))
+        self.assertEqual(sorted(index), sorted(mapping))
+        for key in mapping:
+            self.assertEqual(index[key], mapping[key])
+            self.assertEqual(index[key.upper()], mapping[key])
+        self.assertEqual(index["missing"], set())
+        self.assertNotIn("missing", index)
+        self.assertEqual(index.get_many(["dup", "ABC-1", "missing"]),
+                         [set([2, 3]), set([0]), set()])
+        self.assertEqual(list(index.groups), ALIASES)
+        self.assertEqual(index.groups[-1], ALIASES[-1])
+
+    def test_matcher(self):
+        targets = ["1001", "1002", "1003", "1004", "q"]
+        m = AliasesMatcher()
+        m.set_targets(targets)
+        self.assertEqual(m.match("abc-1"), ["1001"])
+        self.assertEqual(AliasesMatcher.created, 1)
+        self.assertTrue(os.path.exists(m.index_filename()))
+        self.assertIsInstance(m.mdict, gene.AliasIndex)
+
+        # loaded from the stored index
+        m = AliasesMatcher()
+        m.set_targets(targets)
+        self.assertEqual(m.match("ABC-1"), ["1001"])
+        self.assertEqual(m.explain("q"), [(["q"], set(["Q", "1005"]))])
+        self.assertEqual(AliasesMatcher.created, 1)
+
+        # a new version rebuilds the index
+        m = AliasesMatcher()
+        m.version = "v2"
+        m.set_targets(targets)
+        self.assertEqual(AliasesMatcher.created, 2)
+
+        # joined matchers
+        j = gene.MatcherAliasesPickledJoined([AliasesMatcher(),
+                                              AliasesMatcher()])
+        j.set_targets(targets)
+        self.assertEqual(sorted(j.match("dup")), ["1003", "1004"])
+        self.assertEqual(j.umatch("xyz-2"), "1002")
+
+
+if __name__ == "__main__":
+    unittest.main()
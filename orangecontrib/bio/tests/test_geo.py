@@ -0,0 +1,135 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from orangecontrib.bio import geo
+
+
+SOFT = u"""\
+^DATABASE = Geo
+!Database_name = Gene Expression Omnibus (GEO)
+^DATASET = GDS0
+!dataset_title = Test
+!dataset_sample_organism = Homo sapiens
+!dataset_feature_count = 5
+!dataset_sample_count = 3
+^SUBSET = GDS0_1
+!subset_description = control
+!subset_sample_id = GSM1,GSM2
+!subset_type = agent
+^SUBSET = GDS0_2
+!subset_description = treated
+!subset_sample_id = GSM3
+!subset_type = agent
+^DATASET = GDS0
+!dataset_value_type = count
+!dataset_table_begin
+ID_REF\tIDENTIFIER\tGSM1\tGSM2\tGSM3
+s3\tB\t1.0\t2.0\tnull
+s1\tA\t3.5\tnull\tnull
+s2\tA\t1.5\t4.0\tnull
+s4\tC\t0.5\t1.0\t2.0
+s5\tB\t3.0\t6.0\tnull
+!dataset_table_end
+"""
+
+
+class TestSoftTable(unittest.TestCase):
+    def test_parse(self):
+        table = geo.parse_soft_table(io.StringIO(SOFT), chunk_size=2,
+                                     size_hint=1)
+        self.assertEqual(table.samples, ["GSM1", "GSM2", "GSM3"])
+        self.assertEqual(table.spots, ["s3", "s1", "s2", "s4", "s5"])
+        self.assertEqual(table.genes, ["B", "A", "A", "C", "B"])
+        self.assertEqual(table.X.shape, (5, 3))
+        numpy.testing.assert_equal(table.X[1], [3.5, numpy.nan, numpy.nan])
+
+        table = geo.parse_soft_table(io.StringIO(SOFT), remove_unknown=0.5,
+                                     dtype=numpy.float32)
+        self.assertEqual(table.X.dtype, numpy.float32)
+        self.assertEqual(table.spots, ["s3", "s2", "s4", "s5"])
+
+        # a falsy threshold does not remove anything
+        table = geo.parse_soft_table(io.StringIO(SOFT), remove_unknown=0)
+        self.assertEqual(len(table.spots), 5)
+        self.assertEqual(len(table.remove_unknown(0).spots), 5)
+        self.assertEqual(len(table.remove_unknown(0.5).spots), 4)
+
+    def test_merge(self):
+        table = geo.parse_soft_table(io.StringIO(SOFT))
+        for merge in [geo.spots_mean, geo.spots_median, geo.spots_min,
+                      geo.spots_max, lambda x: len(x)]:
+            genes, X = table.merge_spots(merge)
+            self.assertEqual(genes, ["A", "B", "C"])
+            for gene, row in zip(genes, X):
+                values = table.X[[g == gene for g in table.genes]]
+                expected = [merge(list(col)) for col in values.T]
+                numpy.testing.assert_allclose(row, expected)
+
+    def test_table(self):
+        gds = geo.GDS.__new__(geo.GDS)
+        gds.info = {"samples": ["GSM1", "GSM2", "GSM3"],
+                    "subsets": [{"description": "control", "type": "agent",
+                                 "sample_id": ["GSM1", "GSM2"]},
+                                {"description": "treated", "type": "agent",
+                                 "sample_id": ["GSM3"]}]}
+        gds.gdsdata = geo.parse_soft_table(io.StringIO(SOFT))
+        data = gds._to_ExampleTable(report_genes=False)
+        self.assertEqual([str(v) for v in data.metas[:, 0]],
+                         ["s1", "s2", "s3", "s4", "s5"])
+        numpy.testing.assert_equal(data.X[2], [1.0, 2.0, numpy.nan])
+        data = gds._to_ExampleTable(transpose=True)
+        self.assertEqual([a.name for a in data.domain.attributes],
+                         ["A", "B", "C"])
+        numpy.testing.assert_equal(data.X[:, 0], [2.5, 4.0, numpy.nan])
+        self.assertEqual([data.domain.class_var.str_val(v) for v in data.Y],
+                         ["control", "control", "treated"])
+
+
+class TestCompiledGDS(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "GDS0.soft.gz")
+        with gzip.open(self.filename, "wb") as f:
+            f.write(SOFT.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_cache(self):
+        gds = geo.GDS.__new__(geo.GDS)
+        gds.filename = self.filename
+        gds.force_download = False
+        gds._getinfo()
+        self.assertEqual(gds.info["samples"], ["GSM1", "GSM2", "GSM3"])
+
+        compiled = self.filename + geo.GDS.COMPILED_SUFFIX
+        table = geo.parse_soft_table(io.StringIO(SOFT))
+        table.save(compiled, dict(gds._compiled_meta(), info=gds.info))
+
+        gds = geo.GDS.__new__(geo.GDS)
+        gds.filename = self.filename
+        gds.force_download = False
+        gds._load()
+        self.assertIsInstance(gds._table.X, numpy.memmap)
+        numpy.testing.assert_equal(gds._table.X, table.X)
+        self.assertEqual(gds._table.spots, table.spots)
+        self.assertEqual(gds._table.genes, table.genes)
+        self.assertEqual(gds.info["subsets"][0]["sample_id"],
+                         ["GSM1", "GSM2"])
+        gds._parse_soft(remove_unknown=0.5)
+        self.assertEqual(gds.gdsdata.spots, ["s3", "s2", "s4", "s5"])
+
+        # a changed source file invalidates the cache
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(geo.SoftTable.load(compiled, gds._compiled_meta()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,302 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from six import StringIO
+
+from orangecontrib.bio import go
+from orangecontrib.bio.utils import stats
+
+
+ONTOLOGY = """\
+format-version: 1.2
+subsetdef: goslim_generic "Generic GO slim"
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+subset: goslim_generic
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+subset: goslim_generic
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: ab
+namespace: biological_process
+alt_id: GO:0000014
+is_a: GO:0000002 ! a
+is_a: GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: c
+namespace: biological_process
+relationship: part_of GO:0000003 ! b
+
+"""
+
+ANNOTATIONS = [
+    # gene, term, evidence, aspect
+    ("G1", "GO:0000004", "IDA", "P"),
+    ("G2", "GO:0000002", "IEA", "P"),
+    ("G3", "GO:0000005", "IDA", "P"),
+    ("G4", "GO:0000014", "IDA", "P"),
+    ("G5", "GO:0000003", "TAS", "F"),
+    ("G6", "GO:0000001", "IDA", "P"),
+    ("G1", "GO:0000005", "IEA", "P"),
+]
+
+
+def gaf_line(gene, term, evidence, aspect):
+    fields = ["DB", gene + "_ID", gene, "", term, "REF", evidence, "",
+              aspect, gene + " name", "", "gene", "taxon:1", "20000101",
+              "DB", "", ""]
+    return "\t".join(fields)
+
+
+def create_annotations():
+    ontology = go.Ontology(StringIO(ONTOLOGY))
+    gaf = "!gaf-version: 2.0\n" + \
+          "\n".join(gaf_line(*ann) for ann in ANNOTATIONS) + "\n"
+    annotations = go.Annotations(StringIO(gaf), ontology=ontology)
+    return ontology, annotations
+
+
+class TestEnrichment(unittest.TestCase):
+    def setUp(self):
+        self.ontology, self.annotations = create_annotations()
+
+    def brute_force(self, genes, reference, evidence_codes, aspects):
+        # (term, gene) pairs propagated up the ontology
+        annotated = {}
+        for gene, term, evidence, aspect in ANNOTATIONS:
+            if evidence not in evidence_codes or aspect not in aspects:
+                continue
+            term = self.ontology.alias_mapper.get(term, term)
+            for t in self.ontology.extract_super_graph([term]):
+                annotated.setdefault(t, set()).add(gene)
+        res = {}
+        for term, term_genes in annotated.items():
+            if not term_genes & genes:
+                continue
+            ref_genes = term_genes & reference
+            mapped = genes & ref_genes
+            res[term] = (mapped, len(ref_genes))
+        return res
+
+    def test_incidence(self):
+        incidence = self.annotations.term_gene_incidence()
+        self.assertEqual(incidence.genes,
+                         ["G1", "G2", "G3", "G4", "G5", "G6"])
+        root = incidence.term_index["GO:0000001"]
+        self.assertEqual(incidence.matrix[root].sum(), 6)
+        ab = incidence.term_index["GO:0000004"]
+        self.assertEqual(incidence.term_genes(ab, incidence.gene_mask(["G1", "G4"])),
+                         ["G1", "G4"])
+        self.assertNotIn("GO:0000014", incidence.term_index)
+        # cached per filter
+        self.assertIs(incidence, self.annotations.term_gene_incidence())
+        self.assertIsNot(incidence,
+                         self.annotations.term_gene_incidence(aspect="P"))
+
+    def test_enriched_terms(self):
+        cases = [
+            (["G1", "G3"], None, None, None),
+            (["G1", "G2", "G5"], ["G1", "G2", "G3", "G5"], None, None),
+            (["G1", "G4", "G6"], None, ["IDA"], "P"),
+            (["G2", "G5"], None, ["IEA", "TAS"], ["P", "F"]),
+        ]
+        all_evidence = set(go.evidenceDict.keys())
+        for genes, reference, evidence, aspect in cases:
+            res = self.annotations.get_enriched_terms(
+                genes, reference, evidence, aspect=aspect, use_fdr=False)
+            ref = set(reference or self.annotations.gene_names)
+            aspects = set([aspect] if isinstance(aspect, str)
+                          else aspect or ["P", "C", "F"])
+            expected = self.brute_force(
+                set(genes), ref, set(evidence or all_evidence), aspects)
+            self.assertEqual(set(res), set(expected))
+            for term, (mapped, ref_count) in expected.items():
+                res_genes, p, res_ref_count = res[term]
+                self.assertEqual(set(res_genes), mapped)
+                self.assertEqual(res_ref_count, ref_count)
+                self.assertAlmostEqual(
+                    p, stats.Binomial().p_value(
+                        len(mapped), len(ref), ref_count, len(genes)))
+
+    def test_slims_only(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            res = self.annotations.get_enriched_terms(["G1", "G3"],
+                                                      slims_only=True)
+        self.assertEqual(set(res), set(["GO:0000001", "GO:0000002"]))
+
+
+class TestOntologyClosure(unittest.TestCase):
+    def setUp(self):
+        self.ontology, self.annotations = create_annotations()
+
+    def test_graphs(self):
+        ontology = self.ontology
+        self.assertEqual(ontology.extract_super_graph(["GO:0000004"]),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003",
+                              "GO:0000004"]))
+        self.assertEqual(ontology.extract_super_graph("GO:0000014"),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003",
+                              "GO:0000004", "GO:0000014"]))
+        self.assertEqual(ontology.extract_sub_graph(["GO:0000003"]),
+                         set(["GO:0000003", "GO:0000004", "GO:0000005"]))
+        self.assertTrue(ontology.is_super_term("GO:0000001", "GO:0000005"))
+        self.assertFalse(ontology.is_super_term("GO:0000002", "GO:0000005"))
+        self.assertEqual([ontology.term_depth(t) for t in sorted(ontology)],
+                         [1, 2, 2, 3, 3])
+        self.assertRaises(KeyError, ontology.extract_super_graph, ["GO:1"])
+
+    def test_slims(self):
+        ontology = self.ontology
+        ontology.set_slims_subset("goslim_generic")
+        self.assertEqual(ontology.slims_for_term("GO:0000004"),
+                         set(["GO:0000002", "GO:0000001"]))
+        self.assertEqual(ontology.slims_for_term("GO:0000005"),
+                         set(["GO:0000001"]))
+        ontology.set_slims_subset(["GO:0000003"])
+        self.assertEqual(ontology.slims_for_term("GO:0000004"),
+                         set(["GO:0000003"]))
+        self.assertEqual(ontology.slims_for_term("GO:0000002"), set())
+
+    def test_all_annotations(self):
+        genes = lambda term: set(ann.geneName for ann in
+                                 self.annotations.get_all_annotations(term))
+        self.assertEqual(genes("GO:0000003"), set(["G1", "G3", "G4", "G5"]))
+        self.assertEqual(genes("GO:0000004"), set(["G1", "G4"]))
+        self.assertEqual(genes("GO:0000001"),
+                         set(["G1", "G2", "G3", "G4", "G5", "G6"]))
+
+
+class TestCompiledOntology(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "gene_ontology_edit.obo")
+        with open(self.filename, "w") as f:
+            f.write(ONTOLOGY)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compiled(self):
+        parsed = go.Ontology(StringIO(ONTOLOGY))
+        first = go.Ontology(self.filename)
+        compiled = self.filename + go.Ontology.COMPILED_SUFFIX
+        self.assertTrue(os.path.exists(compiled))
+        self.assertIsNone(first._compiled)
+
+        ontology = go.Ontology(self.filename)
+        self.assertIsNotNone(ontology._compiled)
+        self.assertEqual(ontology.header, parsed.header)
+        self.assertEqual(sorted(ontology), sorted(parsed))
+        self.assertEqual(len(ontology), len(parsed))
+        for id in parsed:
+            term, expected = ontology[id], parsed[id]
+            self.assertEqual(term.name, expected.name)
+            self.assertEqual(term.related, expected.related)
+            self.assertEqual(term.related_to, expected.related_to)
+        self.assertEqual(ontology.alias_mapper, parsed.alias_mapper)
+        self.assertEqual(ontology["GO:0000014"].id, "GO:0000004")
+        self.assertEqual(dict(ontology.reverse_alias_mapper),
+                         {"GO:0000004": set(["GO:0000014"])})
+        self.assertEqual(sorted(ontology.typedefs), sorted(parsed.typedefs))
+        self.assertEqual(sorted(ontology.named_slims_subset("goslim_generic")),
+                         ["GO:0000001", "GO:0000002"])
+        self.assertEqual(ontology.extract_super_graph("GO:0000005"),
+                         parsed.extract_super_graph("GO:0000005"))
+
+    def test_invalidate(self):
+        go.Ontology(self.filename)
+        with open(self.filename, "a") as f:
+            f.write("[Term]\nid: GO:0000006\nname: d\n"
+                    "is_a: GO:0000005 ! c\n\n")
+        ontology = go.Ontology(self.filename)
+        self.assertIsNone(ontology._compiled)
+        self.assertIn("GO:0000006", ontology)
+        ontology = go.Ontology(self.filename)
+        self.assertIsNotNone(ontology._compiled)
+        self.assertIn("GO:0000006", ontology)
+
+
+class TestColumnarAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "gene_association")
+        with open(self.filename, "w") as f:
+            f.write("!gaf-version: 2.0\n")
+            for ann in ANNOTATIONS:
+                f.write(gaf_line(*ann) + "\n")
+            # NOT qualified annotations are skipped
+            fields = gaf_line("G7", "GO:0000001", "IDA", "P").split("\t")
+            fields[3] = "NOT"
+            f.write("\t".join(fields) + "\n")
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        lines = [gaf_line(*ann) + "\n" for ann in ANNOTATIONS]
+        # Record based reference
+        self.records = go.Annotations(
+            [go.AnnotationRecord.from_string(line) for line in lines],
+            ontology=self.ontology)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameAnnotations(self, annotations):
+        self.assertIsNotNone(annotations._columns)
+        self.assertEqual(len(annotations), len(self.records))
+        self.assertEqual(list(annotations), list(self.records))
+        self.assertEqual(annotations[-1], self.records[-1])
+        self.assertEqual(annotations.gene_names, self.records.gene_names)
+        self.assertEqual(annotations.alias_mapper, self.records.alias_mapper)
+        self.assertEqual(annotations.gene_annotations["G1"],
+                         self.records.gene_annotations["G1"])
+        self.assertEqual(annotations.term_anotations["GO:0000014"],
+                         self.records.term_anotations["GO:0000014"])
+        self.assertEqual(annotations.get_all_annotations("GO:0000003"),
+                         self.records.get_all_annotations("GO:0000003"))
+        self.assertEqual(
+            annotations.get_enriched_terms(["G1", "G3"], use_fdr=False),
+            self.records.get_enriched_terms(["G1", "G3"], use_fdr=False))
+        incidence = annotations.term_gene_incidence(aspect="P")
+        expected = self.records.term_gene_incidence(aspect="P")
+        self.assertEqual(incidence.genes, expected.genes)
+        self.assertEqual(incidence.terms, expected.terms)
+        self.assertEqual((incidence.matrix != expected.matrix).nnz, 0)
+
+    def test_columnar(self):
+        annotations = go.Annotations(self.filename, ontology=self.ontology)
+        self.assertSameAnnotations(annotations)
+        compiled = self.filename + go.Annotations.COMPILED_SUFFIX
+        self.assertTrue(os.path.exists(compiled))
+
+        annotations = go.Annotations(self.filename, ontology=self.ontology)
+        self.assertSameAnnotations(annotations)
+        self.assertTrue(annotations.header.startswith("!gaf-version"))
+
+        # Adding an annotation switches to the record lists
+        annotations.add_annotation(gaf_line("G7", "GO:0000002", "IDA", "P"))
+        self.assertIsNone(annotations._columns)
+        self.assertEqual(len(annotations), len(self.records) + 1)
+        self.assertIn("G7", annotations.gene_names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import multiprocessing
+import random
+import unittest
+import warnings
+from functools import partial
+
+import numpy
+
+from orangecontrib.bio.utils import gsea
+
+
+class TestGSEABatch(unittest.TestCase):
+    def setUp(self):
+        rand = numpy.random.RandomState(42)
+        self.ngenes = 60
+        self.untied = rand.normal(size=self.ngenes).tolist()
+        # few distinct values, so permuted rankings often give
+        # the same scores as the observed one
+        self.tied = rand.choice([-1.0, -0.5, 0.5, 1.0],
+                                size=self.ngenes).tolist()
+        self.subsets = [list(range(0, 8)), [3, 17, 29, 44, 59],
+                        list(range(10, 60, 3)), [5], [2, 40]]
+
+    def scalar(self, rankings, n):
+        def scores(lcor):
+            ordered = gsea.orderedPointersCorr(lcor)
+            return [gsea.enrichmentScoreRanked(subset, lcor, ordered)[0]
+                    for subset in self.subsets]
+        es = scores(rankings)
+        nulls = [scores(gsea.genePermutationRanking(rankings, i))
+                 for i in range(n)]
+        return list(gsea.gseaSignificance(es, list(zip(*nulls))))
+
+    def assertSameResults(self, batch, scalar):
+        self.assertEqual(len(batch), len(scalar))
+        for (es1, nes1, p1, fdr1), (es2, nes2, p2, fdr2) in \
+                zip(batch, scalar):
+            self.assertAlmostEqual(es1, es2, places=12)
+            self.assertAlmostEqual(nes1, nes2, places=10)
+            self.assertEqual(p1, p2)
+            self.assertAlmostEqual(fdr1, fdr2, places=10)
+
+    def test_scores(self):
+        membership = gsea.geneSetMembership(self.subsets, self.ngenes)
+        for rankings in [self.untied, self.tied]:
+            rows = [gsea.genePermutationRanking(rankings, i)
+                    for i in range(20)]
+            batch = gsea.enrichmentScoresBatch(rows, membership)
+            for row, scores in zip(rows, batch):
+                ordered = gsea.orderedPointersCorr(row)
+                expected = [gsea.enrichmentScoreRanked(s, row, ordered)[0]
+                            for s in self.subsets]
+                # the same arithmetic as enrichmentScoreRanked
+                numpy.testing.assert_array_equal(scores, expected)
+
+    def test_significance(self):
+        for rankings in [self.untied, self.tied]:
+            self.assertSameResults(
+                gsea.gseaR(rankings, self.subsets, 32),
+                self.scalar(rankings, 32))
+
+
+    def test_n_jobs(self):
+        nullRanking = partial(gsea.genePermutationRanking, self.tied)
+        serial = gsea.gseaBatch(self.tied, nullRanking, 40, self.subsets,
+                                chunk=7, n_jobs=1)
+        parallel = gsea.gseaBatch(self.tied, nullRanking, 40, self.subsets,
+                                  chunk=7, n_jobs=2)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallel, gsea.gseaR(self.tied, self.subsets, 40))
+
+    @unittest.skipIf(not hasattr(multiprocessing, "get_context"),
+                     "start methods are not available")
+    def test_n_jobs_spawn(self):
+        # the workers get the pickled nullRanking and membership
+        method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method("spawn", force=True)
+        try:
+            parallel = gsea.gseaBatch(
+                self.untied, partial(gsea.genePermutationRanking, self.untied),
+                20, self.subsets, chunk=5, n_jobs=2)
+        finally:
+            multiprocessing.set_start_method(method, force=True)
+        self.assertEqual(parallel, gsea.gseaR(self.untied, self.subsets, 20))
+
+    def test_not_picklable(self):
+        # lambdas can only be used by forked workers
+        nullRanking = lambda i: gsea.shuffleList(self.tied,
+                                                 random.Random(2000 + i))
+        serial = gsea.gseaR(self.tied, self.subsets, 20)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            result = gsea.gseaBatch(self.tied, nullRanking, 20, self.subsets,
+                                    chunk=5, n_jobs=2)
+        self.assertEqual(result, serial)
+        self.assertEqual(len(w),
+                         0 if gsea._picklableForWorkers(nullRanking) else 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
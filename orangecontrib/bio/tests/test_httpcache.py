@@ -0,0 +1,191 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+
+from six.moves import BaseHTTPServer
+from six.moves.urllib.error import HTTPError, URLError
+
+from orangecontrib.bio.utils import httpcache
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers.items()))
+        if self.path == "/missing":
+            self.respond(404, b"")
+        elif server.failing:
+            self.respond(503, b"")
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.respond(304, None)
+        else:
+            self.respond(200, self.path.encode("utf-8") * 100,
+                         [("ETag", '"v1"'), ("Content-Type", "text/plain")])
+
+    def respond(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _fill(path, worker):
+    cache = httpcache.HTTPCache(path, max_size=10 ** 6)
+    for i in range(20):
+        cache.put("key%i" % (i % 10), b"value %i" % (i + worker))
+        cache.get("key%i" % ((i + 3) % 10))
+    cache.close()
+
+
+class TestHTTPCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def blob_files(self):
+        return [f for _, _, files in os.walk(os.path.join(self.path, "blobs"))
+                for f in files]
+
+    def test_store(self):
+        cache = httpcache.HTTPCache(self.path)
+        body = b"A" * 10000
+        cache.put("a", body, url="http://a", headers="ETag: x\n\n")
+        cache["b"] = body
+        cache["c"] = b"C"
+        self.assertEqual(cache["a"], body)
+        self.assertEqual(cache.lookup("a").headers["ETag"], "x")
+        self.assertEqual(cache.lookup("a").open().read(), body)
+        self.assertIn("b", cache)
+        self.assertNotIn("d", cache)
+        self.assertRaises(KeyError, cache.__getitem__, "d")
+        # content addressed and compressed
+        self.assertEqual(len(self.blob_files()), 2)
+        self.assertLess(cache.size(), 1000)
+
+        del cache["a"]
+        self.assertEqual(len(self.blob_files()), 2)
+        cache["b"] = b"B"
+        self.assertEqual(len(self.blob_files()), 2)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.blob_files(), [])
+
+    def test_eviction(self):
+        cache = httpcache.HTTPCache(self.path, max_size=5000, compress=False)
+        for i in range(4):
+            cache.put(str(i), os.urandom(1000))
+        cache.get("0")
+        cache.put("4", os.urandom(2000))
+        self.assertLessEqual(cache.size(), 4500)
+        self.assertEqual(sorted(cache.con.execute(
+            "SELECT key FROM responses")), [("0",), ("3",), ("4",)])
+        self.assertEqual(len(self.blob_files()), 3)
+        # the running total matches the stored blobs
+        self.assertEqual(cache.size(), cache.con.execute(
+            "SELECT sum(size) FROM blobs").fetchone()[0])
+
+    def test_processes(self):
+        procs = [multiprocessing.Process(target=_fill, args=(self.path, w))
+                 for w in range(3)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+        cache = httpcache.HTTPCache(self.path)
+        self.assertEqual(len(cache), 10)
+        for i in range(10):
+            self.assertTrue(cache["key%i" % i].startswith(b"value "))
+
+
+class TestURLOpen(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.failing = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%i/" % self.server.server_port
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def test_revalidate(self):
+        cache = httpcache.HTTPCache(self.path, ttl=60)
+        url = self.url + "data"
+        expected = b"/data" * 100
+        stream = cache.urlopen(url)
+        self.assertEqual(stream.read(), expected)
+        self.assertEqual(stream.headers.get_content_type(), "text/plain")
+        self.assertEqual(cache.urlopen(url).read(), expected)
+        self.assertEqual(len(self.server.requests), 1)
+
+        # a stale response is revalidated with its ETag
+        cache.con.execute("UPDATE responses SET mtime=?",
+                          (time.time() - 120,))
+        self.assertEqual(cache.urlopen(url).read(), expected)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]["If-None-Match"], '"v1"')
+        self.assertTrue(cache.lookup(url).fresh)
+
+    def test_offline(self):
+        cache = httpcache.HTTPCache(self.path, ttl=60)
+        url = self.url + "data"
+        expected = b"/data" * 100
+        self.assertEqual(cache.urlopen(url).read(), expected)
+        cache.con.execute("UPDATE responses SET mtime=?",
+                          (time.time() - 120,))
+
+        # stale responses are used if the server fails ...
+        self.server.failing = True
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            self.assertEqual(cache.urlopen(url).read(), expected)
+        self.assertEqual(len(w), 1)
+        self.assertRaises(HTTPError, cache.urlopen, self.url + "other")
+
+        # ... or can not be reached
+        self.server.shutdown()
+        self.server.server_close()
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            self.assertEqual(cache.urlopen(url, timeout=5).read(), expected)
+        self.assertEqual(len(w), 1)
+        self.assertRaises(URLError, cache.urlopen, self.url + "other",
+                          timeout=5)
+
+    def test_errors(self):
+        cache = httpcache.HTTPCache(self.path)
+        self.assertRaises(HTTPError, cache.urlopen, self.url + "missing")
+
+        def validate(body):
+            raise ValueError
+        self.assertRaises(ValueError, cache.urlopen, self.url + "x",
+                          validate=validate)
+        self.assertEqual(len(cache), 0)
+
+        self.assertIs(httpcache.shared(self.path),
+                      httpcache.shared(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,6 +51,47 @@ name: bar
         seinfeld = ontology.OBOOntology(seinfeld)
 #        print(seinfeld.child_edges("001"))
 
+    def test_closure(self):
+        onto = ontology.OBOOntology(StringIO("""
+[Term]
+id: A
+
+[Term]
+id: B
+is_a: A
+
+[Term]
+id: C
+is_a: A
+relationship: part_of B
+
+[Term]
+id: D
+is_a: C
+
+[Term]
+id: E
+is_a: F
+
+[Term]
+id: F
+is_a: E
+
+"""))
+        ids = lambda terms: sorted(term.id for term in terms)
+        self.assertEqual(ids(onto.super_terms("D")), ["A", "B", "C"])
+        self.assertEqual(ids(onto.sub_terms("A")), ["B", "C", "D"])
+        self.assertEqual(ids(onto.sub_terms("D")), [])
+        self.assertEqual([onto.term_depth(t) for t in "ABCD"], [1, 2, 2, 3])
+        self.assertTrue(onto.is_super_term("B", "D"))
+        self.assertFalse(onto.is_super_term("D", "B"))
+        # cycles
+        self.assertEqual(ids(onto.super_terms("E")), ["F"])
+
+        onto.add_object(ontology.OBOObject("Term", id="G", is_a="D"))
+        self.assertEqual(ids(onto.super_terms("G")), ["A", "B", "C", "D"])
+
+
 def load_tests(loader, tests, ignore):
     stanza = '''[Term]
 id: FOO:001
@@ -0,0 +1,195 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy
+
+from orangecontrib.bio import ppi
+
+
+LINKS = [("9606.a", "9606.b", 900), ("9606.b", "9606.a", 900),
+         ("9606.a", "9606.c", 400), ("9606.c", "9606.a", 400),
+         ("9606.c", "9606.d", 700), ("9606.d", "9606.c", 700),
+         ("9606.d", "9606.e", 150), ("9606.e", "9606.d", 150)]
+
+
+class TestPPIGraph(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "string.sqlite")
+        con = sqlite3.connect(self.filename)
+        ppi.STRING.clear_db(con)
+        con.executemany("INSERT INTO links VALUES (?, ?, ?)", LINKS)
+        con.executemany("INSERT INTO proteins VALUES (?, ?)",
+                        [("9606." + p, "9606") for p in "abcdef"])
+        ppi.STRING.create_db_index(con)
+        con.commit()
+        con.close()
+        self.db = ppi.STRING(database=self.filename)
+
+    def tearDown(self):
+        self.db.db.close()
+        shutil.rmtree(self.path)
+
+    def test_edges(self):
+        graph = self.db.graph("9606")
+        self.assertIn("9606.f", graph.ids)
+        for id in graph.ids:
+            self.assertEqual(sorted(graph.edges(id)),
+                             sorted(self.db.edges(id)))
+        self.assertEqual(graph.edges("unknown"), [])
+        self.assertEqual(graph.edges("9606.a", min_score=500),
+                         [("9606.a", "9606.b", 900)])
+
+        # stored in a memory mapped cache
+        cached = self.db.graph("9606")
+        self.assertIsInstance(cached.indices, numpy.memmap)
+        self.assertEqual(cached.ids, graph.ids)
+        numpy.testing.assert_array_equal(cached.scores, graph.scores)
+
+    def test_queries(self):
+        graph = self.db.graph()
+        self.assertEqual(graph.neighbours(["9606.a"]), ["9606.b", "9606.c"])
+        self.assertEqual(graph.k_hop(["9606.a"], 2),
+                         ["9606.a", "9606.b", "9606.c", "9606.d"])
+        self.assertEqual(graph.k_hop(["9606.a"], 3, min_score=300),
+                         ["9606.a", "9606.b", "9606.c", "9606.d"])
+        self.assertEqual(
+            sorted(graph.subgraph(["9606.a", "9606.c", "9606.d", "x"])),
+            [("9606.a", "9606.c", 400), ("9606.c", "9606.d", 700)])
+
+        strong = graph.threshold(500)
+        self.assertEqual(sorted(strong.subgraph(graph.ids)),
+                         [("9606.a", "9606.b", 900),
+                          ("9606.c", "9606.d", 700)])
+        self.assertEqual(strong.edges("9606.e"), [])
+
+    def test_from_edges(self):
+        graph = ppi.PPIGraph.from_edges(
+            [("a", "b", 1.0), ("b", "a", 3.0), ("b", "c", None)])
+        self.assertEqual(graph.ids, ["a", "b", "c"])
+        self.assertEqual(graph.edges("b"), [("b", "a", 3.0), ("b", "c", None)])
+        self.assertEqual(graph.edges("c"), [("c", "b", None)])
+        graph = ppi.PPIGraph.from_edges([("a", "b", 1.0), ("b", "x", 2.0)],
+                                        ids=["a", "b"])
+        self.assertEqual(graph.edges("b"), [("b", "a", 1.0)])
+
+    def test_all_edges_annotated(self):
+        edges = self.db.all_edges_annotated("9606")
+        self.assertEqual(sorted(e[:3] for e in edges), sorted(LINKS))
+
+
+class TestNetworkPropagation(unittest.TestCase):
+    def setUp(self):
+        self.graph = ppi.PPIGraph.from_edges(
+            [(a, b, s) for a, b, s in LINKS] + [("x", "y", None)])
+
+    def test_propagate(self):
+        gene_sets = [["9606.a"], ["9606.c", "9606.d", "unknown"], ["z"]]
+        for method in ["rwr", "label"]:
+            prop = ppi.NetworkPropagation(self.graph, method=method,
+                                          restart=0.3, tol=1e-10,
+                                          block_size=2)
+            Y = prop.seed_matrix(gene_sets)
+            numpy.testing.assert_allclose(Y.sum(axis=0), [1, 1, 0])
+            F = prop.propagate(gene_sets)
+            n = len(prop.ids)
+            exact = numpy.linalg.solve(
+                numpy.eye(n) - 0.7 * prop.matrix.toarray(), 0.3 * Y)
+            numpy.testing.assert_allclose(F, exact, atol=1e-8)
+            numpy.testing.assert_allclose(prop.propagate(Y[:, 1]), F[:, 1])
+            # no propagation between components
+            self.assertEqual(F[prop.node_indices(["x", "y"])].max(), 0)
+
+            # warm start from the solution
+            iterations = prop.iterations
+            prop.propagate(gene_sets, x0=F)
+            self.assertLess(prop.iterations, iterations)
+
+        prop = ppi.NetworkPropagation(self.graph)
+        ranked = prop.rank([["9606.a"]], n=2)[0]
+        self.assertEqual([id for id, _ in ranked], ["9606.b", "9606.c"])
+
+    def test_networks(self):
+        other = ppi.PPIGraph.from_edges([("9606.e", "9606.f", 1.0)])
+        prop = ppi.NetworkPropagation([self.graph, other], weights=[1, 0])
+        self.assertIn("9606.f", prop.ids)
+        F = prop.propagate([["9606.e"]])
+        self.assertEqual(F[prop.node_indices(["9606.f"]), 0], 0)
+        prop = ppi.NetworkPropagation([self.graph, other], weights=[1, 1])
+        F = prop.propagate([["9606.e"]])
+        self.assertGreater(F[prop.node_indices(["9606.f"]), 0], 0)
+        self.assertRaises(ValueError, ppi.NetworkPropagation,
+                          [self.graph, other], weights=[1])
+
+
+class TestSTRINGImport(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def flatfile(self, name, header, rows, sep):
+        filename = os.path.join(self.path, name)
+        with gzip.open(filename, "wb") as f:
+            for row in [header] + rows:
+                f.write((sep.join(map(str, row)) + "\n").encode("utf-8"))
+        return filename
+
+    def test_import(self):
+        links = self.flatfile("links.txt.gz",
+                              ["protein1", "protein2", "combined_score"],
+                              LINKS, " ")
+        actions = self.flatfile(
+            "actions.txt.gz",
+            ["item_id_a", "item_id_b", "mode", "action", "a_is_acting",
+             "score"],
+            [("9606.a", "9606.b", "binding", "", 0, 900)], "\t")
+        aliases = self.flatfile(
+            "aliases.txt.gz", ["string_protein_id", "alias", "source"],
+            [("9606.a", "A 1", "Ensembl"), ("9606.b", "B", "Ensembl")], "\t")
+        filename = os.path.join(self.path, "string.sqlite")
+        with open(filename, "wb") as f:
+            f.write(b"replaced")
+
+        ppi.STRING.import_db("v0", filename, links, actions, aliases,
+                             chunk_size=64)
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+
+        db = ppi.STRING(database=filename)
+        try:
+            self.assertEqual(db.ids("9606"),
+                             ["9606.a", "9606.b", "9606.c", "9606.d",
+                              "9606.e"])
+            self.assertEqual(sorted(db.edges("9606.a")),
+                             [("9606.a", "9606.b", 900),
+                              ("9606.a", "9606.c", 400)])
+            self.assertEqual(list(db.search_id("A 1", "9606")), ["9606.a"])
+            annotated = [tuple(e) for e in db.edges_annotated("9606.a")]
+            self.assertIn(("9606.a", "9606.b", 900, "", "binding", 900),
+                          annotated)
+            self.assertEqual(db.db.execute("SELECT * FROM version").fetchall(),
+                             [("v0", ppi.STRING.VERSION)])
+        finally:
+            db.db.close()
+
+        detailed = self.flatfile(
+            "detailed.txt.gz", ["protein1", "protein2", "neighborhood",
+                                "fusion", "cooccurence", "coexpression",
+                                "experimental", "database", "textmining",
+                                "combined_score"],
+            [("9606.a", "9606.b", 0, 0, 0, 100, 200, 0, 300, 900)], " ")
+        filename = os.path.join(self.path, "detailed.sqlite")
+        ppi.STRINGDetailed.import_detailed_db("v0", filename, detailed)
+        con = sqlite3.connect(filename)
+        self.assertEqual(con.execute("SELECT * FROM evidence").fetchall(),
+                         [("9606.a", "9606.b", 0, 0, 0, 100, 200, 0, 300)])
+        con.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
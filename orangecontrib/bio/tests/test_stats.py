@@ -0,0 +1,107 @@
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import stats, multitest
+
+
+class TestPValues(unittest.TestCase):
+    def check_p_values(self, prob):
+        rng = numpy.random.RandomState(42)
+        N = rng.randint(1, 500, size=300)
+        m = (rng.rand(300) * (N + 1)).astype(int)
+        n = (rng.rand(300) * (N + 1)).astype(int)
+        k = (rng.rand(300) * (numpy.minimum(n, m) + 3)).astype(int) - 1
+        # degenerate cases
+        m[:3] = 0
+        m[3:6] = N[3:6]
+
+        p_values = prob.p_values(k, N, m, n)
+        self.assertEqual(p_values.shape, (300,))
+        expected = [prob.p_value(*map(int, args)) for args in zip(k, N, m, n)]
+        numpy.testing.assert_allclose(p_values, expected,
+                                      rtol=1e-7, atol=1e-12)
+
+        # broadcasting scalar arguments
+        p_values = prob.p_values(k[:10], 500, 40, 20)
+        expected = [prob.p_value(int(ki), 500, 40, 20) for ki in k[:10]]
+        numpy.testing.assert_allclose(p_values, expected,
+                                      rtol=1e-7, atol=1e-12)
+
+    def test_binomial(self):
+        self.check_p_values(stats.Binomial())
+
+    def test_hypergeometric(self):
+        self.check_p_values(stats.Hypergeometric())
+
+    def test_chunked(self):
+        prob = stats.Hypergeometric()
+        prob._chunk_size = 7
+        k = numpy.arange(-1, 20)
+        numpy.testing.assert_allclose(
+            prob.p_values(k, 100, 30, 25),
+            [prob.p_value(int(ki), 100, 30, 25) for ki in k],
+            rtol=1e-7, atol=1e-12)
+
+    def test_fallback(self):
+        class Prob(object):
+            def p_value(self, k, N, m, n):
+                return 1.0 / (k + 1)
+
+        numpy.testing.assert_equal(
+            stats.p_values(Prob(), [0, 1, 3], 10, 5, 2), [1, 0.5, 0.25])
+        self.assertEqual(stats.p_values(stats.Binomial(), [], 10, 5, 2).shape,
+                         (0,))
+
+
+class TestMultitest(unittest.TestCase):
+    P = [0.01, 0.04, 0.03, 0.005, 0.5, 0.2, float("nan"), 0.04]
+
+    def test_fdr(self):
+        p = numpy.array(self.P)
+        valid = p[~numpy.isnan(p)]
+        m = len(valid)
+        # reference: the direct step-up definition
+        expected = [min(1, min(m * valid[j] / numpy.sum(valid <= valid[j])
+                               for j in range(m) if valid[j] >= v))
+                    for v in valid]
+        fdr = multitest.fdr_bh(p)
+        self.assertTrue(numpy.isnan(fdr[6]))
+        numpy.testing.assert_allclose(fdr[~numpy.isnan(p)], expected)
+        harmonic = numpy.sum(1. / numpy.arange(1, m + 1))
+        numpy.testing.assert_allclose(
+            multitest.fdr_by(valid),
+            numpy.minimum(numpy.array(expected) * harmonic, 1))
+        self.assertEqual(stats.FDR(list(valid)), list(multitest.fdr_bh(valid)))
+        self.assertEqual(stats.FDR([]), [])
+
+    def test_bonferroni_holm(self):
+        p = numpy.array([0.01, 0.04, 0.03, 0.5])
+        numpy.testing.assert_allclose(multitest.bonferroni(p),
+                                      [0.04, 0.16, 0.12, 1.0])
+        numpy.testing.assert_allclose(multitest.holm(p),
+                                      [0.04, 0.09, 0.09, 0.5])
+        numpy.testing.assert_allclose(stats.Bonferroni(list(p), m=10),
+                                      [0.1, 0.4, 0.3, 1.0])
+
+    def test_harmonic(self):
+        self.assertAlmostEqual(multitest.harmonic(1), 1.0)
+        self.assertAlmostEqual(multitest.harmonic(4), 25. / 12)
+        exact = numpy.sum(1. / numpy.arange(1, 100011, dtype=float))
+        self.assertAlmostEqual(multitest.harmonic(100010), exact, places=10)
+
+    def test_qvalues(self):
+        rng = numpy.random.RandomState(0)
+        p = numpy.hstack([rng.uniform(size=8000), rng.uniform(0, 1e-3, 2000)])
+        numpy.testing.assert_allclose(multitest.qvalues(p),
+                                      multitest.fdr_bh(p))
+        for method in ["spline", "loess"]:
+            pi0 = multitest.pi0_estimate(p, method)
+            self.assertTrue(0.7 < pi0 < 0.9, (method, pi0))
+            numpy.testing.assert_allclose(
+                multitest.qvalues(p, estimate_pi0=method),
+                numpy.minimum(pi0 * multitest.fdr_bh(p), 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import os
 
 from . import stats
+from . import multitest
 from . import expression
 from . import group
 from . import environ
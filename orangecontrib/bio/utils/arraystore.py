@@ -0,0 +1,193 @@
+"""
+Storage of named numpy arrays in a single binary file.
+
+The file starts with a JSON header describing the arrays (and arbitrary
+JSON serializable metadata) followed by the raw array data. The arrays
+are aligned so they can be memory mapped on load, letting several
+processes share the same pages.
+
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import struct
+import tempfile
+
+import numpy
+
+MAGIC = b"OBIARRS1"
+
+_ALIGN = 64
+
+# os.rename does not replace existing files on Windows
+_replace = getattr(os, "replace", os.rename)
+
+
+def _aligned(offset):
+    return offset + (-offset % _ALIGN)
+
+
+def save(filename, arrays, meta=None):
+    """
+    Save a dictionary of numpy `arrays` and JSON serializable `meta`
+    data to `filename`.
+
+    The file is written to a temporary file first and then renamed, so
+    concurrent readers never see a partially written file.
+
+    """
+    arrays = dict((name, numpy.ascontiguousarray(arr))
+                  for name, arr in arrays.items())
+    descr = {}
+    offset = 0
+    for name in sorted(arrays):
+        arr = arrays[name]
+        if arr.dtype.hasobject:
+            raise TypeError("Cannot store object array %r" % name)
+        descr[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape),
+                       "offset": offset}
+        offset = _aligned(offset + arr.nbytes)
+
+    header = json.dumps({"meta": meta, "arrays": descr}).encode("utf-8")
+    start = _aligned(len(MAGIC) + 8 + len(header))
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".arraystore-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name in sorted(arrays):
+                f.seek(start + descr[name]["offset"])
+                f.write(arrays[name].tobytes())
+            f.truncate(start + offset)
+        os.chmod(tmpname, 0o644)
+        _replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def load(filename, mmap=True):
+    """
+    Load the arrays and metadata stored in `filename` with :func:`save`.
+
+    Return a ``(arrays, meta)`` tuple. If `mmap` is True the arrays are
+    read-only memory maps of the file.
+
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%r is not an array store" % filename)
+        size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size).decode("utf-8"))
+        start = _aligned(len(MAGIC) + 8 + size)
+        arrays = {}
+        for name, d in header["arrays"].items():
+            dtype = numpy.dtype(d["dtype"])
+            shape = tuple(d["shape"])
+            count = int(numpy.prod(shape))
+            if mmap and count:
+                arrays[name] = numpy.memmap(
+                    filename, dtype=dtype, mode="r",
+                    offset=start + d["offset"], shape=shape)
+            else:
+                f.seek(start + d["offset"])
+                arrays[name] = numpy.fromfile(
+                    f, dtype=dtype, count=count).reshape(shape)
+    return arrays, header["meta"]
+
+
+def file_stamp(filename):
+    """
+    Return a JSON serializable stamp (size and modification time) of
+    `filename`, used to check whether a derived file is still valid.
+    """
+    st = os.stat(filename)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def load_valid(filename, meta, mmap=True):
+    """
+    Load `filename` if it exists and its metadata contains all the
+    items in `meta`. Return ``None`` otherwise.
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        arrays, stored_meta = load(filename, mmap=mmap)
+    except (ValueError, IOError, OSError, KeyError):
+        return None
+    if not isinstance(stored_meta, dict) or \
+            any(stored_meta.get(key) != value for key, value in meta.items()):
+        return None
+    return arrays, stored_meta
+
+
+def encode_strings(strings):
+    """
+    Encode a list of strings into an (`data`, `offsets`) pair of arrays
+    (utf-8 encoded concatenated strings and `len(strings) + 1` offsets).
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(s) for s in encoded], out=offsets[1:])
+    data = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+    return data, offsets
+
+
+def decode_strings(data, offsets):
+    """
+    Decode all strings encoded with :func:`encode_strings`.
+    """
+    buf = numpy.asarray(data).tobytes()
+    offsets = numpy.asarray(offsets).tolist()
+    return [buf[start:end].decode("utf-8")
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class StringTable(object):
+    """
+    A read-only sequence of strings encoded with :func:`encode_strings`
+    decoded on item access.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return iter(decode_strings(self.data, self.offsets))
+
+    def tolist(self):
+        return decode_strings(self.data, self.offsets)
+
+
+def store_strings(arrays, name, strings):
+    """
+    Encode `strings` into `arrays` dict as `name + "_data"` and
+    `name + "_offsets"` arrays.
+    """
+    arrays[name + "_data"], arrays[name + "_offsets"] = \
+        encode_strings(strings)
+
+
+def stored_strings(arrays, name):
+    """
+    Return a :class:`StringTable` for strings stored with
+    :func:`store_strings`.
+    """
+    return StringTable(arrays[name + "_data"], arrays[name + "_offsets"])
@@ -4,6 +4,7 @@ import numpy
 
 import Orange
 import scipy.stats
+import scipy.special
 
 try:
     from Orange.data import Variable, ContinuousVariable, DiscreteVariable
@@ -195,79 +196,196 @@ class ExpressionSignificance_Test(object):
     def _data_info(self, data):
         return [set(attr.attributes.items()) for attr in data.domain.attributes], [ex.getclass() for ex in data] if data.domain.class_var else [None]*len(data)
         
-    def test_indices(self, target, classes=None):
+    def group_masks(self, target, classes=None):
+        """
+        Return a boolean (number of groups x number of samples) array of
+        sample memberships of the groups defined by `target`.
+        """
         classes = self.classes if classes is None else classes
-        
+
         def target_set(target):
             if isinstance(target, tuple):
                 return set([target])
             else:
                 assert(isinstance(target, set))
                 return target
-            
+
         if self.useAttributeLabels:
             if isinstance(target, list):
-                ind = [[i for i, cl in enumerate(self.classes) if target_set(t).intersection(cl)] for t in target]
+                masks = [[bool(target_set(t).intersection(cl)) for cl in classes]
+                         for t in target]
             else:
                 target = target_set(target)
-                
-                ind1 = [i for i, cl in enumerate(self.classes) if target.intersection(cl)]
-                ind2 = [i for i, cl in enumerate(self.classes) if not target.intersection(cl)]
-                ind = [ind1, ind2]
+                in_target = [bool(target.intersection(cl)) for cl in classes]
+                masks = [in_target, [not m for m in in_target]]
         else:
             if isinstance(target, list):
-                ind = [ma.nonzero(self.classes == t)[0] for t in target]
+                masks = [np.asarray(classes == t, dtype=bool).reshape(-1)
+                         for t in target]
             else:
                 if isinstance(target, (str, Variable)):
                     target = set([target])
                 else:
                     assert(isinstance(target, set))
                 target = list(target)
-                ind1 = [i for i, cl in enumerate(self.classes) if cl in target]
-                ind2 = [i for i, cl in enumerate(self.classes) if cl not in target]
-                ind = [ind1, ind2]
-                
-        return ind
-    
+                in_target = [cl in target for cl in classes]
+                masks = [in_target, [not m for m in in_target]]
+
+        return np.array(masks, dtype=bool).reshape(len(masks), len(classes))
+
+    def test_indices(self, target, classes=None):
+        return [np.flatnonzero(mask)
+                for mask in self.group_masks(target, classes)]
+
     def __call__(self, target):
         raise NotImplementedError()
-    
+
+    def permutations(self, num, random_state=None):
+        """
+        Return a (`num` x number of samples) array of random sample
+        (class label) permutations.
+        """
+        if random_state is None:
+            random_state = np.random
+        elif isinstance(random_state, int):
+            random_state = np.random.RandomState(random_state)
+        n = len(self.classes)
+        return np.array([random_state.permutation(n) for _ in range(num)],
+                        dtype=int).reshape(num, n)
+
+    def _permuted(self, permutation):
+        # a shallow copy with permuted class labels (self is not modified)
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.classes = self.classes[permutation]
+        return other
+
     def null_distribution(self, num, *args, **kwargs):
         kwargs = dict(kwargs)
-        advance = lambda: None
-        if "advance" in kwargs:
-            advance = kwargs["advance"]
-            del kwargs["advance"]
+        advance = kwargs.pop("advance", lambda: None)
+        random_state = kwargs.pop("random_state", None)
         results = []
-        originalClasses = self.classes.copy()
-        for i in range(num):
-            np.random.shuffle(self.classes)
-            results.append(self.__call__(*args, **kwargs))
+        for permutation in self.permutations(num, random_state):
+            results.append(self._permuted(permutation)(*args, **kwargs))
             advance()
-        self.classes = originalClasses
         return results
-    
+
+    #: Max. number of elements in the intermediate (permutations x groups
+    #: x genes) arrays in `null_statistics`.
+    _null_chunk_size = 2 ** 22
+
+    def null_statistics(self, num, target, random_state=None, advance=None):
+        """
+        Return a (`num` x ``len(self.keys)``) array of the test statistic
+        on `num` random class label permutations. Undefined values are NaN.
+
+        Tests computable from group sums (t-test, fold change, signal to
+        noise, ANOVA) evaluate all permutations with matrix products
+        (in chunks of permutations). The instance is not modified.
+        """
+        advance = advance or (lambda: None)
+        permutations = self.permutations(num, random_state)
+        out = np.full((num, len(self.keys)), np.nan)
+        if not hasattr(self, "_statistics"):
+            for i, permutation in enumerate(permutations):
+                values = self._permuted(permutation)(target)
+                out[i] = [self._null_value_scalar(v) for _, v in values]
+                advance()
+            return out
+
+        masks = self.group_masks(target)
+        X = self.array
+        W = (~ma.getmaskarray(X)).astype(float)
+        V = ma.filled(X, 0.0).astype(float)
+        V2 = V * V
+        ngroups, nsamples = masks.shape
+        ngenes = V.shape[1]
+        chunk = max(1, self._null_chunk_size // max(ngroups * ngenes, 1))
+        for start in range(0, num, chunk):
+            perms = permutations[start:start + chunk]
+            # group memberships of samples under each permutation
+            G = masks[:, perms].transpose(1, 0, 2).astype(float)
+            G = G.reshape(-1, nsamples)
+            shape = (len(perms), ngroups, ngenes)
+            counts = G.dot(W).reshape(shape)
+            sums = G.dot(V).reshape(shape)
+            sumsq = G.dot(V2).reshape(shape)
+            sizes = G.sum(axis=1).reshape(len(perms), ngroups, 1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = self._null_value(
+                    self._statistics(counts, sums, sumsq, sizes))
+            out[start:start + len(perms)] = values
+            for _ in range(len(perms)):
+                advance()
+        out[~np.isfinite(out)] = np.nan
+        return out
+
+    def _null_value(self, values):
+        """
+        Transform the `_statistics` values into the null distribution
+        statistic (identity by default).
+        """
+        return values
+
+    def _null_value_scalar(self, value):
+        value = value[0] if isinstance(value, tuple) else value
+        return np.nan if value is ma.masked else float(value)
+
+
+def _group_moments(counts, sums, sumsq):
+    # group means and (population) variances from the group sums
+    mean = sums / counts
+    return mean, sumsq / counts - mean ** 2
+
+
 class ExpressionSignificance_TTest(ExpressionSignificance_Test):
+    #: Use p-values instead of t statistic in `null_statistics`.
+    _null_p_values = False
+
     def __call__(self, target):
         ind1, ind2 = self.test_indices(target)
         t, pval = attest_ind(self.array[ind1, :], self.array[ind2, :], dim=self.dim)
         return list(zip(self.keys,  zip(t, pval)))
-        
+
+    def _statistics(self, counts, sums, sumsq, sizes):
+        # matches `attest_ind`
+        mean, var = _group_moments(counts, sums, sumsq)
+        n1, n2 = sizes[:, 0], sizes[:, 1]
+        df = n1 + n2 - 2
+        svar = ((n1 - 1) * var[:, 0] + (n2 - 1) * var[:, 1]) / df
+        t = (mean[:, 0] - mean[:, 1]) / np.sqrt(svar * (1.0 / n1 + 1.0 / n2))
+        if self._null_p_values:
+            return scipy.special.betainc(0.5 * df, 0.5, df / (df + t ** 2))
+        else:
+            return t
+
 class ExpressionSignificance_FoldChange(ExpressionSignificance_Test):
     def __call__(self, target):
         ind1, ind2 = self.test_indices(target)
         a1, a2 = self.array[ind1, :], self.array[ind2, :]
         fold = ma.mean(a1, self.dim)/ma.mean(a2, self.dim)
         return list(zip(self.keys, fold))
-    
+
+    def _statistics(self, counts, sums, sumsq, sizes):
+        mean = sums / counts
+        return mean[:, 0] / mean[:, 1]
+
 class ExpressionSignificance_SignalToNoise(ExpressionSignificance_Test):
     def __call__(self, target):
         ind1, ind2 = self.test_indices(target)
         a1, a2 = self.array[ind1, :], self.array[ind2, :]
         stn = (ma.mean(a1, self.dim) - ma.mean(a2, self.dim)) / (ma.sqrt(ma.var(a1, self.dim)) + ma.sqrt(ma.var(a2, self.dim)))
         return list(zip(self.keys, stn))
-    
+
+    def _statistics(self, counts, sums, sumsq, sizes):
+        mean, var = _group_moments(counts, sums, sumsq)
+        std = np.sqrt(np.maximum(var, 0))
+        return (mean[:, 0] - mean[:, 1]) / (std[:, 0] + std[:, 1])
+
 class ExpressionSignificance_ANOVA(ExpressionSignificance_Test):
+    #: Use p-values instead of F statistic in `null_statistics`.
+    _null_p_values = False
+
     def __call__(self, target=None):
         if target is not None:
             indices = self.test_indices(target)
@@ -275,6 +393,23 @@ class ExpressionSignificance_ANOVA(ExpressionSignificance_Test):
             indices = []
         f, prob = aF_oneway(*[self.array[ind, :] for ind in indices], **dict(dim=0))
         return list(zip(self.keys, zip(f, prob)))
+
+    def _statistics(self, counts, sums, sumsq, sizes):
+        # matches `aF_oneway`
+        ngroups = counts.shape[1]
+        bign = counts.sum(axis=1)
+        total = sums.sum(axis=1)
+        sstot = sumsq.sum(axis=1) - total ** 2 / bign
+        ssbn = (sums ** 2 / counts).sum(axis=1) - total ** 2 / bign
+        sswn = sstot - ssbn
+        dfbn = float(ngroups - 1)
+        dfwn = bign - ngroups
+        F = (ssbn / dfbn) / (sswn / dfwn)
+        if self._null_p_values:
+            return scipy.special.betainc(0.5 * dfwn, 0.5 * dfbn,
+                                         dfwn / (dfwn + dfbn * F))
+        else:
+            return F
         
 class ExpressionSignificance_ChiSquare(ExpressionSignificance_Test):
     def __call__(self, target):
@@ -329,9 +464,9 @@ def attest_ind(a, b, dim=None):
     svar = ((n1-1)*v1+(n2-1)*v2) / df
     t = (x1-x2)/ma.sqrt(svar*(1.0/n1 + 1.0/n2))
     if t.ndim == 0:
-        return (t, scipy.stats.betai(0.5*df,0.5,df/(df+t**2)) if t is not ma.masked and df/(df+t**2) <= 1.0 else ma.masked)
+        return (t, scipy.special.betainc(0.5*df,0.5,df/(df+t**2)) if t is not ma.masked and df/(df+t**2) <= 1.0 else ma.masked)
     else:
-        prob = [scipy.stats.betai(0.5*df,0.5,df/(df+tsq)) if tsq is not ma.masked and df/(df+tsq) <= 1.0 else ma.masked  for tsq in t*t]
+        prob = [scipy.special.betainc(0.5*df,0.5,df/(df+tsq)) if tsq is not ma.masked and df/(df+tsq) <= 1.0 else ma.masked  for tsq in t*t]
         return t, prob
 
 def aF_oneway(*args, **kwargs):
@@ -351,10 +486,10 @@ def aF_oneway(*args, **kwargs):
     dfwn = bign - len(args) # + 1.0
     F = (ssbn / dfbn) / (sswn / dfwn)
     if F.ndim == 0 and dfwn.ndim == 0:
-        return (F,scipy.stats.betai(0.5 * dfwn, 0.5 * dfnum, dfwn/float(dfwn+dfnum*F)) if F is not ma.masked and dfwn/float(dfwn+dfnum*F) <= 1.0 \
+        return (F,scipy.special.betainc(0.5 * dfwn, 0.5 * dfnum, dfwn/float(dfwn+dfnum*F)) if F is not ma.masked and dfwn/float(dfwn+dfnum*F) <= 1.0 \
                 and dfwn/float(dfwn+dfnum*F) >= 0.0 else ma.masked)
     else:
-        prob = [scipy.stats.betai(0.5 * dfden, 0.5 * dfnum, dfden/float(dfden+dfnum*f)) if f is not ma.masked and dfden/float(dfden+dfnum*f) <= 1.0 \
+        prob = [scipy.special.betainc(0.5 * dfden, 0.5 * dfnum, dfden/float(dfden+dfnum*f)) if f is not ma.masked and dfden/float(dfden+dfnum*f) <= 1.0 \
             and dfden/float(dfden+dfnum*f) >= 0.0 else ma.masked for dfden, f in zip (dfwn, F)]
         return F, prob
     
@@ -428,6 +563,156 @@ Example::
     
 """
 
+#: Max. number of elements in the intermediate (points x neighbors)
+#: arrays in `lowess_fit`.
+_LOWESS_CHUNK_SIZE = 2 ** 21
+
+
+def _nearest_windows(xs, xq, k):
+    """
+    Return the start indices of the windows of `k` nearest neighbors in
+    sorted `xs` for all `xq` points (by a vectorized binary search).
+    """
+    n = len(xs)
+    lo = numpy.clip(numpy.searchsorted(xs, xq) - k, 0, n - k)
+    hi = numpy.clip(numpy.searchsorted(xs, xq), 0, n - k)
+    # invariant: the window start is in [lo, hi]; the window moves right
+    # while its right neighbor is closer than its first element
+    while numpy.any(lo < hi):
+        mid = (lo + hi) // 2
+        right = numpy.minimum(mid + k, n - 1)
+        move = (mid + k < n) & (xq - xs[mid] > xs[right] - xq)
+        lo = numpy.where(move, mid + 1, lo)
+        hi = numpy.where(move, hi, mid)
+    return lo
+
+
+def _lowess_points(xs, ys, xq, k, weights, progress=None):
+    """
+    Locally weighted linear regression of sorted `xs`, `ys` (with
+    point `weights`) evaluated at `xq` using `k` nearest neighbors.
+    """
+    start = _nearest_windows(xs, xq, k)
+    h = numpy.maximum(xq - xs[start], xs[start + k - 1] - xq)
+    # for ties use only the points at distance 0
+    h = numpy.where(h > 0, h, numpy.finfo(float).tiny)
+    yest = numpy.empty(len(xq))
+    offsets = numpy.arange(k)
+    chunk = max(1, _LOWESS_CHUNK_SIZE // k)
+    for i in range(0, len(xq), chunk):
+        sl = slice(i, i + chunk)
+        ind = start[sl, None] + offsets
+        dx = xs[ind] - xq[sl, None]
+        w = numpy.clip(numpy.abs(dx) / h[sl, None], 0.0, 1.0)
+        w = (1 - w ** 3) ** 3 * weights[ind]
+        y = ys[ind]
+        s0 = w.sum(axis=1)
+        sx = (w * dx).sum(axis=1)
+        sxx = (w * dx * dx).sum(axis=1)
+        sy = (w * y).sum(axis=1)
+        sxy = (w * dx * y).sum(axis=1)
+        det = s0 * sxx - sx * sx
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            # the intercept (the fit at xq, since dx is relative to xq)
+            fit = (sxx * sy - sx * sxy) / det
+            # use the weighted mean where the regression is degenerate
+            degenerate = numpy.abs(det) <= 1e-12 * numpy.maximum(s0 * sxx, 1e-300)
+            fit = numpy.where(degenerate, sy / s0, fit)
+        yest[sl] = fit
+        if progress:
+            progress(min(i + chunk, len(xq)) / len(xq))
+    return yest
+
+
+def lowess_fit(x, y, xest=None, f=2./3., iter=3, delta=0.0, weights=None,
+               progressCallback=None):
+    """
+    Robust locally weighted (tricube) linear regression (LOWESS).
+
+    Return the estimated values of `y` at `xest` (default: `x`). The
+    points are sorted once and each fit uses only its
+    ``min(ceil(f * len(x)), len(x) - 1) + 1`` nearest neighbors, all
+    fits are evaluated in vectorized chunks.
+
+    :param x: A 1-d array of x values.
+    :param y: A 1-d array or a (len(x), channels) array of y values
+        (the channels are smoothed independently).
+    :param xest: Points of evaluation (default: `x`).
+    :param float f: The smoothing span (the fraction of points used
+        in each local fit).
+    :param int iter: The number of fits (the first one and ``iter - 1``
+        robustifying iterations).
+    :param float delta: If positive, evaluate the fits on an evenly
+        spaced grid (with spacing at most `delta`) and interpolate.
+    :param weights: Optional point (prior) weights.
+    :param progressCallback: A function called with the progress (0-100).
+
+    """
+    x = numpy.asarray(x, dtype=float).ravel()
+    y = numpy.asarray(y, dtype=float)
+    xest = x if xest is None else numpy.asarray(xest, dtype=float).ravel()
+    n = len(x)
+    if y.shape[0] != n:
+        raise ValueError("x and y must have the same length")
+    if weights is None:
+        weights = numpy.ones(n)
+    else:
+        weights = numpy.asarray(weights, dtype=float).ravel()
+        if len(weights) != n:
+            raise ValueError("x and weights must have the same length")
+
+    if y.ndim == 2:
+        channels = y.shape[1]
+
+        def channel_callback(c):
+            if progressCallback:
+                return lambda p: progressCallback((100. * c + p) / channels)
+
+        return numpy.column_stack(
+            [lowess_fit(x, y[:, c], xest, f, iter, delta, weights,
+                        channel_callback(c))
+             for c in range(channels)]
+        ).reshape(len(xest), channels)
+
+    if n == 0:
+        return numpy.full(len(xest), numpy.nan)
+    elif n == 1:
+        return numpy.full(len(xest), y[0])
+
+    order = numpy.argsort(x, kind="mergesort")
+    xs, ys, ws = x[order], y[order], weights[order]
+    k = min(int(numpy.ceil(f * n)), n - 1) + 1
+    iter = max(int(iter), 1)
+
+    if delta > 0 and xs[-1] > xs[0]:
+        grid = numpy.linspace(
+            xs[0], xs[-1], int(numpy.ceil((xs[-1] - xs[0]) / delta)) + 1)
+    else:
+        grid = None
+
+    def fit(points, robust, step):
+        def progress(p):
+            if progressCallback:
+                progressCallback(100. * (step + p) / iter)
+
+        if grid is None:
+            return _lowess_points(xs, ys, points, k, ws * robust, progress)
+        else:
+            est = _lowess_points(xs, ys, grid, k, ws * robust, progress)
+            return numpy.interp(points, grid, est)
+
+    robust = numpy.ones(n)
+    for step in range(iter - 1):
+        residuals = ys - fit(xs, robust, step)
+        s = numpy.median(numpy.abs(residuals))
+        if s <= 0:
+            # an exact fit, further iterations would not change it
+            break
+        robust = numpy.clip(residuals / (6 * s), -1, 1)
+        robust = (1 - robust ** 2) ** 2
+    return fit(xest, robust, iter - 1)
+
+
 def lowess(x, y, f=2./3., iter=3, progressCallback=None):
     """ Lowess taken from Bio.Statistics.lowess, modified to compute pairwise 
     distances inplace.
@@ -464,56 +749,7 @@ def lowess(x, y, f=2./3., iter=3, progressCallback=None):
     >>> print "[%0.2f, ..., %0.2f]" % (result[0], result[-1])
     [4.85, ..., 84.98]
     """
-    n = len(x)
-    r = min(int(numpy.ceil(f*n)), n - 1)
-    
-#    h = [numpy.sort(numpy.abs(x-x[i]))[r] for i in range(n)]
-#    h, xtmp = numpy.zeros_like(x), numpy.zeros_like(x)
-#    for i in range(n):
-#        xtmp = numpy.abs(x - x[i], xtmp)
-#        h[i] = numpy.sort(xtmp)[r]
-#    w = numpy.clip(numpy.abs(([x]-numpy.transpose([x]))/h),0.0,1.0)
-    dist = [x] - numpy.transpose([x])
-    dist = numpy.abs(dist, dist)
-    dist.sort(axis=1)
-    h = dist[:, r]
-    del dist
-
-    w = [x]-numpy.transpose([x])
-    w /= h
-    w = numpy.abs(w, w)
-    w = numpy.clip(w, 0.0, 1.0, w)
-#    w = 1-w*w*w
-    w **= 3
-    w *= -1
-    w += 1
-#    w = w*w*w
-    w **= 3
-    yest = numpy.zeros(n)
-    delta = numpy.ones(n)
-    for iteration in range(iter):
-        for i in range(n):
-            weights = delta * w[:,i]
-            weights_mul_x = weights * x
-            b1 = numpy.ma.dot(weights,y)
-            b2 = numpy.ma.dot(weights_mul_x,y)
-            A11 = sum(weights)
-            A12 = sum(weights_mul_x)
-            A21 = A12
-            A22 = numpy.ma.dot(weights_mul_x,x)
-            determinant = A11*A22 - A12*A21
-            beta1 = (A22*b1-A12*b2) / determinant
-            beta2 = (A11*b2-A21*b1) / determinant
-            yest[i] = beta1 + beta2*x[i]
-            if progressCallback and (iteration * n + i) % (iter * n // 100 + 1) == 0:
-                progressCallback((100. * iteration*n + i) / (iter * n))
-        residuals = y-yest
-        s = median(abs(residuals))
-        delta[:] = numpy.clip(residuals/(6*s),-1,1)
-        delta[:] = 1-delta*delta
-        delta[:] = delta*delta
-    return yest
-
+    return lowess_fit(x, y, f=f, iter=iter, progressCallback=progressCallback)
 
 
 def lowess2(x, y, xest, f=2./3., iter=3, progressCallback=None):
@@ -531,81 +767,8 @@ def lowess2(x, y, xest, f=2./3., iter=3, progressCallback=None):
     Taken from Peter Juvan's numpyExtn.py, modified for numpy, computes pairwise
     distances inplace
     """
-    x = numpy.asarray(x, 'f')
-    y = numpy.asarray(y, 'f')
-    xest = numpy.asarray(xest, 'f')
-    n = len(x)
-    nest = len(xest)
-    r = min(int(numpy.ceil(f*n)),n-1) # radius: num. of points to take into LR
-#    h = [numpy.sort(numpy.abs(x-x[i]))[r] for i in range(n)]    # distance of the r-th point from x[i]
-    dist = [x] - numpy.transpose([x])
-    dist = numpy.abs(dist, dist)
-    dist.sort(axis=1)
-    h = dist[:, r]
-    del dist # to free memory
-    w = [x] - numpy.transpose([x])
-    w /= h
-    w = numpy.abs(w, w)
-    w = numpy.clip(w, 0.0, 1.0, w)
-#    w = numpy.clip(numpy.abs(([x]-numpy.transpose([x]))/h),0.0,1.0)
-    w **= 3
-    w *= -1
-    w += 1
-#    w = 1 - w**3 #1-w*w*w
-    w **= 3
-#    w = w**3 #w*w*w
-#    hest = [numpy.sort(numpy.abs(x-xest[i]))[r] for i in range(nest)]    # r-th min. distance from xest[i] to x
-    dist = [x] - numpy.transpose([xest])
-    dist = numpy.abs(dist, dist)
-    dist.sort(axis=1)
-    hest = dist[:, r]
-    del dist # to free memory
-#    west = numpy.clip(numpy.abs(([xest]-numpy.transpose([x]))/hest),0.0,1.0)  # shape: (len(x), len(xest)
-    west = [xest]-numpy.transpose([x])
-    west /= hest
-    west = numpy.abs(west, west)
-    west = numpy.clip(west, 0.0, 1.0, west)
-#    west = 1 - west**3 #1-west*west*west
-    west **= 3
-    west *= -1
-    west += 1
-#    west = west**3 #west*west*west
-    west **= 3
-    yest = numpy.zeros(n,'f')
-    yest2 = numpy.zeros(nest,'f')
-    delta = numpy.ones(n,'f')
-    iter_count = iter*(nest + n) if iter > 1 else nest
-
-    curr_iter = 0
-    for iteration in range(iter):
-        # fit xest
-        for i in range(nest):
-            weights = delta * west[:,i]
-            b = numpy.array([numpy.sum(weights*y), numpy.sum(weights*y*x)])
-            A = numpy.array([[numpy.sum(weights), numpy.sum(weights*x)], [numpy.sum(weights*x), numpy.sum(weights*x*x)]])
-            beta = numpy.linalg.solve(A, b)
-            yest2[i] = beta[0] + beta[1]*xest[i]
-            if progressCallback and curr_iter % (iter_count // 100 + 1) == 0:
-                progressCallback(100. * curr_iter / iter_count)
-            curr_iter += 1
-                
-        # fit x (to calculate residuals and delta)
-        if iter > 1:
-            for i in range(n):
-                weights = delta * w[:,i]
-                b = numpy.array([numpy.sum(weights*y), numpy.sum(weights*y*x)])
-                A = numpy.array([[numpy.sum(weights), numpy.sum(weights*x)], [numpy.sum(weights*x), numpy.sum(weights*x*x)]])
-                beta = numpy.linalg.solve(A,b)
-                yest[i] = beta[0] + beta[1]*x[i]
-                if progressCallback and curr_iter % (iter_count // 100 + 1) == 0:
-                    progressCallback(100. * curr_iter / iter_count)
-                curr_iter += 1
-            residuals = y-yest
-            s = numpy.median(numpy.abs(residuals))
-            delta = numpy.clip(residuals/(6*s), -1, 1)
-            delta = 1-delta*delta
-            delta = delta*delta
-    return yest2
+    return lowess_fit(x, y, xest, f=f, iter=iter,
+                      progressCallback=progressCallback)
 
 
 def attr_group_indices(data, label_groups):
@@ -747,42 +910,62 @@ def MA_center_average(G, R):
     return G, R.copy()
 
 
-def MA_center_lowess(G, R, f=2./3., iter=1, progressCallback=None):
-    """ return the G, R by centering the average log2 ratio locally
-    depending on the intensity using lowess (locally weighted linear regression)
+def _MA_center_columns(G, R, estimate, progressCallback=None):
+    """ Center the log2 ratio of (each column of) G, R using the
+    `estimate(intensity, ratio, progressCallback)` of the local center.
     """
-#    from Bio.Statistics.lowess import lowess
+    if numpy.ndim(G) == 2:
+        columns = G.shape[1]
+        Gc, Rc = numpy.ma.array(G, copy=True), numpy.ma.array(R, copy=True)
+        for i in range(columns):
+            callback = None
+            if progressCallback:
+                callback = lambda val, i=i: progressCallback((100. * i + val) / columns)
+            Gc[:, i], Rc[:, i] = _MA_center_columns(G[:, i], R[:, i], estimate, callback)
+        Gc.mask, Rc.mask = numpy.ma.getmaskarray(Gc), numpy.ma.getmaskarray(Rc)
+        return Gc, Rc
+
     ratio, intensity = ratio_intensity(G, R)
-    valid = ~ (ratio.mask & intensity.mask)
-    valid_ind = numpy.ma.where(valid)
-    center_est = lowess(intensity[valid], ratio[valid], f=f, iter=iter, progressCallback=progressCallback)
+    valid = ~ (numpy.ma.getmaskarray(ratio) | numpy.ma.getmaskarray(intensity))
+    x = numpy.ma.getdata(intensity)[valid]
+    y = numpy.ma.getdata(ratio)[valid]
+    center_est = estimate(x, y, progressCallback) if len(x) else y
     Gc, R = G.copy(), R.copy()
     Gc[valid] *= numpy.exp2(center_est)
     Gc.mask, R.mask = ~valid, ~valid
     return Gc, R
 
 
+def MA_center_lowess(G, R, f=2./3., iter=1, progressCallback=None, delta=None):
+    """ return the G, R by centering the average log2 ratio locally
+    depending on the intensity using lowess (locally weighted linear regression)
+
+    If G and R are 2-d arrays each column (array) is centered separately.
+    The local fits are evaluated at intervals of `delta` (default 1% of
+    the intensity range) and interpolated in between.
+    """
+    def estimate(x, y, callback):
+        d = 0.01 * (x.max() - x.min()) if delta is None else delta
+        return lowess_fit(x, y, f=f, iter=iter, delta=d,
+                          progressCallback=callback)
+    return _MA_center_columns(G, R, estimate, progressCallback)
+
+
 def MA_center_lowess_fast(G, R, f=2./3., iter=1, resolution=100, progressCallback=None):
     """return the G, R by centering the average log2 ratio locally
     depending on the intensity using lowess (locally weighted linear regression),
     approximated only in a limited resolution.
-    """
-    
-    ratio, intensity = ratio_intensity(G, R)
-    valid = ~ (ratio.mask & intensity.mask)
-    resolution = min(resolution, len(intensity[valid]))
-    hist, edges = numpy.histogram(intensity[valid], len(intensity[valid])//resolution)
-    
-    progressCallback2 = (lambda val: progressCallback(val/2)) if progressCallback else None 
-    centered = lowess2(intensity[valid], ratio[valid], edges, f, iter, progressCallback=progressCallback2)
 
-    progressCallback2 = (lambda val: progressCallback(50 + val/2)) if progressCallback else None
-    centered = lowess2(edges, centered, intensity[valid], f, iter, progressCallback=progressCallback2)
-    
-    Gc, R = G.copy(), R.copy()
-    Gc[valid] *= numpy.exp2(centered)
-    Gc.mask, R.mask = ~valid, ~valid
-    return Gc, R
+    The lowess curve is evaluated at the histogram bin edges (one bin
+    per `resolution` points) and linearly interpolated in between.
+    """
+    def estimate(x, y, callback):
+        res = min(resolution, len(x))
+        _, edges = numpy.histogram(x, max(len(x) // res, 1))
+        centered = lowess_fit(x, y, edges, f, iter,
+                              progressCallback=callback)
+        return numpy.interp(x, edges, centered)
+    return _MA_center_columns(G, R, estimate, progressCallback)
 
 
 def MA_plot(G, R, format="b."):
@@ -834,6 +1017,71 @@ def normalize_expression_data(data, groups, axis=1, merge_function=numpy.ma.aver
 def MA_zscore(G, R, window=1./5., padded=False, progressCallback=None):
     """ Return the Z-score of log2 fold ratio estimated from local
     distribution of log2 fold ratio values on the MA-plot
+
+    The local standard deviation is computed over a sliding window of
+    ``ceil(len(G) * window)`` points ordered by intensity (from cumulative
+    sums of ratio and ratio squared). If `padded` the windows at the
+    ends are padded with the first/last points. Masked ratios are ignored
+    and their Z-scores are masked.
+    """
+    ratio, intensity = ratio_intensity(G, R)
+    ratio = numpy.ma.ravel(ratio)
+    n = len(ratio)
+    order = numpy.ma.argsort(numpy.ma.ravel(intensity))
+    r = int(numpy.ceil(n * window)) # number of window elements
+
+    if progressCallback:
+        progressCallback(0.0)
+
+    values = numpy.ma.getdata(ratio)[order].astype(float)
+    valid = ~numpy.ma.getmaskarray(ratio)[order]
+    finite = valid & numpy.isfinite(values)
+    # non finite values make the std. of all windows they are in undefined
+    nonfinite = valid & ~finite
+    # center the values to reduce the cancellation in sum(x^2) - sum(x)^2
+    center = values[finite].mean() if finite.any() else 0.0
+    centered = numpy.where(finite, values - center, 0.0)
+
+    def cumulative(x):
+        c = numpy.zeros(n + 1)
+        numpy.cumsum(x, out=c[1:])
+        return c
+
+    index = numpy.arange(n)
+    start = numpy.clip(index - r // 2, 0, n)
+    end = numpy.clip(index + r // 2 + r % 2, 0, n)
+    pad_start = numpy.clip(r // 2 - index, 0, n)
+    pad_end = numpy.clip(index + r // 2 + r % 2 - n, 0, n)
+
+    def window_sums(x):
+        c = cumulative(x)
+        sums = c[end] - c[start]
+        if padded:
+            sums += c[pad_start] + (c[n] - c[n - pad_end])
+        return sums
+
+    count = window_sums(finite)
+    sum1 = window_sums(centered)
+    sum2 = window_sums(centered ** 2)
+    undefined = window_sums(nonfinite) > 0
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean = sum1 / count
+        local_std = numpy.sqrt(numpy.maximum(sum2 / count - mean ** 2, 0.0))
+        local_std[undefined] = numpy.nan
+        z = numpy.empty(n)
+        z[order] = values / local_std
+
+    if progressCallback:
+        progressCallback(100.0)
+
+    z = z.reshape(numpy.shape(G))
+    mask = ~numpy.isfinite(z) | numpy.ma.getmaskarray(ratio).reshape(z.shape)
+    return numpy.ma.array(numpy.where(mask, 0.0, z), mask=mask)
+
+
+def _MA_zscore_reference(G, R, window=1./5., padded=False, progressCallback=None):
+    """ Reference (quadratic time) implementation of `MA_zscore`.
     """
     ratio, intensity = ratio_intensity(G, R)
     
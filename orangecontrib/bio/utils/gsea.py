@@ -0,0 +1,571 @@
+"""
+Enrichment scores and their significance for gene set enrichment
+analysis (GSEA) on precomputed rankings (correlations of genes with
+the class).
+
+These functions only need numpy (and scipy); the GSEA on Orange example
+tables is in :mod:`orangecontrib.bio.gsea`.
+
+"""
+from __future__ import absolute_import
+
+from functools import partial, reduce
+import multiprocessing
+import random
+import warnings
+
+import six
+if six.PY3:
+    import pickle
+else:
+    import cPickle as pickle
+
+import numpy
+
+
+def mean(l):
+    return float(sum(l))/len(l)
+
+def orderedPointersCorr(lcor):
+    """
+    Return a list of integers: indexes in original
+    lcor. Elements in the list are ordered by
+    their lcor[i] value. Higher correlations first.
+    """
+    ordered = [ (i,a) for i,a in enumerate(lcor) ] #original pos + correlation
+    ordered.sort(key=lambda x: -x[1]) #sort by correlation, descending
+    ordered = nth(ordered, 0) #contains positions in the original list
+    return ordered
+
+def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+    """
+    Input data and subset. 
+    
+    subset: list of attribute indices of the input data belonging
+        to the same set.
+    lcor: correlations with class for each attribute in a list. 
+
+    Returns enrichment score on given data.
+
+    This implementation efficiently handles "sparse" genesets (that
+    cover only a small subset of all genes in the dataset).
+    """
+
+    #print lcor
+
+    subset = set(subset)
+
+    if rev2 is None:
+        def rev(l):
+            return numpy.argsort(l)
+        rev2 = rev(ordered)
+
+    #add if gene is not in the subset
+    notInA = -(1. / (len(lcor)-len(subset)))
+    #base for addition if gene is in the subset
+
+    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
+    sumcors = sum(cors)
+
+    #this should not happen
+    if sumcors == 0.0:
+        return (0.0, None)
+    
+    inAb = 1./sumcors
+
+    ess = [0.0]
+    
+    map = {}
+    for i in subset:
+        orderedpos = rev2[i]
+        map[orderedpos] = inAb*abs(lcor[i]**p)
+        
+    last = 0
+
+    maxSum = minSum = csum = 0.0
+
+    for a,b in sorted(map.items()):
+        diff = a-last
+        csum += notInA*diff
+        last = a+1
+        
+        if csum < minSum:
+            minSum = csum
+        
+        csum += b
+
+        if csum > maxSum:
+            maxSum = csum
+
+    #finish it
+    diff = (len(ordered))-last
+    csum += notInA*diff
+
+    if csum < minSum:
+        minSum = csum
+
+    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
+
+    """
+    #BY DEFINITION
+    print("subset", subset)
+
+    for i in ordered:
+        ess.append(ess[-1] + \
+            (inAb*abs(lcor[i]**p) if i in subset else notInA)
+        )
+        if i in subset:
+            print(ess[-2], ess[-1])
+            print(i, (inAb*abs(lcor[i]**p)))
+
+    maxEs = max(ess)
+    minEs = min(ess)
+    
+    print("REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:]))
+
+    """
+    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+
+def geneSetMembership(subsets, ngenes):
+    """
+    Return a sparse (len(subsets) x ngenes) binary membership matrix
+    of gene sets given as lists of attribute indices.
+
+    The members of each set are kept in the iteration order of
+    set(subset), the order in which enrichmentScoreRanked sums
+    their weights.
+    """
+    import scipy.sparse
+    subsets = [ list(set(subset)) for subset in subsets ]
+    indptr = numpy.cumsum([0] + [ len(subset) for subset in subsets ])
+    indices = numpy.array([ i for subset in subsets for i in subset ],
+                          dtype=int)
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices)), indices, indptr),
+        shape=(len(subsets), ngenes))
+
+def enrichmentScoresBatch(rankings, membership, p=1.0):
+    """
+    Compute enrichment scores of all gene sets for multiple rankings
+    at once.
+
+    rankings: a (nrankings x ngenes) array of correlations with class
+        (one row per ranking, for example one per permutation).
+    membership: a sparse (nsets x ngenes) gene set membership matrix
+        (see geneSetMembership).
+
+    Returns a (nrankings x nsets) array of enrichment scores, equal to
+    the scores of enrichmentScoreRanked.
+
+    The running sum is only evaluated at the positions of gene set members.
+    It is accumulated separately for each set (vectorized over sets and
+    rankings) in the same order as in enrichmentScoreRanked, so equal
+    running sums (ties between the observed and the null scores) are
+    preserved exactly.
+    """
+    rankings = numpy.atleast_2d(numpy.asarray(rankings, dtype=float))
+    nrankings, ngenes = rankings.shape
+    membership = membership.tocsr()
+    nsets = membership.shape[0]
+    sizes = numpy.diff(membership.indptr)
+    genes = membership.indices
+    rows = numpy.repeat(numpy.arange(nsets), sizes)
+
+    if not len(genes):
+        return numpy.zeros((nrankings, nsets))
+
+    #positions of all genes in the (descending, stable) ordering
+    ordered = numpy.argsort(-rankings, axis=1, kind="mergesort")
+    positions = numpy.empty_like(ordered)
+    numpy.put_along_axis(positions, ordered,
+        numpy.arange(ngenes)[numpy.newaxis, :], axis=1)
+
+    #sums of weights (in the order of the membership matrix)
+    cors = numpy.abs(rankings[:, genes]) ** p
+    sumw = numpy.zeros((nrankings, nsets))
+    for k in range(sizes.max()):
+        active = numpy.flatnonzero(sizes > k)
+        sumw[:, active] += cors[:, membership.indptr[active] + k]
+    with numpy.errstate(divide="ignore"):
+        inAb = numpy.where(sumw > 0, 1. / sumw, 0)
+
+    #sort the members of each set by their positions
+    pos = positions[:, genes]
+    order = numpy.argsort(rows * ngenes + pos, axis=1, kind="mergesort")
+    pos = numpy.take_along_axis(pos, order, axis=1)
+    weights = inAb[:, rows] * numpy.take_along_axis(
+        numpy.abs(rankings[:, genes] ** p), order, axis=1)
+
+    #decrement for each gene not in the set
+    notInA = -(1. / numpy.maximum(ngenes - sizes, 1))
+
+    csum = numpy.zeros((nrankings, nsets))
+    maxSum = numpy.zeros((nrankings, nsets))
+    minSum = numpy.zeros((nrankings, nsets))
+    last = numpy.zeros((nrankings, nsets), dtype=int)
+    for k in range(sizes.max()):
+        active = numpy.flatnonzero(sizes > k)
+        cols = membership.indptr[active] + k
+        a = pos[:, cols]
+        c = csum[:, active] + notInA[active] * (a - last[:, active])
+        minSum[:, active] = numpy.minimum(minSum[:, active], c)
+        c += weights[:, cols]
+        maxSum[:, active] = numpy.maximum(maxSum[:, active], c)
+        csum[:, active] = c
+        last[:, active] = a + 1
+    csum += notInA * (ngenes - last)
+    minSum = numpy.minimum(minSum, csum)
+
+    es = numpy.where(numpy.abs(maxSum) > numpy.abs(minSum), maxSum, minSum)
+    es[sumw == 0] = 0.0
+    return es
+
+def shuffleList(l, rand=random.Random(0)):
+    """
+    Returns a copy of a shuffled input list.
+    """
+    import copy
+    l2 = copy.copy(l)
+    rand.shuffle(l2)
+    return l2
+
+def gseapval(es, esnull):
+    """
+    From article (PNAS):
+    estimate nominal p-value for S from esnull by using the positive
+    or negative portion of the distribution corresponding to the sign 
+    of the observed ES(S).
+    """
+    
+    try:
+        if es < 0:
+            return float(len([ a for a in esnull if a <= es ]))/ \
+                len([ a for a in esnull if a < 0])    
+        else: 
+            return float(len([ a for a in esnull if a >= es ]))/ \
+                len([ a for a in esnull if a >= 0])
+    except:
+        return 1.0
+
+def runOptCallbacks(callback):
+    if callback is not None:
+        try:
+            [ a() for a in callback ]
+        except:
+            callback()            
+
+def gseaR(rankings, subsets, n, callback=None, n_jobs=1):
+    """
+    Run GSEA on precomputed rankings, permuting the gene order.
+    """
+    nullRanking = partial(genePermutationRanking, rankings)
+    return gseaBatch(rankings, nullRanking, n, subsets, callback=callback,
+                     n_jobs=n_jobs)
+
+def genePermutationRanking(rankings, i):
+    """
+    Return the i-th null ranking obtained by permuting the
+    rankings (with a fixed seed).
+    """
+    return shuffleList(rankings, random.Random(2000+i))
+
+def gseaSignificance(enrichmentScores, enrichmentNulls):
+
+    #print enrichmentScores
+
+    import time
+
+    tb1 = time.time()
+
+    enrichmentPVals = []
+    nEnrichmentScores = []
+    nEnrichmentNulls = []
+
+    for i in range(len(enrichmentScores)):
+        es = enrichmentScores[i]
+        enrNull = enrichmentNulls[i]
+        #print es, enrNull
+
+        enrichmentPVals.append(gseapval(es, enrNull))
+
+        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
+        #the positive and negative scores by divident by the mean of the 
+        #ES(S,pi)
+
+        #print es, enrNull
+
+        def normalize(s):
+            try:
+                if s == 0:
+                    return 0.0
+                if s >= 0:
+                    meanPos = mean([a for a in enrNull if a >= 0])
+                    #print s, meanPos
+                    return s/meanPos
+                else:
+                    meanNeg = mean([a for a in enrNull if a < 0])
+                    #print s, meanNeg
+                    return -s/meanNeg
+            except:
+                return 0.0 #return if according mean value is uncalculable
+
+
+        nes = normalize(es)
+        nEnrichmentScores.append(nes)
+        
+        nenrNull = [ normalize(s) for s in enrNull ]
+        nEnrichmentNulls.append(nenrNull)
+ 
+
+    #print "First part", time.time() - tb1
+
+    #FDR computation
+    #create a histogram of all NES(S,pi) over all S and pi
+    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
+
+
+    def shorten(l, p=10000):
+        """
+        Take each len(l)/p element, if len(l)/p >= 2.
+        """
+        e = len(l)/p
+        if e <= 1:
+            return l
+        else:
+            return [ l[i] for i in range(0, len(l), e) ]
+
+    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
+
+    """
+    Use this null distribution to compute an FDR q value, for a given NES(S) =
+    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
+    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
+    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
+    = NES* <= 0.
+    """
+
+    nvals = numpy.array(sorted(vals))
+    nnes = numpy.array(sorted(nEnrichmentScores))
+
+    #print "LEN VALS", len(vals), len(nEnrichmentScores)
+
+    fdrs = []
+
+    import operator
+
+    for i in range(len(enrichmentScores)):
+
+        nes = nEnrichmentScores[i]
+
+        """
+        #Strighfoward but slow implementation follows in comments.
+        #Useful as code description.
+        
+        if nes >= 0:
+            op0 = operator.ge
+            opn = operator.ge
+        else:
+            op0 = operator.lt
+            opn = operator.le
+
+        allPos = [a for a in vals if op0(a,0)]
+        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
+
+        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
+        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
+
+        top = len(allHigherAndPos)/float(len(allPos)) #p value
+        down = len(nesHigherAndPos)/float(len(nesPos))
+        
+        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
+
+        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
+
+        """
+
+        #this could be speed up twice with the same accuracy! 
+        if nes >= 0:
+            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
+            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
+            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
+            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
+        else:
+            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
+            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
+            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
+            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
+           
+        """
+        #Comparing results
+        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
+        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
+        sumd = sum( [ abs(a) for a in diffs ] )
+        if sumd > 0:
+            print(nes > 0)
+            print("orig", l1)
+            print("modi", l2)
+        """
+
+        try:
+            top = allHigherAndPos/float(allPos) #p value
+            down = nesHigherAndPos/float(nesPos)
+
+            fdrs.append(top/down)
+        except:
+            fdrs.append(1000000000.0)
+    
+    #print "Whole part", time.time() - tb1
+
+    return zip(enrichmentScores, nEnrichmentScores, enrichmentPVals, fdrs)
+
+
+def gseaSignificanceBatch(enrichmentScores, enrichmentNulls):
+    """
+    Vectorized gseaSignificance.
+
+    enrichmentScores: an array of enrichment scores for nsets gene sets.
+    enrichmentNulls: a (npermutations x nsets) array of null enrichment
+        scores.
+
+    Returns the same list of (es, nes, p, fdr) tuples as gseaSignificance.
+    """
+    es = numpy.asarray(enrichmentScores, dtype=float)
+    nulls = numpy.asarray(enrichmentNulls, dtype=float).reshape(-1, len(es))
+
+    pos = nulls >= 0
+    npos = pos.sum(axis=0)
+    nneg = len(nulls) - npos
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        meanPos = numpy.where(pos, nulls, 0).sum(axis=0) / npos
+        meanNeg = numpy.where(pos, 0, nulls).sum(axis=0) / nneg
+
+        pvals = numpy.where(es < 0,
+            (nulls <= es).sum(axis=0) / nneg.astype(float),
+            (nulls >= es).sum(axis=0) / npos.astype(float))
+        pvals[~numpy.isfinite(pvals)] = 1.0
+
+        def normalize(s):
+            #rescale positive and negative scores separately by the
+            #mean of the positive/negative null scores of the set
+            n = numpy.where(s >= 0, s / meanPos, -s / meanNeg)
+            n[(s == 0) | ~numpy.isfinite(n)] = 0.0
+            return n
+
+        nes = normalize(es)
+        nvals = numpy.sort(normalize(nulls).ravel())
+    nnes = numpy.sort(nes)
+
+    #FDR (see gseaSignificance)
+    allPos = numpy.where(nes >= 0,
+        len(nvals) - numpy.searchsorted(nvals, 0, side="left"),
+        numpy.searchsorted(nvals, 0, side="left"))
+    allHigherAndPos = numpy.where(nes >= 0,
+        len(nvals) - numpy.searchsorted(nvals, nes, side="left"),
+        numpy.searchsorted(nvals, nes, side="right"))
+    nesPos = numpy.where(nes >= 0,
+        len(nnes) - numpy.searchsorted(nnes, 0, side="left"),
+        numpy.searchsorted(nnes, 0, side="left"))
+    nesHigherAndPos = numpy.where(nes >= 0,
+        len(nnes) - numpy.searchsorted(nnes, nes, side="left"),
+        numpy.searchsorted(nnes, nes, side="right"))
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        top = allHigherAndPos / allPos.astype(float)
+        down = nesHigherAndPos / nesPos.astype(float)
+        fdrs = top / down
+    fdrs[(allPos == 0) | (nesPos == 0) | (down == 0)] = 1000000000.0
+
+    return list(zip(es.tolist(), nes.tolist(), pvals.tolist(), fdrs.tolist()))
+
+_gseaWorkerState = None
+
+def _gseaInitWorker(nullRanking, membership):
+    global _gseaWorkerState
+    _gseaWorkerState = (nullRanking, membership)
+
+def _gseaNullChunk(bounds):
+    nullRanking, membership = _gseaWorkerState
+    start, stop = bounds
+    return enrichmentScoresBatch(
+        [ nullRanking(i) for i in range(start, stop) ], membership)
+
+def _picklableForWorkers(obj):
+    """
+    Can obj be passed to worker processes (the pool initializer
+    arguments are only pickled if the processes are not forked).
+    """
+    getStartMethod = getattr(multiprocessing, "get_start_method", None)
+    if getStartMethod is None or getStartMethod() == "fork":
+        return True
+    try:
+        pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    return True
+
+def gseaBatch(rankings, nullRanking, n, subsets, chunk=50, callback=None,
+        n_jobs=1):
+    """
+    Run GSEA for given rankings with all enrichment scores computed by
+    enrichmentScoresBatch.
+
+    rankings: correlations with class for each attribute.
+    nullRanking: a function returning the i-th ranking (of the same
+        length) used to sample the null distribution.
+    n: number of null rankings.
+    subsets: list of distinct subsets of attribute indices.
+    chunk: number of null rankings processed at once.
+    n_jobs: number of worker processes to distribute chunks of null
+        rankings to (None for all processors). The workers inherit the
+        data in nullRanking (copy-on-write with the "fork" start method;
+        otherwise it needs to be picklable, and the permutations run in
+        a single process with a warning if it is not). Results do not
+        depend on n_jobs or chunk.
+
+    Returns a list of (es, nes, p, fdr) tuples like gseaSignificance.
+    """
+    membership = geneSetMembership(subsets, len(rankings))
+    enrichmentScores = enrichmentScoresBatch([rankings], membership)[0]
+    runOptCallbacks(callback)
+
+    chunks = [ (start, min(start + chunk, n)) for start in range(0, n, chunk) ]
+
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(chunks))
+
+    if n_jobs > 1 and not _picklableForWorkers((nullRanking, membership)):
+        warnings.warn("nullRanking can not be pickled; computing the "
+                      "permutations in a single process", RuntimeWarning)
+        n_jobs = 1
+
+    pool = None
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, _gseaInitWorker,
+                                    (nullRanking, membership))
+        results = pool.imap(_gseaNullChunk, chunks)
+    else:
+        _gseaInitWorker(nullRanking, membership)
+        results = map(_gseaNullChunk, chunks)
+
+    enrichmentNulls = []
+    try:
+        #results are merged in the permutation order
+        for (start, stop), nulls in zip(chunks, results):
+            enrichmentNulls.append(nulls)
+            for _ in range(start, stop):
+                runOptCallbacks(callback)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        else:
+            _gseaInitWorker(None, None)
+
+    if enrichmentNulls:
+        enrichmentNulls = numpy.vstack(enrichmentNulls)
+    else:
+        enrichmentNulls = numpy.zeros((0, len(subsets)))
+    return gseaSignificanceBatch(enrichmentScores, enrichmentNulls)
+
+def nth(l,n): return [ a[n] for a in l ]
@@ -0,0 +1,447 @@
+"""
+A persistent cache of HTTP responses shared between connections and
+processes.
+
+Response bodies are stored (zlib compressed) in files named by the
+SHA-1 digest of their contents, so identical responses are stored only
+once. An SQLite index (in WAL mode) maps the request keys to the bodies
+and records the response headers (with the ETag/Last-Modified
+validators) and the storage/access times used for expiry and LRU
+eviction. The total size of the stored bodies is kept up to date in the
+index, so checking the size budget does not need a scan.
+
+>>> cache = HTTPCache("/tmp/cache", max_size=100 * 2 ** 20, ttl=3600)
+>>> stream = cache.urlopen("http://www.example.com/")  # doctest: +SKIP
+
+"""
+from __future__ import absolute_import
+
+import os
+import io
+import email
+import errno
+import hashlib
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+import zlib
+
+from contextlib import contextmanager
+
+from six.moves.urllib.request import Request, urlopen
+from six.moves.urllib.response import addinfourl
+from six.moves.urllib.error import HTTPError, URLError
+
+# os.rename does not replace existing files on Windows
+_replace = getattr(os, "replace", os.rename)
+
+#: Bodies smaller than this are not compressed.
+COMPRESS_MIN_SIZE = 256
+
+
+class CachedResponse(object):
+    """
+    A response stored in the cache.
+
+    :ivar str key: The cache key.
+    :ivar bytes body: The response body.
+    :ivar str url: The (final) response url.
+    :ivar int status: The HTTP status code.
+    :ivar headers: The response headers (an :class:`email.message.Message`).
+    :ivar float mtime: The time the response was stored or revalidated.
+    :ivar bool fresh: Is the response younger than the cache's TTL.
+
+    """
+    def __init__(self, key, body, url, status, headers, mtime, fresh):
+        self.key = key
+        self.body = body
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.mtime = mtime
+        self.fresh = fresh
+
+    def open(self):
+        """
+        Return a file like object with the response body (and `headers`,
+        `url` and `code` like the responses of ``urlopen``).
+        """
+        return addinfourl(io.BytesIO(self.body), self.headers, self.url,
+                          self.status)
+
+
+class HTTPCache(object):
+    """
+    A cache of HTTP responses in the directory `path`.
+
+    :param int max_size: The budget (in bytes) for the stored bodies. The
+        least recently used responses are evicted when it is exceeded.
+    :param float ttl: Time (in seconds) after which a stored response
+        needs to be revalidated (``None`` to never expire).
+    :param bool compress: Compress the stored bodies.
+    :param float timeout: Time to wait for a lock on the index database.
+
+    The instances can be used from several threads and several
+    processes can use the same directory.
+
+    """
+    #: Format version of the index database.
+    FORMAT = 1
+
+    def __init__(self, path, max_size=None, ttl=None, compress=True,
+                 timeout=30.0):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.compress = compress
+        self.blobs = os.path.join(path, "blobs")
+        _makedirs(self.blobs)
+
+        self._lock = threading.RLock()
+        self.con = sqlite3.connect(os.path.join(path, "index.sqlite"),
+                                   timeout=timeout, isolation_level=None,
+                                   check_same_thread=False)
+        self._init_db()
+
+    def _init_db(self):
+        con = self.con
+        exists = con.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name='responses'"
+        ).fetchone()[0]
+        if not exists:
+            # WAL mode is persistent, but changing it needs an exclusive
+            # lock so only do it when the database is created.
+            con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                mtime REAL,
+                atime REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_atime
+                ON responses (atime);
+            CREATE INDEX IF NOT EXISTS responses_digest
+                ON responses (digest);
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER,
+                compressed INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            );
+            INSERT OR IGNORE INTO meta
+                SELECT 'size', coalesce(sum(size), 0) FROM blobs;
+        """)
+
+    @staticmethod
+    def _size(con):
+        return con.execute(
+            "SELECT value FROM meta WHERE name='size'").fetchone()[0]
+
+    @staticmethod
+    def _add_size(con, delta):
+        con.execute("UPDATE meta SET value=value+? WHERE name='size'",
+                    (delta,))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.con.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.con
+            except BaseException:
+                self.con.execute("ROLLBACK")
+                raise
+            else:
+                self.con.execute("COMMIT")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs, digest[:2], digest)
+
+    def _write_blob(self, digest, body):
+        # Return (size, compressed) of the stored blob
+        filename = self._blob_path(digest)
+        data, compressed = body, False
+        if self.compress and len(body) >= COMPRESS_MIN_SIZE:
+            packed = zlib.compress(body, 6)
+            if len(packed) < len(body):
+                data, compressed = packed, True
+        if not os.path.exists(filename):
+            dirname = os.path.dirname(filename)
+            _makedirs(dirname)
+            fd, tmpname = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                _replace(tmpname, filename)
+            except BaseException:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+                raise
+        return len(data), compressed
+
+    def _read_blob(self, digest, compressed):
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        return zlib.decompress(data) if compressed else data
+
+    def put(self, key, body, url=None, status=200, headers=None):
+        """
+        Store the response `body` (bytes) under `key`.
+        """
+        body = bytes(body)
+        digest = hashlib.sha1(body).hexdigest()
+        size, compressed = self._write_blob(digest, body)
+        headers = "" if headers is None else str(headers)
+        now = time.time()
+        with self._transaction() as con:
+            if con.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)",
+                           (digest, size, int(compressed))).rowcount:
+                self._add_size(con, size)
+            old = con.execute("SELECT digest FROM responses WHERE key=?",
+                              (key,)).fetchone()
+            con.execute(
+                "INSERT OR REPLACE INTO responses "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, digest, url, status, headers, now, now))
+            removed = [] if old is None else self._release(con, [old[0]])
+            total = self._size(con)
+        self._remove_blobs(removed)
+        if self.max_size is not None and total > self.max_size:
+            self.evict()
+
+    def lookup(self, key):
+        """
+        Return the :class:`CachedResponse` stored under `key` (also if it
+        is not fresh) or ``None``.
+        """
+        with self._lock:
+            row = self.con.execute("""
+                SELECT responses.digest, url, status, headers, mtime,
+                       blobs.compressed
+                FROM responses JOIN blobs USING (digest)
+                WHERE key=?""", (key,)).fetchone()
+            if row is None:
+                return None
+            digest, url, status, headers, mtime, compressed = row
+            body = self._read_blob(digest, compressed)
+            if body is None:
+                # evicted by another process
+                self.delete(key)
+                return None
+            self.con.execute("UPDATE responses SET atime=? WHERE key=?",
+                             (time.time(), key))
+        fresh = self.ttl is None or time.time() - mtime < self.ttl
+        return CachedResponse(key, body, url, status,
+                              email.message_from_string(headers or ""),
+                              mtime, fresh)
+
+    def get(self, key, default=None):
+        """
+        Return the body of the fresh response stored under `key` or
+        `default`.
+        """
+        entry = self.lookup(key)
+        return entry.body if entry is not None and entry.fresh else default
+
+    def urlopen(self, url, timeout=30, key=None, validate=None):
+        """
+        Open `url` and return the response as a file like object
+        (as returned by ``urlopen``).
+
+        A fresh cached response is returned without a request. A stale
+        one is revalidated with a conditional request (using its ETag
+        and Last-Modified headers) and reused if the server responds with
+        `304 Not Modified`. If the server can not be reached (or responds
+        with a server error) the stale response is returned with a
+        warning.
+
+        :param str key: The cache key (default: `url`).
+        :param validate: A function called with the response body before
+            it is stored. It should raise an exception if the response is
+            not valid (it is then not stored).
+
+        """
+        key = url if key is None else key
+        entry = self.lookup(key)
+        if entry is not None and entry.fresh:
+            return entry.open()
+
+        request = Request(url)
+        if entry is not None:
+            if entry.headers.get("ETag"):
+                request.add_header("If-None-Match", entry.headers["ETag"])
+            if entry.headers.get("Last-Modified"):
+                request.add_header("If-Modified-Since",
+                                   entry.headers["Last-Modified"])
+        try:
+            reply = urlopen(request, timeout=timeout)
+        except HTTPError as err:
+            if err.code == 304 and entry is not None:
+                with self._transaction() as con:
+                    con.execute("UPDATE responses SET mtime=? WHERE key=?",
+                                (time.time(), key))
+                return entry.open()
+            if err.code >= 500 and entry is not None:
+                return self._stale(entry, err)
+            raise
+        except (URLError, socket.error) as err:
+            if entry is not None:
+                return self._stale(entry, err)
+            raise
+
+        body = reply.read()
+        if validate is not None:
+            validate(body)
+        self.put(key, body, url=reply.geturl(), status=reply.getcode(),
+                 headers=reply.headers)
+        return addinfourl(io.BytesIO(body), reply.headers, reply.geturl(),
+                          reply.getcode())
+
+    def _stale(self, entry, err):
+        warnings.warn("Could not revalidate %s (%s); using the cached "
+                      "response" % (entry.url or entry.key, err),
+                      RuntimeWarning)
+        return entry.open()
+
+    def delete(self, key):
+        """
+        Remove the response stored under `key`.
+        """
+        with self._transaction() as con:
+            row = con.execute("SELECT digest FROM responses WHERE key=?",
+                              (key,)).fetchone()
+            removed = [] if row is None else self._release(con, [row[0]])
+            con.execute("DELETE FROM responses WHERE key=?", (key,))
+        self._remove_blobs(removed)
+
+    def _release(self, con, digests):
+        # Remove the blobs of `digests` which are no longer referenced
+        # and return their digests (the files are removed after commit).
+        removed = []
+        for digest in set(digests):
+            refs = con.execute("SELECT count(*) FROM responses WHERE digest=?",
+                               (digest,)).fetchone()[0]
+            if refs == 0:
+                size, = con.execute("SELECT size FROM blobs WHERE digest=?",
+                                    (digest,)).fetchone()
+                con.execute("DELETE FROM blobs WHERE digest=?", (digest,))
+                self._add_size(con, -size)
+                removed.append(digest)
+        return removed
+
+    def _remove_blobs(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def size(self):
+        """
+        Return the total size of the stored (compressed) bodies.
+        """
+        with self._lock:
+            return self._size(self.con)
+
+    def evict(self, max_size=None):
+        """
+        Remove the least recently used responses until the stored bodies
+        take at most 90% of `max_size` (default: :obj:`max_size`).
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return
+        removed = []
+        with self._transaction() as con:
+            total = self._size(con)
+            if total <= max_size:
+                return
+            target = 0.9 * max_size
+            rows = con.execute("""
+                SELECT key, digest, blobs.size
+                FROM responses JOIN blobs USING (digest)
+                ORDER BY atime""").fetchall()
+            for key, digest, size in rows:
+                if total <= target:
+                    break
+                con.execute("DELETE FROM responses WHERE key=?", (key,))
+                if self._release(con, [digest]):
+                    removed.append(digest)
+                    total -= size
+        self._remove_blobs(removed)
+
+    def clear(self):
+        """
+        Remove all the stored responses.
+        """
+        with self._transaction() as con:
+            digests = [d for d, in con.execute("SELECT digest FROM blobs")]
+            con.execute("DELETE FROM responses")
+            con.execute("DELETE FROM blobs")
+            con.execute("UPDATE meta SET value=0 WHERE name='size'")
+        self._remove_blobs(digests)
+
+    def close(self):
+        with self._lock:
+            self.con.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.con.execute(
+                "SELECT count(*) FROM responses").fetchone()[0]
+
+    def __contains__(self, key):
+        entry = self.lookup(key)
+        return entry is not None and entry.fresh
+
+    def __getitem__(self, key):
+        body = self.get(key)
+        if body is None:
+            raise KeyError(key)
+        return body
+
+    def __setitem__(self, key, body):
+        self.put(key, body)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared(path, **kwargs):
+    """
+    Return a :class:`HTTPCache` for `path` shared by all the callers in
+    this process (the `kwargs` are only used when it is first created).
+    """
+    path = os.path.abspath(path)
+    with _shared_lock:
+        cache = _shared.get(path)
+        # sqlite connections must not be used across a fork
+        if cache is None or cache[0] != os.getpid():
+            cache = _shared[path] = (os.getpid(), HTTPCache(path, **kwargs))
+        return cache[1]
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
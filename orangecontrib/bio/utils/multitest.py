@@ -0,0 +1,223 @@
+"""
+Multiple hypothesis testing corrections of arrays of p-values.
+
+All functions accept any array-like of p-values (of any shape) and
+return a :class:`numpy.ndarray` of the same shape. Missing (NaN)
+p-values are ignored and remain NaN in the output.
+
+"""
+from __future__ import absolute_import, division
+
+import numpy
+
+__all__ = ["harmonic", "fdr_bh", "fdr_by", "bonferroni", "holm",
+           "pi0_estimate", "qvalues"]
+
+#: Euler-Mascheroni constant
+EULER_GAMMA = 0.57721566490153286060651209008240243104215933593992
+
+_HARMONIC_TABLE_SIZE = 100000
+_harmonic_table = None
+
+
+def harmonic(m):
+    """
+    Return the `m`-th harmonic number (``sum(1 / i for i in 1..m)``).
+
+    Values up to 100000 are looked up in a table (computed on first
+    use), larger ones use an asymptotic expansion (with a relative error
+    below 1e-20).
+
+    :param m: A positive integer or an array of positive integers.
+    """
+    global _harmonic_table
+    m_arr = numpy.asarray(m)
+    if _harmonic_table is None:
+        _harmonic_table = numpy.cumsum(
+            1.0 / numpy.arange(1, _HARMONIC_TABLE_SIZE + 1))
+    small = m_arr <= _HARMONIC_TABLE_SIZE
+    mf = numpy.maximum(m_arr, 1).astype(float)
+    res = numpy.log(mf) + EULER_GAMMA + 1 / (2 * mf) - 1 / (12 * mf ** 2)
+    res = numpy.where(
+        small,
+        _harmonic_table[numpy.clip(m_arr, 1, _HARMONIC_TABLE_SIZE) - 1],
+        res)
+    res = numpy.where(m_arr <= 0, 0.0, res)
+    return float(res) if res.ndim == 0 else res
+
+
+def _prepare(p_values, m):
+    p = numpy.asarray(p_values, dtype=float)
+    flat = p.ravel()
+    valid = numpy.flatnonzero(~numpy.isnan(flat))
+    pv = flat[valid]
+    if m is None:
+        m = len(pv)
+    return p, valid, pv, m
+
+
+def _finish(p, valid, adjusted):
+    out = numpy.full(p.size, numpy.nan)
+    out[valid] = adjusted
+    return out.reshape(p.shape)
+
+
+def _step_up(pv, m, factor):
+    """
+    Step-up adjustment ``min_{j >= i} (factor * m * p_(j) / j)``
+    (in sorted order) clipped to 1.
+    """
+    n = len(pv)
+    if n == 0:
+        return pv
+    order = numpy.argsort(pv, kind="mergesort")
+    ranked = pv[order] * (factor * m) / numpy.arange(1, n + 1)
+    ranked = numpy.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = numpy.empty(n)
+    adjusted[order] = numpy.minimum(ranked, 1.0)
+    return adjusted
+
+
+def fdr_bh(p_values, m=None):
+    """
+    Benjamini-Hochberg `False Discovery Rate
+    <http://en.wikipedia.org/wiki/False_discovery_rate>`_ adjusted
+    p-values (for independent or positively correlated tests).
+
+    :param p_values: An array of p-values.
+    :param int m: The number of hypotheses tested (default: the number
+        of (non NaN) p-values).
+
+    """
+    p, valid, pv, m = _prepare(p_values, m)
+    return _finish(p, valid, _step_up(pv, m, 1.0))
+
+
+def fdr_by(p_values, m=None):
+    """
+    Benjamini-Yekutieli False Discovery Rate adjusted p-values (for
+    arbitrarily dependent tests).
+
+    :param p_values: An array of p-values.
+    :param int m: The number of hypotheses tested (default: the number
+        of (non NaN) p-values).
+
+    """
+    p, valid, pv, m = _prepare(p_values, m)
+    return _finish(p, valid, _step_up(pv, m, harmonic(m) if m else 1.0))
+
+
+def bonferroni(p_values, m=None):
+    """
+    `Bonferroni <http://en.wikipedia.org/wiki/Bonferroni_correction>`_
+    adjusted p-values (``min(m * p, 1)``).
+
+    :param p_values: An array of p-values.
+    :param int m: The number of hypotheses tested (default: the number
+        of (non NaN) p-values).
+
+    """
+    p, valid, pv, m = _prepare(p_values, m)
+    return _finish(p, valid, numpy.minimum(pv * m, 1.0))
+
+
+def holm(p_values, m=None):
+    """
+    Holm-Bonferroni (step-down) adjusted p-values.
+
+    :param p_values: An array of p-values.
+    :param int m: The number of hypotheses tested (default: the number
+        of (non NaN) p-values).
+
+    """
+    p, valid, pv, m = _prepare(p_values, m)
+    n = len(pv)
+    if n == 0:
+        return _finish(p, valid, pv)
+    order = numpy.argsort(pv, kind="mergesort")
+    ranked = pv[order] * (m - numpy.arange(n))
+    ranked = numpy.minimum(numpy.maximum.accumulate(ranked), 1.0)
+    adjusted = numpy.empty(n)
+    adjusted[order] = ranked
+    return _finish(p, valid, adjusted)
+
+
+def _loess_at(x, y, x0, frac):
+    """
+    Evaluate a local linear (tricube weighted) regression of `y` on `x`
+    using the `frac` nearest points at each of `x0`.
+    """
+    k = max(int(numpy.ceil(frac * len(x))), 2)
+    fit = numpy.empty(len(x0))
+    for i, xi in enumerate(x0):
+        dist = numpy.abs(x - xi)
+        ind = numpy.argsort(dist, kind="mergesort")[:k]
+        h = dist[ind[-1]] * 1.0000001 or 1.0
+        w = (1 - (dist[ind] / h) ** 3) ** 3
+        X = numpy.column_stack([numpy.ones(k), x[ind] - xi])
+        WX = X * w[:, None]
+        beta = numpy.linalg.lstsq(WX.T.dot(X), WX.T.dot(y[ind]), rcond=None)[0]
+        fit[i] = beta[0]
+    return fit
+
+
+def pi0_estimate(p_values, method="spline", lambdas=None):
+    """
+    Estimate the proportion of true null hypotheses `pi0` from p-values
+    (Storey and Tibshirani, 2003) by smoothing ``pi0(lambda) =
+    #{p > lambda} / (m * (1 - lambda))`` and evaluating the fit at
+    ``lambda = 1``.
+
+    :param p_values: An array of p-values.
+    :param str method: "spline" (a cubic smoothing spline) or "loess".
+    :param lambdas: The lambda values (default ``0, 0.01, ..., 0.95``
+        for "spline" and ``0, 0.01, ..., 0.99`` for "loess").
+
+    """
+    if method not in ("spline", "loess"):
+        raise ValueError("Unknown pi0 estimation method %r" % method)
+    pv = numpy.asarray(p_values, dtype=float).ravel()
+    pv = numpy.sort(pv[~numpy.isnan(pv)])
+    m = len(pv)
+    if m == 0:
+        return 1.0
+    if lambdas is None:
+        lambdas = numpy.arange(0, 0.96 if method == "spline" else 1.0, 0.01)
+    lambdas = numpy.asarray(lambdas, dtype=float)
+
+    def pi0_fit(lambdas, smoothing):
+        # number of p-values greater than each lambda
+        greater = m - numpy.searchsorted(pv, lambdas, side="right")
+        pi0_lambda = greater / (m * (1 - lambdas))
+        if method == "spline":
+            import scipy.interpolate
+            rep = scipy.interpolate.splrep(lambdas, pi0_lambda, k=3,
+                                           s=smoothing)
+            return float(scipy.interpolate.splev(1.0, rep, der=0))
+        else:
+            return float(_loess_at(lambdas, pi0_lambda, [1.0], 0.4)[0])
+
+    pi0 = pi0_fit(lambdas, 0.01)
+    # retry with smaller lambdas if the fit is not positive
+    while pi0 <= 0 and len(lambdas) > 5:
+        lambdas = lambdas[:-1]
+        pi0 = pi0_fit(lambdas, 0.1)
+    return min(pi0, 1.0) if pi0 > 0 else 1.0
+
+
+def qvalues(p_values, pi0=None, estimate_pi0=False):
+    """
+    Storey q-values (``pi0`` times the Benjamini-Hochberg adjusted
+    p-values).
+
+    :param p_values: An array of p-values.
+    :param float pi0: The proportion of true null hypotheses.
+    :param estimate_pi0: If `pi0` is not given, estimate it with
+        :func:`pi0_estimate` using this method ("spline" or "loess")
+        or use 1 if False.
+
+    """
+    if pi0 is None:
+        pi0 = pi0_estimate(p_values, estimate_pi0) if estimate_pi0 else 1.0
+    p, valid, pv, m = _prepare(p_values, None)
+    return _finish(p, valid, numpy.minimum(_step_up(pv, m, pi0), 1.0))
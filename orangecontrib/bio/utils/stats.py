@@ -2,6 +2,10 @@ import math
 import threading
 import six
 
+import numpy
+
+from . import multitest
+
 
 def _lngamma(z):
     x = 0
@@ -21,9 +25,13 @@ def _lngamma(z):
 class LogBin(object):
     _max = 2
     _lookup = [0.0, 0.0]
+    _lookup_array = numpy.zeros(2)
     _max_factorial = 1
     _lock = threading.Lock()
 
+    #: Max. number of distribution terms evaluated at once by `p_values`.
+    _chunk_size = 2 ** 20
+
     def __init__(self, max=1000):
         self._extend(max)
 
@@ -55,6 +63,72 @@ class LogBin(object):
         else:
             return _lngamma(n + 1)
 
+    @staticmethod
+    def _logfactorials(max):
+        """Return a numpy array of log(i!) for i in range(max)."""
+        if len(LogBin._lookup_array) < max:
+            LogBin._extend(max)
+            with LogBin._lock:
+                LogBin._lookup_array = numpy.array(LogBin._lookup)
+        return LogBin._lookup_array
+
+    def _logbins(self, n, k):
+        """Vectorized `_logbin` (requires 0 <= k <= n)."""
+        lookup = self._logfactorials(int(numpy.max(n, initial=0)) + 1)
+        return lookup[n] - lookup[n - k] - lookup[k]
+
+    def _tail_sums(self, lo, hi, logpmf):
+        """
+        Return sum(exp(logpmf(j, i)) for i in range(lo[j], hi[j] + 1))
+        for all j.
+
+        `logpmf` is called with arrays of element indices `j` and term
+        indices `i` for (a chunk of) all the terms at once.
+
+        """
+        width = numpy.clip(hi - lo + 1, 0, None)
+        sums = numpy.zeros(len(width))
+        nonempty = numpy.flatnonzero(width)
+        # split the elements into chunks of at most ~_chunk_size terms
+        total = numpy.cumsum(width[nonempty])
+        splits = numpy.searchsorted(
+            total, numpy.arange(self._chunk_size, total[-1] if len(total) else 0,
+                                self._chunk_size))
+        for elements in numpy.split(nonempty, numpy.unique(splits)):
+            if not len(elements):
+                continue
+            w = width[elements]
+            starts = numpy.cumsum(w) - w
+            j = numpy.repeat(elements, w)
+            i = lo[j] + numpy.arange(w.sum()) - numpy.repeat(starts, w)
+            terms = numpy.exp(logpmf(j, i))
+            sums[elements] = numpy.add.reduceat(terms, starts)
+        return numpy.minimum(sums, 1.0)
+
+
+def _as_int_arrays(*arrays):
+    arrays = numpy.broadcast_arrays(
+        *[numpy.asarray(a, dtype=numpy.int64) for a in arrays])
+    return arrays[0].shape, [a.ravel() for a in arrays]
+
+
+def p_values(prob, k, N, m, n):
+    """
+    Return an array of p-values for arrays of (`k`, `N`, `m`, `n`)
+    using `prob` (a :class:`Binomial` or :class:`Hypergeometric`
+    instance).
+
+    If `prob` does not define a vectorized `p_values` method then
+    `prob.p_value` is called for each element.
+
+    """
+    if hasattr(prob, "p_values"):
+        return prob.p_values(k, N, m, n)
+    shape, (k, N, m, n) = _as_int_arrays(k, N, m, n)
+    return numpy.array([prob.p_value(*map(int, args))
+                        for args in zip(k, N, m, n)],
+                       dtype=float).reshape(shape)
+
 class Binomial(LogBin):
     """ `Binomial distribution 
     <http://en.wikipedia.org/wiki/Binomial_distribution>`_ is a discrete
@@ -102,6 +176,29 @@ class Binomial(LogBin):
             else:
                 return value
 
+    def p_values(self, k, N, m, n):
+        """ Vectorized :func:`p_value`: return an array of probabilities
+        that k[i] or more tests are positive for all (broadcasted)
+        elements of array arguments `k`, `N`, `m` and `n`.
+        """
+        shape, (k, N, m, n) = _as_int_arrays(k, N, m, n)
+        p = m / N.astype(float)
+        # the p == 0 and p == 1 cases are handled separately below
+        inner = (p > 0.0) & (p < 1.0)
+        logp = numpy.log(numpy.where(inner, p, 0.5))
+        log1p = numpy.log(numpy.where(inner, 1.0 - p, 0.5))
+
+        def logpmf(j, i):
+            return (self._logbins(n[j], i) + i * logp[j] +
+                    (n[j] - i) * log1p[j])
+
+        res = self._tail_sums(numpy.where(inner, numpy.maximum(k, 0), 1),
+                              numpy.where(inner, n, 0), logpmf)
+        res[p <= 0.0] = 0.0
+        res[p >= 1.0] = (k <= n)[p >= 1.0]
+        res[k <= 0] = 1.0
+        return res.reshape(shape)
+
 class Hypergeometric(LogBin):
     """ `Hypergeometric distribution
     <http://en.wikipedia.org/wiki/Hypergeometric_distribution>`_ is
@@ -144,10 +241,21 @@ class Hypergeometric(LogBin):
             else:
                 return value
 
-## to speed-up FDR, calculate ahead sum([1/i for i in range(1, m+1)]), for m in [1,100000]. For higher values of m use an approximation, with error less or equal to 4.99999157277e-006. (sum([1/i for i in range(1, m+1)])  ~ log(m) + 0.5772..., 0.5572 is an Euler-Mascheroni constant) 
-c = [1.0]
-for m in range(2, 100000):
-    c.append( c[-1] + 1.0/m)
+    def p_values(self, k, N, m, n):
+        """ Vectorized :func:`p_value`: return an array of probabilities
+        that k[i] or more tests are positive for all (broadcasted)
+        elements of array arguments `k`, `N`, `m` and `n`.
+        """
+        shape, (k, N, m, n) = _as_int_arrays(k, N, m, n)
+
+        def logpmf(j, i):
+            return (self._logbins(m[j], i) + self._logbins(N[j] - m[j], n[j] - i) -
+                    self._logbins(N[j], n[j]))
+
+        lo = numpy.maximum(k, numpy.maximum(0, n + m - N))
+        res = self._tail_sums(lo, numpy.minimum(n, m), logpmf)
+        res[k <= 0] = 1.0
+        return res.reshape(shape)
 
 def is_sorted(l):
     return all(l[i] <= l[i+1] for i in range(len(l)-1))
@@ -159,42 +267,19 @@ def FDR(p_values, dependent=False, m=None, ordered=False):
     :param p_values: a list of p-values.
     :param dependent: use correction for dependent hypotheses (default False).
     :param m: number of hypotheses tested (default ``len(p_values)``).
-    :param ordered: prevent sorting of p-values if they are already sorted (default False).
-    """
-
-    if not ordered:
-        ordered = is_sorted(p_values)
-
-    if not ordered:
-        joined = [ (v,i) for i,v in enumerate(p_values) ]
-        joined.sort()
-        p_values = [ p[0] for p in joined ]
-        indices = [ p[1] for p in joined ]
+    :param ordered: unused, kept for compatibility.
 
+    .. seealso:: :func:`.multitest.fdr_bh` and :func:`.multitest.fdr_by`
+        for array inputs.
+    """
     if not m:
         m = len(p_values)
-    if m <= 0 or not p_values:
+    if m <= 0 or not len(p_values):
         return []
-
-    if dependent: # correct q for dependent tests
-        k = c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
-        m = m * k
-
-    tmp_fdrs = [p*m/(i+1.0) for (i, p) in enumerate(p_values)]
-    fdrs = []
-    cmin = tmp_fdrs[-1]
-    for f in reversed(tmp_fdrs):
-        cmin = min(f, cmin)
-        fdrs.append( cmin)
-    fdrs.reverse()
-
-    if not ordered:
-        new = [ None ] * len(fdrs)
-        for v,i in zip(fdrs, indices):
-            new[i] = v
-        fdrs = new
-
-    return fdrs
+    if dependent:
+        return multitest.fdr_by(p_values, m).tolist()
+    else:
+        return multitest.fdr_bh(p_values, m).tolist()
 
 def Bonferroni(p_values, m=None):
     """
@@ -207,5 +292,4 @@ def Bonferroni(p_values, m=None):
         m = len(p_values)
     if m == 0:
         return []
-    m = float(m)
-    return [p/m for p in p_values]
+    return multitest.bonferroni(p_values, m).tolist()
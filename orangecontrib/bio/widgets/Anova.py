@@ -7,9 +7,11 @@ import math
 import numpy.oldnumeric as Numeric, numpy.oldnumeric.ma as MA
 import numpy.oldnumeric.linear_algebra as LinearAlgebra
 
+import numpy
 import scipy.stats
 
 from . import numpyExtn
+from ..utils import multitest
 
 #######################################################################################
 ## ANOVA based on Multivariate Linear Regression
@@ -1280,63 +1282,22 @@ def qVals(pVals, estimatePi0=False, verbose=False):
                           "loess": loess fit on pi0(lambda) curve, estimate at lambda=1
     Reference:  Storey et al. (2003) Statistical significance for genomewide studies.
                 PNAS 100(16), pp. 9440-5.
-    Changes: loess fit instead of cubic spline
-    Added:  handles missing values -> it compresses it out
-            lambda values depend on pValues:
-                min(pVals) <= lmbd < max(pVals)
-                len(lmbd) == len(pVals)
-    TODO: remove calculation of flmbd in all points except for lmbd=1
+    Handles missing values (they remain masked in the result).
+    See also: orangecontrib.bio.utils.multitest.qvalues
     """
     assert estimatePi0 in [False, "spline", "loess"]
     pValsMA = MA.asarray(pVals)
-    qVals = MA.ones(pValsMA.shape, Numeric.Float) * MA.masked
-    putInd = Numeric.compress(Numeric.logical_not(MA.getmaskarray(pValsMA)), Numeric.arange(pValsMA.shape[0]))
-    pValsMA = pValsMA.compressed()
-    minp = min(pValsMA); maxp = max(pValsMA)
-    m = pValsMA.shape[0]
-    x = Numeric.arange(0,1.01,0.01)
-    if estimatePi0 == "spline":
-        import scipy.interpolate
-        lmbd = Numeric.arange(0,0.96,0.01,Numeric.Float)
-        pi0lmbd = map(lambda l: Numeric.add.reduce(Numeric.greater(pValsMA,l)) / (m*(1-l)), lmbd)
-        splineRep = scipy.interpolate.splrep(lmbd, pi0lmbd, k=3, s=0.01)   # spline representation: (knots, coefficeints, degree)
-        flmbd = scipy.interpolate.splev(x, splineRep, der=0)
-        pi0 = flmbd[-1]
-        if pi0 <= 0:
-            print "Warning: pi0<=0, trying smaller lambda..."
-            while pi0 <= 0:
-                lmbd = lmbd[:-1]
-                pi0lmbd = map(lambda l: Numeric.add.reduce(Numeric.greater(pValsMA,l)) / (m*(1-l)), lmbd)
-                splineRep = scipy.interpolate.splrep(lmbd, pi0lmbd, k=3, s=0.1)   # spline representation: (knots, coefficeints, degree)
-                flmbd = scipy.interpolate.splev(x, splineRep, der=0)
-                pi0 = flmbd[-1]
-    elif estimatePi0 == "loess":
-        lmbd = Numeric.arange(0,1.0,0.01,Numeric.Float)
-        pi0lmbd = map(lambda l: Numeric.add.reduce(Numeric.greater(pValsMA,l)) / (m*(1-l)), lmbd)
-        flmbd = Numeric.asarray(statc.loess(zip(lmbd, pi0lmbd), list(x), 0.4))[:,1]
-        pi0 = flmbd[-1]
-        if pi0 <= 0:
-            print "Warning: pi0<=0, trying smaller lambda..."
-            while pi0 <= 0:
-                lmbd = lmbd[:-1]
-                pi0lmbd = map(lambda l: Numeric.add.reduce(Numeric.greater(pValsMA,l)) / (m*(1-l)), lmbd)
-                flmbd = Numeric.asarray(statc.loess(zip(lmbd, pi0lmbd), list(x), 0.4))[:,1]
-                pi0 = flmbd[-1]
+    mask = MA.getmaskarray(pValsMA)
+    p = numpy.asarray(MA.filled(pValsMA, 0), dtype=float)
+    p[numpy.asarray(mask, dtype=bool)] = numpy.nan
+    if estimatePi0:
+        pi0 = multitest.pi0_estimate(p, estimatePi0)
+        if verbose:
+            print("pi0: %.4f" % pi0)
     else:
-        pi0=1
-    if verbose and estimatePi0:
-        M.plot(lmbd, pi0lmbd)
-        M.plot(x,flmbd)
-        M.legend(["pi0(lambda", "fit, len(lmbd)==%i"%len(lmbd)])
-        M.title("pi0: %.4f"%pi0)
-        M.show()
-    args = Numeric.argsort(pValsMA)
-    q = Numeric.ones(pValsMA.shape, Numeric.Float)
-    q[args[m-1]] = pi0 * pValsMA[args[m-1]]
-    for i in range(m-1, 0, -1):
-        q[args[i-1]] = min(pi0*m*pValsMA[args[i-1]]/i, q[args[i]])
-    MA.put(qVals, putInd, q)
-    return qVals
+        pi0 = 1.0
+    q = multitest.qvalues(p, pi0=pi0)
+    return MA.masked_array(numpy.nan_to_num(q), mask=mask)
 
 
 
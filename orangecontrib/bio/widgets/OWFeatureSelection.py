@@ -43,6 +43,8 @@ class ExpressionSignificance_TTest_PValue(ExpressionSignificance_TTest):
         return [(key, pval) for key, (t, pval) in \
                 ExpressionSignificance_TTest.__call__(self, *args, **kwargs)]
 
+    _null_p_values = True
+
 
 class ExpressionSignificance_TTest_T(ExpressionSignificance_TTest):
     def __call__(self, *args, **kwargs):
@@ -55,6 +57,8 @@ class ExpressionSignificance_ANOVA_PValue(ExpressionSignificance_ANOVA):
         return [(key, pval) for key, (t, pval) in \
                 ExpressionSignificance_ANOVA.__call__(self, *args, **kwargs)]
 
+    _null_p_values = True
+
 
 class ExpressionSignificance_ANOVA_F(ExpressionSignificance_ANOVA):
     def __call__(self, *args, **kwargs):
@@ -67,6 +71,10 @@ class ExpressionSignificance_Log2FoldChange(ExpressionSignificance_FoldChange):
         return [(key, math.log(fold, 2.0) if fold > 1e-300 and fold < 1e300 else 0.0) \
                 for key, fold in ExpressionSignificance_FoldChange.__call__(self, *args, **kwargs)]
 
+    def _null_value(self, fold):
+        valid = (fold > 1e-300) & (fold < 1e300)
+        return np.where(valid, np.log2(np.where(valid, fold, 1.0)), 0.0)
+
 
 class ExpressionSignigicance_MannWhitneyu_U(ExpressionSignificance_MannWhitneyu):
     def __call__(self, *args, **kwargs):
@@ -372,8 +380,8 @@ class OWFeatureSelection(OWWidget):
     def compute_null_distribution(self, data, score_func, use_attributes,
                                   target=None, perm_count=10, advance=lambda: None):
         score_func = score_func(data, use_attributes)
-        dist = score_func.null_distribution(perm_count, target, advance=advance)
-        return [score for run in dist for k, score in run if score is not ma.masked]
+        dist = score_func.null_statistics(perm_count, target, advance=advance)
+        return dist[~np.isnan(dist)].tolist()
             
     @disable_controls
     def update_scores(self):
@@ -676,17 +676,20 @@ class OWGOEnrichmentAnalysis(OWWidget):
         
         self.treeStructRootKey = None
         
+        closure = self.ontology.closure_index()
         parents = {}
         for id in ids:
-            parents[id] = set([term for typeId, term in self.ontology[id].related])
+            parents[id] = closure.parents(self.ontology[id].id)
             
-        children = {}
-        for term in self.terms:
-            children[term] = set([id for id in ids if term in parents[id]])
+        children = dict((term, set()) for term in ids)
+        for id in ids:
+            for term in parents[id]:
+                if term in children:
+                    children[term].add(id)
             
         for term in self.terms:
             self.treeStructDict[term] = TreeNode(self.terms[term], children[term])
-            if not self.ontology[term].related and not getattr(self.ontology[term], "is_obsolete", False):
+            if not parents[term] and not getattr(self.ontology[term], "is_obsolete", False):
                 self.treeStructRootKey = term
         return terms
         
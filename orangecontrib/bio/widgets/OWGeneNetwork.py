@@ -380,6 +380,17 @@ def get_gene_network(ppidb, geneinfo, taxid, query_genes,
     return net
 
 
+def ppidb_edges(ppidb):
+    """
+    Return a function returning all edges of a ppidb id, using the
+    in-memory graph of the database if available.
+    """
+    try:
+        return ppidb.graph().edges
+    except NotImplementedError:
+        return ppidb.edges
+
+
 def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
                     min_score=None, progress=None):
     """
@@ -392,6 +403,8 @@ def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
     if not isinstance(query, dict):
         query = {name: name for name in query}
 
+    edges = ppidb_edges(ppidb)
+
     report_weights = True
     if isinstance(ppidb, ppi.BioGRID):
         # BioGRID scores are not comparable (they can be p values,
@@ -439,7 +452,7 @@ def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
 
     if include_neighborhood:
         # extend the set of nodes in the network with immediate neighborers
-        edges_iter = (edge for key in query for edge in ppidb.edges(key))
+        edges_iter = (edge for key in query for edge in edges(key))
         for id1, id2, score in edges_iter:
             if min_score is None or score >= min_score:
                 nodeid1 = nodeids[id1]
@@ -467,7 +480,7 @@ def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
         if progress is not None:
             progress(100.0 * i / len(nodeids))
 
-        for _, id2, score in ppidb.edges(id1):
+        for _, id2, score in edges(id1):
             if id2 in nodeids and (min_score is None or score >= min_score):
                 nodeid1 = nodeids[id1]
                 nodeid2 = nodeids[id2]
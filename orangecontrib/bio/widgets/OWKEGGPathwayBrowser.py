@@ -13,6 +13,8 @@ import webbrowser
 from operator import add, itemgetter
 from contextlib import contextmanager
 
+import numpy
+
 from PyQt4.QtGui import (
     QTreeWidget, QTreeWidgetItem, QItemSelectionModel, QSplitter,
     QAction, QMenu, QGraphicsView, QGraphicsScene, QFont,
@@ -27,7 +29,6 @@ from PyQt4.QtCore import (
 
 import Orange
 
-from orangecontrib.bio.utils import serverfiles
 from Orange.orng.orngDataCaching import data_hints
 
 from Orange.OrangeWidgets import OWGUI
@@ -38,7 +39,6 @@ from Orange.OrangeWidgets.OWConcurrent import \
 
 
 from .. import kegg
-from .. import geneset
 
 
 NAME = "KEGG Pathways"
@@ -734,27 +734,11 @@ class OWKEGGPathwayBrowser(OWWidget):
             unique_genes, _, _ = org.get_unique_gene_ids(set(genes))
             unique_ref_genes, _, _ = org.get_unique_gene_ids(set(reference))
 
-            taxid = kegg.to_taxid(org.org_code)
-            # Map the taxid back to standard 'common' taxids
-            # (as used by 'geneset') if applicable
-            r_tax_map = dict((v, k) for k, v in
-                             kegg.KEGGGenome.TAXID_MAP.items())
-            if taxid in r_tax_map:
-                taxid = r_tax_map[taxid]
-
-            # We use the kegg pathway gene sets provided by 'geneset' for
-            # the enrichment calculation.
-
-            # Ensure we are using the latest genesets
-            # TODO: ?? Is updating the index enough?
-            serverfiles.update(geneset.sfdomain, "index.pck")
-            kegg_gs_collections = geneset.collections(
-                (("KEGG", "pathways"), taxid)
-            )
+            # Enrichment of all the pathways at once (from the
+            # organism's pathway index)
+            index = org.pathway_index(callback=progress)
             pathways = pathway_enrichment(
-                kegg_gs_collections, unique_genes.keys(),
-                unique_ref_genes.keys(),
-                callback=progress
+                index, unique_genes.keys(), unique_ref_genes.keys()
             )
             # Ensure that pathway entries are pre-cached for later use in the
             # list/tree view
@@ -931,31 +915,27 @@ class OWKEGGPathwayBrowser(OWWidget):
 from ..utils import stats
 
 
-def pathway_enrichment(genesets, genes, reference, prob=None, callback=None):
-    result_sets = []
-    p_values = []
+def pathway_enrichment(index, genes, reference, prob=None):
+    """
+    Return a dictionary of (genes, FDR, number of reference genes) of all
+    pathways in `index` (a :class:`kegg.pathway.PathwayIndex`) with any
+    of `genes`. The p-values of all pathways are computed at once with
+    :func:`kegg.pathway.PathwayIndex.enrichment`.
+    """
     if prob is None:
         prob = stats.Hypergeometric()
 
-    for i, gs in enumerate(genesets):
-        cluster = gs.genes.intersection(genes)
-        ref = gs.genes.intersection(reference)
-        k = len(cluster)
-        N = len(reference)
-        m = len(ref)
-        n = len(genes)
-        if k:
-            p_val = prob.p_value(k, N, m, n)
-            result_sets.append((gs.id, cluster, ref))
-            p_values.append(p_val)
-        if callback is not None:
-            callback(100.0 * i / len(genesets))
+    genes = set(genes)
+    counts, ref_counts, p_values = index.enrichment(genes, reference, prob)
+    hits = numpy.flatnonzero(counts)
 
     # FDR correction
-    p_values = stats.FDR(p_values)
+    p_values = stats.FDR(p_values[hits].tolist())
 
-    return dict([(id, (genes, p_val, len(ref)))
-                 for (id, genes, ref), p_val in zip(result_sets, p_values)])
+    return dict([(index.pathways[i],
+                  (genes.intersection(index.pathway_genes(index.pathways[i])),
+                   p_val, int(ref_counts[i])))
+                 for i, p_val in zip(hits, p_values)])
 
 
 @contextmanager
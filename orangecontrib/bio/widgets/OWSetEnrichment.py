@@ -463,7 +463,8 @@ class OWSetEnrichment(OWWidget):
 
         cmapped = genes.intersection(cluster)
         rmapped = genes.intersection(reference)
-        return (cmapped, rmapped, pval.p_value(len(cmapped), len(reference), len(rmapped), len(cluster)), float(len(cmapped)) / (len(cluster) or 1) / (float(len(rmapped) or 1) / (len(reference) or 1))) # TODO: compute all statistics here
+        p_val = pval.p_value(len(cmapped), len(reference), len(rmapped), len(cluster)) if pval is not None else None
+        return (cmapped, rmapped, p_val, float(len(cmapped)) / (len(cluster) or 1) / (float(len(rmapped) or 1) / (len(reference) or 1))) # TODO: compute all statistics here
 
     def updateAnnotations(self):
         if not self.taxid_list:
@@ -524,10 +525,19 @@ class OWSetEnrichment(OWWidget):
 
         milestones = progressBarMilestones(len(collections), 100)
         for i, geneset in enumerate(collections):
-            results.append((geneset, self.enrichment(geneset, clusterGenes, referenceGenes, cache=cache)))
+            results.append((geneset, self.enrichment(geneset, clusterGenes, referenceGenes, pval=None, cache=cache)))
             if i in milestones:
                 self.progressBarSet(100.0 * i / len(collections))
 
+        # compute the p-values for all sets at once
+        p_vals = obiProb.p_values(obiProb.Hypergeometric(),
+                                  [len(cm) for _, (cm, _, _, _) in results],
+                                  len(referenceGenes),
+                                  [len(rm) for _, (_, rm, _, _) in results],
+                                  len(clusterGenes))
+        results = [(geneset, (cm, rm, float(p_val), enrichment))
+                   for (geneset, (cm, rm, _, enrichment)), p_val in zip(results, p_vals)]
+
         self.annotationsChartView.clear()
 
         maxCount = max([len(cm) for _, (cm, _, _, _) in results] + [1])
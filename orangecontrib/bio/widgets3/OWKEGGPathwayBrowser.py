@@ -33,11 +33,8 @@ from Orange.widgets import widget, gui, settings
 from Orange.widgets.utils import itemmodels, concurrent
 
 from .. import kegg
-from .. import geneset
 from ..utils import stats
 
-from .OWMapManOntology import relation_list_to_multimap
-
 
 def split_and_strip(string, sep=None):
     return [s.strip() for s in string.split(sep)]
@@ -664,25 +661,11 @@ class OWKEGGPathwayBrowser(widget.OWWidget):
             unique_genes, _, _ = org.get_unique_gene_ids(set(genes))
             unique_ref_genes, _, _ = org.get_unique_gene_ids(set(reference))
 
-            taxid = kegg.to_taxid(org.org_code)
-            # Map the taxid back to standard 'common' taxids
-            # (as used by 'geneset') if applicable
-            r_tax_map = dict((v, k) for k, v in
-                             kegg.KEGGGenome.TAXID_MAP.items())
-            if taxid in r_tax_map:
-                taxid = r_tax_map[taxid]
-
-            # We use the kegg pathway gene sets provided by 'geneset' for
-            # the enrichment calculation.
-
-            kegg_api = kegg.api.CachedKeggApi()
-            linkmap = kegg_api.link(org.org_code, "pathway")
-            kegg_sets = relation_list_to_multimap(linkmap)
-            kegg_sets = geneset.GeneSets(input=kegg_sets)
+            # Enrichment of all the pathways at once (from the
+            # organism's pathway index)
+            index = org.pathway_index(callback=progress)
             pathways = pathway_enrichment(
-                kegg_sets, unique_genes.keys(),
-                unique_ref_genes.keys(),
-                callback=progress
+                index, unique_genes.keys(), unique_ref_genes.keys()
             )
             # Ensure that pathway entries are pre-cached for later use in the
             # list/tree view
@@ -849,31 +832,27 @@ class OWKEGGPathwayBrowser(widget.OWWidget):
         return QSize(1024, 720)
 
 
-def pathway_enrichment(genesets, genes, reference, prob=None, callback=None):
-    result_sets = []
-    p_values = []
+def pathway_enrichment(index, genes, reference, prob=None):
+    """
+    Return a dictionary of (genes, FDR, number of reference genes) of all
+    pathways in `index` (a :class:`kegg.pathway.PathwayIndex`) with any
+    of `genes`. The p-values of all pathways are computed at once with
+    :func:`kegg.pathway.PathwayIndex.enrichment`.
+    """
     if prob is None:
         prob = stats.Hypergeometric()
 
-    for i, gs in enumerate(genesets):
-        cluster = gs.genes.intersection(genes)
-        ref = gs.genes.intersection(reference)
-        k = len(cluster)
-        N = len(reference)
-        m = len(ref)
-        n = len(genes)
-        if k:
-            p_val = prob.p_value(k, N, m, n)
-            result_sets.append((gs.id, cluster, ref))
-            p_values.append(p_val)
-        if callback is not None:
-            callback(100.0 * i / len(genesets))
+    genes = set(genes)
+    counts, ref_counts, p_values = index.enrichment(genes, reference, prob)
+    hits = numpy.flatnonzero(counts)
 
     # FDR correction
-    p_values = stats.FDR(p_values)
+    p_values = stats.FDR(p_values[hits].tolist())
 
-    return dict([(id, (genes, p_val, len(ref)))
-                 for (id, genes, ref), p_val in zip(result_sets, p_values)])
+    return dict([(index.pathways[i],
+                  (genes.intersection(index.pathway_genes(index.pathways[i])),
+                   p_val, int(ref_counts[i])))
+                 for i, p_val in zip(hits, p_values)])
 
 
 @contextmanager
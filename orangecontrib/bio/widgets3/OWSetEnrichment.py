@@ -121,6 +121,17 @@ def fulfill(value):
     return f
 
 
+def umatch_names(match, names):
+    """
+    Return a list of unique target matches of `names` (`None` for names
+    without a unique match) using a single batch call.
+    """
+    names = list(names)
+    indices, unmatched = match.umatch_many(names)
+    return [None if um else match.targets[i]
+            for i, um in zip(indices.tolist(), unmatched)]
+
+
 def withtraceback(func):
     def f(*args, **kwargs):
         try:
@@ -677,8 +688,9 @@ class OWSetEnrichment(widget.OWWidget):
 
         def map_unames():
             matcher = namematcher.result()
-            query = list(filter(None, map(matcher.umatch, querynames)))
-            reference = list(filter(None, map(matcher.umatch, ref_set.result())))
+            query = list(filter(None, umatch_names(matcher, querynames)))
+            reference = list(filter(None,
+                                    umatch_names(matcher, ref_set.result())))
             return query, reference
 
         if self._nogenematching():
@@ -715,13 +727,16 @@ class OWSetEnrichment(widget.OWWidget):
             query, reference = map_unames()
             gscollections = collections.result()
 
-            results = []
+            targets = []
             info("Running enrichment")
             p = 0
+            allgenes = list(reduce(operator.ior,
+                                   (set(g.genes) for g in gscollections),
+                                   set()))
+            mapped = dict(zip(allgenes, umatch_names(match, allgenes)))
             for i, gset in enumerate(gscollections):
-                genes = set(filter(None, map(match.umatch, gset.genes)))
-                enr = set_enrichment(genes, reference, query)
-                results.append((gset, enr))
+                targets.append(
+                    set(filter(None, map(mapped.get, gset.genes))))
 
                 if state.cancelled:
                     raise UserInteruptException
@@ -730,6 +745,8 @@ class OWSetEnrichment(widget.OWWidget):
                 if pnew != p:
                     progress(pnew)
                     p = pnew
+            results = list(zip(gscollections,
+                               set_enrichment_many(targets, reference, query)))
             progress(100)
             info("")
             return query, reference, results
@@ -1122,6 +1139,39 @@ def set_enrichment(target, reference, query,
     )
 
 
+def set_enrichment_many(targets, reference, query,
+                        prob=utils.stats.Hypergeometric()):
+    """
+    Like :func:`set_enrichment` but for a list of target sets. The p-values
+    for all the targets are computed at once.
+
+    :param list targets: a list of target sets
+    :param set query: query set
+    :param set reference: the reference set
+
+    """
+    assert len(reference) > 0
+    query, reference = set(query), set(reference)
+    mapped = [(target.intersection(query), target.intersection(reference))
+              for target in targets]
+    p_values = utils.stats.p_values(
+        prob, [len(query_mapped) for query_mapped, _ in mapped],
+        len(reference),
+        [len(reference_mapped) for _, reference_mapped in mapped],
+        len(query))
+
+    results = []
+    for (query_mapped, reference_mapped), p_value in zip(mapped, p_values):
+        query_p = len(query_mapped) / len(query) if query else np.nan
+        ref_p = len(reference_mapped) / len(reference)
+        enrichment = query_p / ref_p if ref_p else np.nan
+        results.append(
+            enrichment_res(list(query_mapped), list(reference_mapped),
+                           float(p_value), enrichment)
+        )
+    return results
+
+
 def main(argv=None):
     app = QApplication(argv or [])
     argv = app.arguments()
@@ -0,0 +1,119 @@
+"""
+Benchmark the STRING database import on a synthetic STRING-format
+flat file and report the throughput in rows/sec.
+
+    python scripts/benchmark_string_import.py [n_proteins] [n_links]
+"""
+from __future__ import print_function
+
+import csv
+import gzip
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from orangecontrib.bio import ppi
+
+
+def write_flatfile(filename, header, rows, sep):
+    with gzip.open(filename, "wb") as f:
+        f.write((sep.join(header) + "\n").encode("utf-8"))
+        for row in rows:
+            f.write((sep.join(row) + "\n").encode("utf-8"))
+
+
+def synthetic(path, n_proteins, n_links, seed=0):
+    rand = random.Random(seed)
+    proteins = ["9606.ENSP%011i" % i for i in range(n_proteins)]
+
+    def links():
+        for _ in range(n_links):
+            p1, p2 = rand.sample(proteins, 2)
+            yield p1, p2, str(rand.randint(150, 999))
+
+    def actions():
+        for p1, p2, score in links():
+            yield p1, p2, "binding", "", "0", score
+
+    def aliases():
+        for i, protein in enumerate(proteins):
+            yield protein, "GENE%i" % i, "Ensembl_HGNC"
+
+    filenames = [os.path.join(path, name) for name in
+                 ["links.txt.gz", "actions.txt.gz", "aliases.txt.gz"]]
+    write_flatfile(filenames[0], ["protein1", "protein2", "combined_score"],
+                   links(), " ")
+    write_flatfile(filenames[1], ["item_id_a", "item_id_b", "mode", "action",
+                                  "a_is_acting", "score"],
+                   actions(), "\t")
+    write_flatfile(filenames[2], ["string_protein_id", "alias", "source"],
+                   aliases(), "\t")
+    return filenames
+
+
+def baseline_import(dbfilename, links, actions, aliases):
+    """
+    The row by row csv import (as previously done by STRING.init_db).
+    """
+    con = sqlite3.connect(dbfilename)
+    with con:
+        ppi.STRING.clear_db(con)
+
+        def read(filename, delimiter):
+            f = gzip.open(filename, "rt")
+            f.readline()
+            return csv.reader(f, delimiter=delimiter)
+
+        con.executemany("INSERT INTO links VALUES (?, ?, ?)",
+                        ((p1, p2, int(score))
+                         for p1, p2, score in read(links, " ")))
+        con.create_function("part", 3, lambda s, sep, i: s.split(sep)[i])
+        con.execute("""
+            INSERT INTO proteins
+            SELECT protein_id1, part(protein_id1, '.', 0)
+            FROM (SELECT DISTINCT(protein_id1)
+                  FROM links
+                  ORDER BY protein_id1)
+        """)
+        con.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
+                        ((p1, p2, mode, action, int(score))
+                         for p1, p2, mode, action, _, score
+                         in read(actions, "\t")))
+        con.executemany("INSERT INTO aliases VALUES (?, ?, ?)",
+                        read(aliases, "\t"))
+        ppi.STRING.create_db_index(con)
+    con.close()
+
+
+def streaming_import(dbfilename, links, actions, aliases):
+    ppi.STRING.import_db("benchmark", dbfilename, links, actions, aliases)
+
+
+def main(argv):
+    n_proteins = int(argv[1]) if len(argv) > 1 else 20000
+    n_links = int(argv[2]) if len(argv) > 2 else 1000000
+    n_rows = 2 * n_links + n_proteins
+
+    path = tempfile.mkdtemp()
+    try:
+        files = synthetic(path, n_proteins, n_links)
+        print("{} proteins, {} links, {} rows in total"
+              .format(n_proteins, n_links, n_rows))
+        for name, func in [("baseline", baseline_import),
+                           ("streaming", streaming_import)]:
+            dbfilename = os.path.join(path, name + ".sqlite")
+            start = time.time()
+            func(dbfilename, *files)
+            elapsed = time.time() - start
+            print("{:10} {:8.2f} s {:12.0f} rows/sec"
+                  .format(name, elapsed, n_rows / elapsed))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
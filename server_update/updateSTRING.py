@@ -1,6 +1,7 @@
 """ update string database """
 import re
 import gzip
+import multiprocessing
 
 from server_update import *
 from server_update.tests.test_STRING import StringTest
@@ -26,6 +27,7 @@ def get_version():
 version = get_version()
 version_id = 'dbversion:{}'.format(version)
 force = False  # force update
+processes = min(4, multiprocessing.cpu_count())  # parallel per taxid builds
 
 taxids = ppi.STRING.common_taxids()
 desc = "STRING Protein interactions for {name} (Creative Commons Attribution 3.0 License)"
@@ -37,7 +39,17 @@ desc = "STRING Protein interactions for {name} (Creative Commons Attribution 3.0
 exclude = ['272634', '5476']
 taxids = [idtax for idtax in taxids if idtax not in exclude]
 
-for taxid in taxids:
+
+def outdated(dbfilename):
+    basename = os.path.basename(dbfilename)
+    return force or version_id not in sf_server.info("PPI", basename)["tags"]
+
+
+pending = [taxid for taxid in taxids
+           if outdated(ppi.STRING.default_db_filename(taxid))]
+ppi.STRING.download_data(version, pending, cache_dir=downloads, processes=processes)
+
+for taxid in pending:
     dbfilename = ppi.STRING.default_db_filename(taxid)
     basename = os.path.basename(dbfilename)
 
@@ -45,11 +57,6 @@ for taxid in taxids:
     TAGS = ["protein interaction", "STRING"]
     VERSION = ppi.STRING.VERSION
 
-    if not force and version_id in sf_server.info("PPI", basename)["tags"]:
-        continue
-
-    ppi.STRING.init_db(version, taxid, dbfilename=dbfilename, cache_dir=downloads)
-
     gzfile = gzip.GzipFile(os.path.join(temp_path, basename), "wb")
     shutil.copyfileobj(open(dbfilename, "rb"), gzfile)
     gzfile.close()
@@ -61,22 +68,24 @@ for taxid in taxids:
 desc_detailed = "STRING Protein interactions for {name} (Creative Commons Attribution-Noncommercial-Share Alike 3.0 License)"
 
 
-for taxid in taxids:
-    print(taxid)
-    dbfilename = sf_local.localpath(
+def detailed_db_filename(taxid):
+    return sf_local.localpath(
         ppi.STRINGDetailed.DOMAIN,
         ppi.STRINGDetailed.FILENAME_DETAILED.format(taxid=taxid)
     )
+
+
+pending = [taxid for taxid in taxids if outdated(detailed_db_filename(taxid))]
+ppi.STRINGDetailed.download_data(version, pending, cache_dir=downloads, processes=processes)
+
+for taxid in pending:
+    dbfilename = detailed_db_filename(taxid)
     basename = os.path.basename(dbfilename)
 
     TITLE = desc_detailed.format(name=taxonomy.name(taxid))
     TAGS = ["protein interaction", "STRING"]
     VERSION = ppi.STRING.VERSION
 
-    if not force and version_id in sf_server.info("PPI", basename)["tags"]:
-        continue
-
-    ppi.STRINGDetailed.init_db(version, taxid, dbfilename=dbfilename, cache_dir=downloads)
     gzfile = gzip.GzipFile(os.path.join(temp_path, basename), "wb")  # gzip the database
     shutil.copyfileobj(open(dbfilename, "rb"), gzfile)
     gzfile.close()